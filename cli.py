@@ -0,0 +1,447 @@
+import sys
+import os
+import csv
+import json
+import argparse
+import multiprocessing
+from pathlib import Path
+
+from core.engine import Engine
+from core.search import candidate_pool_report, ann_recall_report
+from core.service import ServiceClient, ServiceUnavailable
+from core.duplicates import cluster_rows
+from core.stereo import STEREO_BANDS
+from config.settings import (
+    DEFAULT_SIMILARITY_THRESHOLD, DEFAULT_MAX_RESULTS, DEFAULT_ANN_NPROBE,
+    DEFAULT_EMBEDDING_MODE, DEFAULT_DUPLICATE_THRESHOLD, DEFAULT_CANDIDATE_POOL, SERVICE_HOST,
+    SERVICE_PORT, DEFAULT_ANALYSIS_DEPTH
+)
+
+# Headless entry point built on the Qt-free core.engine, so PyQt5 is never
+# imported and no display is needed.
+
+SUBTYPES = {
+    'wav': {'16': 'PCM_16', '24': 'PCM_24', '32f': 'FLOAT'},
+    'flac': {'16': 'PCM_16', '24': 'PCM_24'},
+}
+
+
+def _round(value, digits):
+    """round() that passes None (a metric that does not apply) through"""
+    return None if value is None else round(value, digits)
+
+
+def _progress_printer(label):
+    """Progress callback that draws a percentage on stderr when it is a terminal"""
+    if not sys.stderr.isatty():
+        return lambda value: None
+
+    def report(value):
+        sys.stderr.write(f'\r{label}: {value:3d}%')
+        if value >= 100:
+            sys.stderr.write('\n')
+        sys.stderr.flush()
+    return report
+
+
+def _open_output(path):
+    if path in (None, '-'):
+        return sys.stdout
+    return open(path, 'w', newline='', encoding='utf-8')
+
+
+def _write_rows(args, rows, fieldnames):
+    """Write a list of dicts as JSON or CSV to args.output"""
+    out = _open_output(args.output)
+    try:
+        if args.format == 'csv':
+            writer = csv.DictWriter(out, fieldnames=fieldnames, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            json.dump(rows, out, indent=2)
+            out.write('\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def _service(args):
+    """Client for a running `mast serve`, or None to work in-process"""
+    if args.no_service:
+        return None
+    client = ServiceClient()
+    return client if client.is_running() else None
+
+
+def _search_service(client, args, targets):
+    results, errors = client.search(
+        targets, os.path.abspath(args.directory), threshold=args.threshold,
+        max_results=args.max_results, embedding_mode=args.mode,
+        progress=_progress_printer('Searching')
+    )
+    if errors and len(targets) == 1:
+        raise RuntimeError(errors[targets[0]])
+    for target, error in errors.items():
+        print(f"Error processing {target}: {error}, skipping target", file=sys.stderr)
+    if not results:
+        raise RuntimeError("Could not extract embeddings for any of the target songs")
+    return results
+
+
+def cmd_index(args):
+    engine = Engine(args.mode, workers=args.workers or None)
+    stats = engine.index(
+        os.path.abspath(args.directory), nprobe=args.nprobe,
+        progress=_progress_printer('Indexing')
+    )
+    stats['directory'] = os.path.abspath(args.directory)
+    _write_rows(args, [stats], ['directory', 'files', 'cached', 'extracted', 'failed',
+                                'removed', 'indexed'])
+    return 0
+
+
+def cmd_query(args):
+    engine = Engine(args.mode, workers=args.workers or None)
+    targets = [os.path.abspath(path) for path in args.targets]
+    # The service always scores every track exactly, so two-stage and IVF queries run in-process
+    client = _service(args) if not args.candidates and not args.nprobe else None
+    try:
+        if client is not None:
+            try:
+                results = _search_service(client, args, targets)
+            except ServiceUnavailable:
+                client = None
+        if client is None:
+            results = engine.search_many(
+                targets,
+                os.path.abspath(args.directory),
+                threshold=args.threshold,
+                max_results=args.max_results,
+                nprobe=args.nprobe,
+                progress=_progress_printer('Searching'),
+                # A single target that cannot be decoded is an error, as in the GUI
+                skip_failed=len(targets) > 1,
+                candidate_pool=args.candidates
+            )
+    except RuntimeError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    rows = [
+        {
+            'reference': target,
+            'rank': rank,
+            'path': path,
+            'distance': round(distance, 6),
+        }
+        for target, similarities in results.items()
+        for rank, (path, distance) in enumerate(similarities.items(), start=1)
+    ]
+    _write_rows(args, rows, ['reference', 'rank', 'path', 'distance'])
+    return 0
+
+
+def cmd_benchmark(args):
+    directory = os.path.abspath(args.directory)
+    Engine('mel', workers=args.workers or None).index(
+        directory, progress=_progress_printer('Indexing')
+    )
+    if args.nprobe:
+        report = ann_recall_report(
+            directory, args.nprobe, k=args.k, n_queries=args.queries, pq_subvectors=args.pq
+        )
+        setting = 'nprobe'
+    else:
+        report = candidate_pool_report(
+            directory, args.candidates, k=args.k, n_queries=args.queries
+        )
+        setting = 'candidates'
+    rows = [
+        {
+            setting: entry[setting],
+            'recall': round(entry['recall'], 4),
+            'query_ms': round(entry['query_ms'], 3),
+            'exact_ms': round(entry['exact_ms'], 3),
+            'speedup': round(entry['speedup'], 2),
+        }
+        for entry in report
+    ]
+    _write_rows(args, rows, [setting, 'recall', 'query_ms', 'exact_ms', 'speedup'])
+    return 0
+
+
+def cmd_duplicates(args):
+    engine = Engine(args.mode, workers=args.workers or None)
+    clusters = engine.duplicates(
+        os.path.abspath(args.directory), threshold=args.threshold,
+        progress=_progress_printer('Scanning')
+    )
+    _write_rows(args, cluster_rows(clusters),
+                ['cluster', 'path', 'name', 'format', 'size', 'distance'])
+    return 0
+
+
+def cmd_analyze(args):
+    engine = Engine()
+    client = _service(args)
+    rows = []
+    status = 0
+    for path in args.files:
+        try:
+            summary = None
+            if client is not None:
+                try:
+                    summary = client.analyze(path, depth=args.depth, budget=args.budget)
+                except ServiceUnavailable:
+                    client = None
+            if summary is None:
+                summary = engine.analyze(path, depth=args.depth, budget=args.budget)
+        except RuntimeError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            status = 1
+            continue
+        row = {
+            'file': os.path.abspath(path),
+            'depth': summary.get('depth'),
+            'duration': round(summary['duration'], 3),
+            'bpm': round(summary['bpm'], 2),
+            'key': summary['key'],
+            'scale': summary['scale'],
+            'key_confidence': _round(summary.get('key_confidence'), 3),
+        }
+        for name, value in summary['loudness'].items():
+            row[f'loudness_{name}'] = round(value, 6)
+        row['peak'] = round(summary['peak'], 6)
+        lufs = summary.get('lufs', {})
+        row['lufs_integrated'] = _round(lufs.get('integrated'), 2)
+        row['lufs_short_term_max'] = _round(lufs.get('short_term_max'), 2)
+        row['lufs_momentary_max'] = _round(lufs.get('momentary_max'), 2)
+        row['loudness_range'] = _round(lufs.get('range'), 2)
+        row['true_peak_dbtp'] = _round(lufs.get('true_peak'), 2)
+        row['clipped_samples'] = summary['clipped_samples']
+        clipping = summary.get('clipping')
+        row['clip_regions'] = sum(clipping['regions']) if clipping else None
+        row['longest_clip_ms'] = (
+            round(max(clipping['longest']) / clipping['sample_rate'] * 1000, 2) if clipping else None
+        )
+        row['spectral_centroid'] = round(summary['spectral']['centroid_mean'], 1)
+        stereo = summary.get('stereo', {})
+        row['stereo_correlation'] = _round(stereo.get('correlation'), 4)
+        row['stereo_balance_db'] = _round(stereo.get('balance_db'), 2)
+        row['stereo_side_to_mid_db'] = _round(stereo.get('side_to_mid_db'), 2)
+        row['stereo_width'] = _round(stereo.get('width'), 4)
+        for name, width in stereo.get('bands', {}).items():
+            row[f'stereo_width_{name}'] = round(width, 4)
+        rows.append(row)
+
+    _write_rows(args, rows, ['file', 'depth', 'duration', 'bpm', 'key', 'scale',
+                             'key_confidence', 'loudness_mean', 'loudness_max', 'loudness_min',
+                             'loudness_dynamic_range',
+                             'peak', 'lufs_integrated', 'lufs_short_term_max',
+                             'lufs_momentary_max', 'loudness_range', 'true_peak_dbtp',
+                             'clipped_samples', 'clip_regions', 'longest_clip_ms',
+                             'spectral_centroid',
+                             'stereo_correlation', 'stereo_balance_db',
+                             'stereo_side_to_mid_db', 'stereo_width']
+                + [f'stereo_width_{name}' for name, _, _ in STEREO_BANDS])
+    return status
+
+
+def cmd_serve(args):
+    from core.service import serve
+
+    try:
+        serve(args.host, args.port, preload=[os.path.abspath(d) for d in args.preload],
+              embedding_mode=args.mode, workers=args.workers or None, verbose=args.verbose)
+    except OSError as e:
+        print(f"Error: could not listen on {args.host}:{args.port}: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def cmd_master(args):
+    target_path = Path(args.target).resolve()
+    reference_path = Path(args.reference).resolve()
+    if args.output_file:
+        output_path = Path(args.output_file).resolve()
+        output_format = args.output_format or output_path.suffix.lstrip('.').lower()
+    else:
+        output_format = args.output_format or 'wav'
+        name = f"{target_path.stem}_mastered_to_{reference_path.stem}.{output_format}"
+        output_path = target_path.parent / name
+
+    if output_format not in ('wav', 'flac', 'mp3', 'aiff'):
+        print(f"Error: unsupported output format: {output_format}", file=sys.stderr)
+        return 2
+    subtype = SUBTYPES.get(output_format, {}).get(args.bit_depth)
+    if output_format in SUBTYPES and subtype is None:
+        print(f"Error: {args.bit_depth} is not available for {output_format}", file=sys.stderr)
+        return 2
+
+    options = {
+        'format': output_format,
+        'subtype': subtype,
+        'mp3_bitrate': args.mp3_bitrate if output_format == 'mp3' else None,
+        'naming_pattern': None,
+        'output_dir': str(output_path.parent),
+    }
+    try:
+        output = Engine().master(
+            str(target_path), str(reference_path), str(output_path), options,
+            progress=_progress_printer('Mastering')
+        )
+    except RuntimeError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    _write_rows(args, [{
+        'target': str(target_path),
+        'reference': str(reference_path),
+        'output': output,
+    }], ['target', 'reference', 'output'])
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='mast',
+        description='MAST - Master Audio Similarity Tool. Run without a command to start the GUI.'
+    )
+    subparsers = parser.add_subparsers(dest='command')
+
+    def add_output_options(subparser):
+        subparser.add_argument('--format', choices=['json', 'csv'], default='json',
+                               help='output format (default: json)')
+        subparser.add_argument('-o', '--output', help='write results to a file instead of stdout')
+
+    def add_search_options(subparser):
+        subparser.add_argument('--mode', choices=['mel', 'compact'], default=DEFAULT_EMBEDDING_MODE,
+                               help='embedding mode')
+        subparser.add_argument('--workers', type=int, default=0,
+                               help='decoder processes (0 = one per physical core, 1 = serial)')
+        subparser.add_argument('--nprobe', type=int, default=DEFAULT_ANN_NPROBE,
+                               help='IVF lists probed per query (0 = exact search)')
+
+    def add_service_options(subparser):
+        subparser.add_argument('--no-service', action='store_true',
+                               help='work in-process even if `mast serve` is running')
+
+    index_parser = subparsers.add_parser(
+        'index', help='scan a music directory and cache its embeddings')
+    index_parser.add_argument('directory')
+    add_search_options(index_parser)
+    add_output_options(index_parser)
+    index_parser.set_defaults(func=cmd_index)
+
+    query_parser = subparsers.add_parser(
+        'query', help='find songs in a directory similar to one or more targets')
+    query_parser.add_argument('targets', nargs='+', metavar='target')
+    query_parser.add_argument('-d', '--directory', required=True, help='music directory to search')
+    query_parser.add_argument('--threshold', type=float, default=DEFAULT_SIMILARITY_THRESHOLD,
+                              help='maximum distance of a match')
+    query_parser.add_argument('--max-results', type=int, default=DEFAULT_MAX_RESULTS,
+                              help='matches per target')
+    query_parser.add_argument('--candidates', type=int, default=DEFAULT_CANDIDATE_POOL,
+                              help='two-stage search: tracks per target re-ranked with full '
+                                   'embeddings after a coarse pass (0 = score every track)')
+    add_search_options(query_parser)
+    add_service_options(query_parser)
+    add_output_options(query_parser)
+    query_parser.set_defaults(func=cmd_query)
+
+    benchmark_parser = subparsers.add_parser(
+        'benchmark', help='compare two-stage or IVF index search with exhaustive search on a catalog')
+    benchmark_parser.add_argument('directory')
+    benchmark_parser.add_argument('--candidates', type=int, nargs='+', default=[100, 300, 1000],
+                                  help='candidate pool sizes to measure (default: 100 300 1000)')
+    benchmark_parser.add_argument('--nprobe', type=int, nargs='+', metavar='N',
+                                  help='measure an IVF index instead, probing N lists per query')
+    benchmark_parser.add_argument('--pq', type=int, metavar='M',
+                                  help='with --nprobe, product-quantize the index to M bytes per track')
+    benchmark_parser.add_argument('-k', type=int, default=10, help='matches compared per query')
+    benchmark_parser.add_argument('--queries', type=int, default=50,
+                                  help='catalog tracks used as queries')
+    benchmark_parser.add_argument('--workers', type=int, default=0,
+                                  help='decoder processes (0 = one per physical core, 1 = serial)')
+    add_output_options(benchmark_parser)
+    benchmark_parser.set_defaults(func=cmd_benchmark)
+
+    duplicates_parser = subparsers.add_parser(
+        'duplicates', help='find clusters of near-identical tracks in a music directory')
+    duplicates_parser.add_argument('directory')
+    duplicates_parser.add_argument('--threshold', type=float, default=DEFAULT_DUPLICATE_THRESHOLD,
+                                   help='maximum distance between duplicates '
+                                        f'(default: {DEFAULT_DUPLICATE_THRESHOLD})')
+    duplicates_parser.add_argument('--mode', choices=['mel', 'compact'],
+                                   default=DEFAULT_EMBEDDING_MODE, help='embedding mode')
+    duplicates_parser.add_argument('--workers', type=int, default=0,
+                                   help='decoder processes (0 = one per physical core, 1 = serial)')
+    add_output_options(duplicates_parser)
+    duplicates_parser.set_defaults(func=cmd_duplicates)
+
+    analyze_parser = subparsers.add_parser(
+        'analyze', help='report tempo, key, BS.1770 loudness, clipping and stereo field of audio files')
+    analyze_parser.add_argument('files', nargs='+', metavar='file')
+    analyze_parser.add_argument('--depth', choices=['quick', 'standard', 'full'],
+                                default=DEFAULT_ANALYSIS_DEPTH,
+                                help='quick: excerpt only, full: adds constant-Q key chroma '
+                                     f'(default: {DEFAULT_ANALYSIS_DEPTH})')
+    analyze_parser.add_argument('--budget', type=float, metavar='SECONDS',
+                                help='per-file time budget; uses the richest depth up to --depth '
+                                     'expected to fit')
+    add_service_options(analyze_parser)
+    add_output_options(analyze_parser)
+    analyze_parser.set_defaults(func=cmd_analyze)
+
+    serve_parser = subparsers.add_parser(
+        'serve', help='keep catalog embeddings in memory and answer queries from the GUI and CLI')
+    serve_parser.add_argument('--host', default=SERVICE_HOST, help=f'(default: {SERVICE_HOST})')
+    serve_parser.add_argument('--port', type=int, default=SERVICE_PORT,
+                              help=f'(default: {SERVICE_PORT})')
+    serve_parser.add_argument('--preload', action='append', default=[], metavar='DIR',
+                              help='music directory to load at startup (repeatable)')
+    serve_parser.add_argument('--mode', choices=['mel', 'compact'], default=DEFAULT_EMBEDDING_MODE,
+                              help='embedding mode of preloaded directories')
+    serve_parser.add_argument('--workers', type=int, default=0,
+                              help='decoder processes (0 = one per physical core, 1 = serial)')
+    serve_parser.add_argument('--verbose', action='store_true', help='log every request')
+    serve_parser.set_defaults(func=cmd_serve)
+
+    master_parser = subparsers.add_parser(
+        'master', help='master a target to match a reference with matchering')
+    master_parser.add_argument('target')
+    master_parser.add_argument('reference')
+    master_parser.add_argument('--output-file', dest='output_file',
+                               help='mastered file (default: <target>_mastered_to_<reference>.<format>)')
+    master_parser.add_argument('--output-format', choices=['wav', 'flac', 'mp3', 'aiff'],
+                               help='audio format of the mastered file')
+    master_parser.add_argument('--bit-depth', choices=['16', '24', '32f'], default='24',
+                               help='bit depth for WAV/FLAC (default: 24)')
+    master_parser.add_argument('--mp3-bitrate', default='320k', help='bitrate for MP3 output')
+    add_output_options(master_parser)
+    master_parser.set_defaults(func=cmd_master)
+
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        # No command: start the desktop application
+        from main import main as run_gui
+        return run_gui()
+
+    args = build_parser().parse_args(argv)
+    if args.command is None:
+        build_parser().print_help()
+        return 2
+    try:
+        return args.func(args)
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == '__main__':
+    # Required for the embedding worker pool in frozen builds
+    multiprocessing.freeze_support()
+    sys.exit(main())
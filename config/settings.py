@@ -7,6 +7,7 @@ VERSION = "1.0.0"
 SUPPORTED_FORMATS = ['.mp3', '.wav', '.aif', '.flac', '.m4a', '.ogg']
 DEFAULT_SAMPLE_RATE = 44100
 MAX_ANALYSIS_DURATION = 30  # seconds for similarity analysis
+EMBEDDING_OFFSET = 0.0  # excerpt start in seconds, or 'middle' to center it in the track
 
 # UI Settings
 DEFAULT_WINDOW_SIZE = (800, 600)
@@ -15,6 +16,29 @@ DEFAULT_WINDOW_POSITION = (100, 100)
 # Analysis Settings
 DEFAULT_SIMILARITY_THRESHOLD = 0.5
 DEFAULT_MAX_RESULTS = 50
+DEFAULT_ANN_NPROBE = 0  # 0 = exact search, otherwise IVF lists probed per query
+ANN_MIN_CATALOG_SIZE = 1000  # smaller catalogs are always searched exhaustively
+DEFAULT_CANDIDATE_POOL = 0  # tracks per reference re-ranked after a coarse pass; 0 = score all
+DEFAULT_EMBEDDING_MODE = 'mel'  # 'mel' (16,384 float32) or 'compact' (pooled statistics)
+PCA_COMPONENTS = 128  # dimensions of the projected compact embedding
+PCA_MIN_CATALOG_SIZE = 500  # tracks needed before a PCA projection is fitted
+DEFAULT_DUPLICATE_THRESHOLD = 0.02  # cosine distance under which two tracks count as duplicates
+KEY_CHROMA = 'stft'  # key chromagram at 'standard' depth: 'stft' (shared with other features) or 'cqt' (1-minute excerpt)
+DEFAULT_ANALYSIS_DEPTH = 'standard'  # 'quick' (excerpt), 'standard' or 'full' (adds constant-Q key chroma)
+QUICK_ANALYSIS_EXCERPT = 60  # seconds from the middle of a file analyzed at 'quick' depth
+STREAMING_ANALYSIS_DURATION = 600  # seconds; longer files are analyzed block by block in bounded memory
+CLIPPING_THRESHOLD = 0.99  # absolute sample value counted as clipped
+CLIPPING_MAX_REGIONS = 100000  # clipping regions whose positions are kept per file (all are counted)
+CATALOG_VERIFY_FILES = True  # stat every file on rescans; False trusts unchanged directory mtimes
+
+# Track analysis cache (tempo, key, loudness, waveform and spectrogram per file)
+ANALYSIS_CACHE_MEMORY = 512 * 1024 * 1024  # bytes of analyses kept in memory
+ANALYSIS_CACHE_DISK = 2 * 1024 * 1024 * 1024  # bytes of analyses kept on disk
+
+# Local search service (mast serve)
+SERVICE_HOST = '127.0.0.1'  # loopback only: the service reads any file it is asked about
+SERVICE_PORT = 47431
+SERVICE_TIMEOUT = 600  # seconds a client waits for a response
 
 # Processing Settings
 DEFAULT_OUTPUT_FORMAT = 'WAV'
@@ -26,8 +50,16 @@ import os
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, 'data')
 PRESETS_DIR = os.path.join(DATA_DIR, 'presets')
+EMBEDDING_CACHE_PATH = os.path.join(DATA_DIR, 'embeddings.sqlite')
+ANN_INDEX_DIR = os.path.join(DATA_DIR, 'indexes')
+EMBEDDING_PCA_PATH = os.path.join(DATA_DIR, 'embedding_pca.npz')
+CATALOG_DIR = os.path.join(DATA_DIR, 'catalogs')
+EMBEDDING_STORE_DIR = os.path.join(DATA_DIR, 'stores')
+ANALYSIS_CACHE_DIR = os.path.join(DATA_DIR, 'analysis')
+SERVICE_TOKEN_PATH = os.path.join(DATA_DIR, 'service.token')  # per-session secret, mode 0600
 
 # Create directories if they don't exist
-for directory in [DATA_DIR, PRESETS_DIR]:
+for directory in [DATA_DIR, PRESETS_DIR, ANN_INDEX_DIR, CATALOG_DIR, EMBEDDING_STORE_DIR,
+                  ANALYSIS_CACHE_DIR]:
     if not os.path.exists(directory):
         os.makedirs(directory)
\ No newline at end of file
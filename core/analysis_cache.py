@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from core.analyzer import (
+    AudioAnalyzer, ANALYSIS_VERSION, ANALYSIS_DEPTHS, analysis_depth, file_duration
+)
+from core.embedding_cache import file_signature
+from config.settings import (
+    ANALYSIS_CACHE_DIR, ANALYSIS_CACHE_MEMORY, ANALYSIS_CACHE_DISK, DEFAULT_ANALYSIS_DEPTH
+)
+
+# Track analyses (tempo, key, loudness, waveform, spectrogram) shared by every
+# dialog. Results are kept in a byte-bounded in-memory LRU and in one .npz file
+# per track and depth on disk, keyed by path, size, mtime, ANALYSIS_VERSION and
+# depth, so a file that changed, or an analyzer that changed its output, never
+# hits stale data. A request is served from a richer depth when one is cached.
+
+# Display-only arrays written at half precision to halve the disk footprint
+_HALF_PRECISION = ('waveform', 'spectrogram')
+
+
+def _ignore(*args):
+    pass
+
+
+def _nbytes(analysis):
+    return sum(value.nbytes for value in analysis.values() if isinstance(value, np.ndarray))
+
+
+class AnalysisCache:
+    """
+    Get-or-compute cache of AudioAnalyzer.analyze_audio results.
+
+    Returned dicts are shallow copies whose arrays are read-only, since the
+    same arrays are handed to every caller asking about that file.
+    """
+
+    def __init__(self, directory=None, memory_bytes=ANALYSIS_CACHE_MEMORY,
+                 disk_bytes=ANALYSIS_CACHE_DISK):
+        self.directory = directory or ANALYSIS_CACHE_DIR
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        self._entries = OrderedDict()  # key -> (analysis, nbytes)
+        self._size = 0
+        self._lock = threading.Lock()
+        self._pending = {}  # key -> lock held while that file is being analyzed
+
+    @staticmethod
+    def key(file_path, depth=DEFAULT_ANALYSIS_DEPTH):
+        """Identity of file_path's current contents at depth; raises OSError if unreadable"""
+        size, mtime = file_signature(file_path)
+        return os.path.abspath(file_path), size, mtime, ANALYSIS_VERSION, depth
+
+    @staticmethod
+    def _richer(key):
+        """Keys of the cached analyses that can serve key: its depth and richer ones"""
+        return [key[:-1] + (depth,) for depth in ANALYSIS_DEPTHS[ANALYSIS_DEPTHS.index(key[-1]):]]
+
+    def _lookup_richer(self, key):
+        for candidate in self._richer(key):
+            analysis = self._lookup(candidate)
+            if analysis is not None:
+                return analysis
+        return None
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1('\0'.join(map(str, key)).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + '.npz')
+
+    def get(self, file_path, depth=DEFAULT_ANALYSIS_DEPTH):
+        """Cached analysis of file_path at depth or richer, or None if it has not been analyzed as is"""
+        try:
+            key = self.key(file_path, depth)
+        except OSError:
+            return None
+        analysis = self._lookup_richer(key)
+        return None if analysis is None else dict(analysis)
+
+    def analyze(self, file_path, progress=None, token=None, partial=None,
+                depth=DEFAULT_ANALYSIS_DEPTH, budget=None):
+        """
+        Analysis of file_path from the cache, computing and storing it on a miss.
+
+        Returns None if the file cannot be analyzed. Concurrent requests for
+        the same file wait for one analysis instead of repeating it. partial
+        is passed to AudioAnalyzer.analyze_audio; on a hit it receives the
+        whole analysis at once. depth and budget pick the analysis depth as
+        in AudioAnalyzer.analyze_audio; an analysis already cached at a
+        richer depth is returned as is.
+        """
+        progress = progress or _ignore
+        partial = partial or _ignore
+        depth = analysis_depth(file_duration(file_path) if budget is not None else None, depth, budget)
+        try:
+            key = self.key(file_path, depth)
+        except OSError as e:
+            print(f"Error reading {file_path}: {e}")
+            return None
+
+        with self._lock:
+            pending = self._pending.setdefault(key, threading.Lock())
+        try:
+            with pending:
+                analysis = self._lookup_richer(key)
+                if analysis is not None:
+                    partial(dict(analysis))
+                    progress(100)
+                    return dict(analysis)
+                analysis = AudioAnalyzer().analyze_audio(
+                    file_path, progress=progress, token=token, partial=partial, depth=depth
+                )
+                if analysis is None:
+                    return None
+                # Stored under the depth actually produced, so a request that
+                # came back shallower is retried rather than served from cache
+                produced = key[:-1] + (analysis['depth'],)
+                analysis = self._remember(produced, analysis)
+                self._write(produced, analysis)
+                return dict(analysis)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def clear_memory(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[0]
+        analysis = self._read(key)
+        return None if analysis is None else self._remember(key, analysis)
+
+    def _remember(self, key, analysis):
+        analysis = dict(analysis)
+        for value in analysis.values():
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+        nbytes = _nbytes(analysis)
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            if nbytes <= self.memory_bytes:
+                self._entries[key] = (analysis, nbytes)
+                self._size += nbytes
+            while self._size > self.memory_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= evicted
+        return analysis
+
+    def _read(self, key):
+        path = self._disk_path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if json.loads(str(data['identity'])) != list(key):
+                    return None
+                analysis = json.loads(str(data['meta']))
+                for name in data.files:
+                    if name not in ('identity', 'meta'):
+                        array = data[name]
+                        analysis[name] = array.astype(np.float32) if name in _HALF_PRECISION else array
+            os.utime(path)  # recently used files survive disk trimming
+            return analysis
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Discarding unreadable analysis cache entry {path}: {e}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def _write(self, key, analysis):
+        arrays = {}
+        meta = {}
+        for name, value in analysis.items():
+            if isinstance(value, np.ndarray):
+                arrays[name] = value.astype(np.float16) if name in _HALF_PRECISION else value
+            else:
+                meta[name] = value
+        path = self._disk_path(key)
+        temp_path = path + '.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                np.savez(
+                    f, identity=np.array(json.dumps(list(key))),
+                    meta=np.array(json.dumps(meta, default=float)), **arrays
+                )
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Error writing analysis cache: {e}")
+            return
+        self._trim_disk()
+
+    def _trim_disk(self):
+        """Delete least recently used entries until the directory fits disk_bytes"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz'):
+                try:
+                    stats = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stats.st_mtime, stats.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_cache():
+    """The process-wide AnalysisCache used by the engine and every dialog"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = AnalysisCache()
+        return _shared
@@ -1,8 +1,82 @@
-import librosa
+import time
 import numpy as np
 import scipy.spatial.distance as distance
-from PyQt5.QtCore import QThread, pyqtSignal
-import os
+
+from core.cancellation import CancelledError
+from core.features import FeatureGraph, ANALYSIS_HOP_LENGTH, CQT_EXCERPT_DURATION
+from core.key import estimate_key
+from core.streaming import analyze_stream, measure_channels, stream_duration
+from config.settings import (
+    KEY_CHROMA, STREAMING_ANALYSIS_DURATION, DEFAULT_ANALYSIS_DEPTH, QUICK_ANALYSIS_EXCERPT
+)
+
+# Qt-free: the search itself lives in core.search and the UI threads in core.workers
+
+# Bump whenever analyze_audio's output changes; cached analyses of other versions are ignored
+ANALYSIS_VERSION = 8
+
+# Analysis depths, cheapest first. quick analyzes an excerpt from the middle of
+# the file at twice the hop length, standard the whole file, and full adds the
+# constant-Q key chroma.
+ANALYSIS_DEPTHS = ('quick', 'standard', 'full')
+_DEPTH_SETTINGS = {
+    'quick': {'excerpt': QUICK_ANALYSIS_EXCERPT, 'hop_length': 2 * ANALYSIS_HOP_LENGTH, 'key_chroma': 'stft'},
+    'standard': {'excerpt': None, 'hop_length': ANALYSIS_HOP_LENGTH, 'key_chroma': KEY_CHROMA},
+    'full': {'excerpt': None, 'hop_length': ANALYSIS_HOP_LENGTH, 'key_chroma': 'cqt'},
+}
+
+# Seconds of analysis per second of audio analyzed at each depth, used to fit
+# time budgets; seeded with typical figures and refined by every analysis
+_cost_rates = {'quick': 0.008, 'standard': 0.011, 'full': 0.012}
+_COST_SMOOTHING = 0.3  # weight of the newest measurement
+_COST_MIN_SECONDS = 30  # shorter analyses are dominated by fixed costs and not measured
+
+
+def file_duration(file_path):
+    """Duration of file_path in seconds, or None if it cannot be read"""
+    duration = stream_duration(file_path)
+    if duration is not None:
+        return duration
+    try:
+        import librosa
+        return librosa.get_duration(path=file_path)
+    except Exception:
+        return None
+
+
+def _analyzed_seconds(duration, depth):
+    excerpt = _DEPTH_SETTINGS[depth]['excerpt']
+    return duration if excerpt is None else min(duration, excerpt)
+
+
+def estimated_cost(duration, depth):
+    """Expected seconds to analyze duration seconds of audio at depth"""
+    return _cost_rates[depth] * _analyzed_seconds(duration, depth)
+
+
+def analysis_depth(duration, depth=DEFAULT_ANALYSIS_DEPTH, budget=None):
+    """
+    Depth to analyze a file of duration seconds at: depth itself, or with a
+    budget in seconds the richest depth up to depth expected to finish
+    within it (quick if none is)
+    """
+    if depth not in _DEPTH_SETTINGS:
+        raise ValueError(f"Unknown analysis depth {depth!r}; expected one of {', '.join(ANALYSIS_DEPTHS)}")
+    if budget is None or duration is None:
+        return depth
+    candidates = ANALYSIS_DEPTHS[:ANALYSIS_DEPTHS.index(depth) + 1]
+    for candidate in reversed(candidates):
+        if estimated_cost(duration, candidate) <= budget:
+            return candidate
+    return candidates[0]
+
+
+def _record_cost(depth, duration, elapsed):
+    analyzed = _analyzed_seconds(duration, depth)
+    if analyzed >= _COST_MIN_SECONDS:
+        rate = elapsed / analyzed
+        _cost_rates[depth] += _COST_SMOOTHING * (rate - _cost_rates[depth])
+
 
 def calculate_song_similarity(embedding1, embedding2, method='cosine'):
     if embedding1 is None or embedding2 is None:
@@ -13,14 +87,12 @@ def calculate_song_similarity(embedding1, embedding2, method='cosine'):
     elif method == 'euclidean':
         return distance.euclidean(embedding1, embedding2)
 
-from PyQt5.QtCore import QThread, pyqtSignal
-import numpy as np
-import os
 
 class AudioAnalyzer:
     def __init__(self):
         self._audio = None
         self._sr = None
+        self._features = None
         self._librosa = None
         self._scipy = None
 
@@ -28,8 +100,8 @@ class AudioAnalyzer:
         if self._librosa is None:
             import librosa
             self._librosa = librosa
-            # Enable caching
-            if hasattr(librosa, 'cache'):
+            # Enable caching (librosa < 0.10; newer versions configure it via LIBROSA_CACHE_DIR)
+            if hasattr(getattr(librosa, 'cache', None), 'cache'):
                 librosa.cache.cache(level=10)
 
     def _ensure_scipy(self):
@@ -37,154 +109,207 @@ class AudioAnalyzer:
             import scipy.spatial.distance as distance
             self._scipy = distance
 
-    def load_audio(self, file_path):
+    def load_audio(self, file_path, offset=0.0, duration=None, hop_length=ANALYSIS_HOP_LENGTH):
+        """Load file_path, or duration seconds of it from offset, as 22.05 kHz mono"""
         try:
             self._ensure_librosa()
-            self._audio, self._sr = self._librosa.load(file_path)
+            self._audio, self._sr = self._librosa.load(file_path, offset=offset, duration=duration)
+            self._features = FeatureGraph(self._audio, self._sr, hop_length=hop_length)
             return True
         except Exception as e:
             print(f"Error loading audio: {str(e)}")
             return False
 
-    def analyze_audio(self, file_path):
-        if not self.load_audio(file_path):
+    @property
+    def features(self):
+        """FeatureGraph of the loaded audio (None before load_audio)"""
+        return self._features
+
+    def analyze_audio(self, file_path, progress=None, token=None, key_chroma=None,
+                      partial=None, depth=DEFAULT_ANALYSIS_DEPTH, budget=None):
+        """
+        Analysis of file_path at depth (one of ANALYSIS_DEPTHS), or None on failure.
+
+        progress, if given, is called with a percentage after each stage, and
+        token (a CancellationToken) is checked between stages. partial, if
+        given, receives each stage's results as soon as they are ready:
+        duration and levels, then the waveform, then the spectrogram, then
+        peak, clipping, BS.1770 loudness and the stereo field, then tempo and
+        key. Every feature comes from one STFT unless key_chroma ('stft' or
+        'cqt', by default the depth's choice) is 'cqt'. The
+        mono analysis is a mixdown at 22.05 kHz; 'peak', 'clipped_samples',
+        'clipping' and 'clip_regions', 'lufs', the loudness curves and
+        'stereo' are measured on the file's native channels and rate (see
+        core.streaming.measure_channels). 'loudness' holds linear frame RMS.
+
+        Files soundfile can read that are longer than
+        STREAMING_ANALYSIS_DURATION are analyzed block by block (see
+        core.streaming) in bounded memory; their waveform and
+        spectrogram come back at display resolution, as described by
+        'waveform_rate' and 'spectrogram_hop'.
+
+        With a budget in seconds, the richest depth up to depth expected to
+        finish within it is used instead (see analysis_depth). 'depth' holds
+        the depth used. At quick depth, files longer than
+        QUICK_ANALYSIS_EXCERPT are analyzed on an excerpt from their middle,
+        given as 'excerpt' (offset, length) in seconds, to which the arrays,
+        beats and clip regions are relative; 'duration' is still the whole
+        file's.
+        """
+        progress = progress or (lambda value: None)
+        partial = partial or (lambda results: None)
+        started = time.perf_counter()
+        # Only files soundfile can read are streamed; others are loaded whole
+        streamed = stream_duration(file_path)
+        duration = streamed if streamed is not None else file_duration(file_path)
+        depth = analysis_depth(duration, depth, budget)
+        settings = _DEPTH_SETTINGS[depth]
+        key_chroma = key_chroma or settings['key_chroma']
+        excerpt = None
+        if settings['excerpt'] is not None and duration is not None and duration > settings['excerpt']:
+            excerpt = [(duration - settings['excerpt']) / 2, float(settings['excerpt'])]
+        elif streamed is not None and streamed > STREAMING_ANALYSIS_DURATION:
+            return self._analyze_stream(file_path, progress, token, partial, depth, key_chroma)
+        offset, length = excerpt or (0.0, None)
+        if not self.load_audio(file_path, offset, length, settings['hop_length']):
             return None
 
         try:
             analysis = {}
-            self._ensure_librosa()
-            
-            # Basic properties
-            analysis['duration'] = self._librosa.get_duration(y=self._audio, sr=self._sr)
-
-            # BPM Detection (lazy load when needed)
-            tempo, beats = self._librosa.beat.beat_track(y=self._audio, sr=self._sr)
-            analysis['bpm'] = float(tempo)
-            analysis['beats'] = beats
-
-            # Key Detection
-            key, scale = self._detect_key()
-            analysis['key'] = key
-            analysis['scale'] = scale
-
-            # Loudness Analysis
-            rms = self._librosa.feature.rms(y=self._audio)[0]
-            analysis['loudness'] = {
-                'mean': float(np.mean(rms)),
-                'max': float(np.max(rms)),
-                'min': float(np.min(rms)),
-                'dynamic_range': float(np.max(rms) - np.min(rms))
-            }
+            features = self._features
 
-            # Spectral Analysis
-            spec = np.abs(self._librosa.stft(self._audio))
-            analysis['spectrogram'] = self._librosa.amplitude_to_db(spec, ref=np.max)
+            def publish(results, percent):
+                analysis.update(results)
+                partial(results)
+                progress(percent)
+
+            # Basic properties, loudness and level
+            rms = features.rms
+            centroid = features.centroid
+            publish({
+                'depth': depth,
+                'excerpt': excerpt,
+                'duration': features.duration if excerpt is None else duration,
+                'sample_rate': self._sr,
+                'loudness': {
+                    'mean': float(np.mean(rms)),
+                    'max': float(np.max(rms)),
+                    'min': float(np.min(rms)),
+                    'dynamic_range': float(np.max(rms) - np.min(rms))
+                },
+                'spectral': {
+                    'centroid_mean': float(np.mean(centroid)),
+                    'centroid_std': float(np.std(centroid))
+                }
+            }, 25)
 
             # Waveform
-            analysis['waveform'] = self._audio
-            analysis['sample_rate'] = self._sr
+            publish({'waveform': self._audio, 'waveform_rate': self._sr}, 40)
+
+            # Spectral Analysis
+            if token is not None:
+                token.check()
+            publish({
+                'spectrogram': features.spectrogram_db,
+                'spectrogram_hop': features.hop_length
+            }, 60)
 
+            # Peak, clipping, loudness and stereo field, from a chunked pass over the native channels
+            if token is not None:
+                token.check()
+            publish(measure_channels(file_path, token=token, offset=offset, duration=length), 70)
+
+            # BPM and Key Detection
+            if token is not None:
+                token.check()
+            bpm, beats = features.tempo, features.beats
+            if token is not None:
+                token.check()
+            key, scale, confidence = self._detect_key(
+                features.chroma_cqt if key_chroma == 'cqt' else features.chroma
+            )
+            publish({
+                'bpm': bpm, 'beats': beats, 'key': key, 'scale': scale, 'key_confidence': confidence
+            }, 100)
+
+            if duration is not None:
+                _record_cost(depth, duration, time.perf_counter() - started)
             return analysis
 
+        except CancelledError:
+            raise
         except Exception as e:
             print(f"Error during analysis: {str(e)}")
             return None
 
-    def _detect_key(self):
-        """Detect musical key and scale"""
-        self._ensure_librosa()
-        chroma = self._librosa.feature.chroma_cqt(y=self._audio, sr=self._sr)
-        chroma_avg = np.mean(chroma, axis=1)
-        keys = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-        key_index = np.argmax(chroma_avg)
-        
-        # Simple major/minor detection
-        major_profile = np.array([1, 0, 1, 0, 1, 1, 0, 1, 0, 1, 0, 1])
-        minor_profile = np.array([1, 0, 1, 1, 0, 1, 0, 1, 1, 0, 1, 0])
-        
-        major_profile = np.roll(major_profile, key_index)
-        minor_profile = np.roll(minor_profile, key_index)
-        
-        major_corr = np.corrcoef(chroma_avg, major_profile)[0,1]
-        minor_corr = np.corrcoef(chroma_avg, minor_profile)[0,1]
-        
-        scale = 'major' if major_corr > minor_corr else 'minor'
-        return keys[key_index], scale
-
-# Use separate functions for similarity search to avoid loading libraries until needed
-def extract_audio_embedding(file_path, max_length=128):
-    try:
-        import librosa
-        y, sr = librosa.load(file_path, duration=30)
-        mel_spec = librosa.feature.melspectrogram(y=y, sr=sr)
-        mel_spec = librosa.power_to_db(mel_spec)
-        
-        if mel_spec.shape[1] > max_length:
-            mel_spec = mel_spec[:, :max_length]
-        else:
-            pad_width = max_length - mel_spec.shape[1]
-            mel_spec = np.pad(mel_spec, ((0,0),(0,pad_width)), mode='constant')
-        
-        embedding = mel_spec.flatten()
-        return embedding / np.linalg.norm(embedding)
-    except Exception as e:
-        print(f"Error processing {file_path}: {e}")
-        return None
-    
-class SimilarityThread(QThread):
-    update_progress = pyqtSignal(int)
-    comparison_complete = pyqtSignal(dict)
-    error_occurred = pyqtSignal(str)
-
-    def __init__(self, reference_song, directory, threshold=0.5, max_results=50):
-        super().__init__()
-        self.reference_song = reference_song
-        self.directory = directory
-        self.threshold = threshold
-        self.max_results = max_results
-
-    def run(self):
-        try:
-            reference_embedding = extract_audio_embedding(self.reference_song)
-            if reference_embedding is None:
-                self.error_occurred.emit(f"Could not extract embedding for {self.reference_song}")
-                return
-
-            song_files = self._find_audio_files(self.directory)
-            song_files = [f for f in song_files if os.path.abspath(f) != os.path.abspath(self.reference_song)]
-
-            similarities = {}
-            total_files = len(song_files)
-
-            for i, other_song_path in enumerate(song_files):
-                try:
-                    other_embedding = extract_audio_embedding(other_song_path)
-                    if other_embedding is not None:
-                        similarity = calculate_song_similarity(reference_embedding, other_embedding)
-                        if similarity <= self.threshold:
-                            similarities[other_song_path] = similarity
-                    
-                    progress = int(((i + 1) / total_files) * 100)
-                    self.update_progress.emit(progress)
-
-                except Exception as e:
-                    print(f"Error processing {other_song_path}: {e}")
-
-            sorted_similarities = dict(
-                sorted(similarities.items(), key=lambda x: x[1])[:self.max_results]
-            )
-            self.comparison_complete.emit(sorted_similarities)
+    def _analyze_stream(self, file_path, progress, token, partial, depth, key_chroma):
+        """
+        Bounded-memory analysis of a long file; all stages are published at the end.
 
+        The constant-Q key chroma only covers the middle CQT_EXCERPT_DURATION
+        seconds, so just that excerpt is loaded for it. If it cannot be loaded
+        the key comes from the streamed STFT chroma and a full request is
+        recorded as standard depth.
+        """
+        try:
+            analysis = analyze_stream(file_path, progress=progress, token=token)
+            analysis['excerpt'] = None
+            chroma = analysis.pop('chroma_profile')
+            if key_chroma == 'cqt':
+                if token is not None:
+                    token.check()
+                offset = max(0.0, (analysis['duration'] - CQT_EXCERPT_DURATION) / 2)
+                if self.load_audio(file_path, offset, CQT_EXCERPT_DURATION):
+                    chroma = self._features.chroma_cqt
+                elif depth == 'full':
+                    depth = 'standard'
+            analysis['depth'] = depth
+            analysis['key'], analysis['scale'], analysis['key_confidence'] = self._detect_key(chroma)
+        except CancelledError:
+            raise
         except Exception as e:
-            self.error_occurred.emit(str(e))
-
-    def _find_audio_files(self, directory):
-        supported_formats = ['.mp3', '.wav', '.aif', '.flac', '.m4a', '.ogg']
-        audio_files = []
-        
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                if os.path.splitext(file)[1].lower() in supported_formats:
-                    audio_files.append(os.path.join(root, file))
-        
-        return audio_files
\ No newline at end of file
+            print(f"Error during analysis: {str(e)}")
+            return None
+
+        stages = (
+            ('depth', 'excerpt', 'duration', 'sample_rate', 'loudness', 'spectral'),
+            ('waveform', 'waveform_rate'),
+            ('spectrogram', 'spectrogram_hop'),
+            ('peak', 'clipped_samples', 'clipping', 'clip_regions',
+             'lufs', 'momentary_lufs', 'short_term_lufs', 'stereo'),
+            ('bpm', 'beats', 'key', 'scale', 'key_confidence'),
+        )
+        for names in stages:
+            partial({name: analysis[name] for name in names})
+        progress(100)
+        return analysis
+
+    def _detect_key(self, chroma=None):
+        """
+        (key, scale, confidence) from a chromagram or mean chroma profile (the
+        loaded audio's chromagram by default); see core.key.estimate_key
+        """
+        if chroma is None:
+            chroma = self._features.chroma
+        return estimate_key(chroma)
+
+
+def analysis_summary(analysis):
+    """JSON-friendly subset of an AudioAnalyzer.analyze_audio result (no arrays)"""
+    return {
+        'depth': analysis['depth'],
+        'excerpt': analysis['excerpt'],
+        'duration': float(analysis['duration']),
+        'bpm': float(analysis['bpm']),
+        'key': analysis['key'],
+        'scale': analysis['scale'],
+        'key_confidence': float(analysis['key_confidence']),
+        'sample_rate': int(analysis['sample_rate']),
+        'loudness': dict(analysis['loudness']),
+        'lufs': dict(analysis['lufs']),
+        'peak': float(analysis['peak']),
+        'clipped_samples': int(analysis['clipped_samples']),
+        'clipping': dict(analysis['clipping']),
+        'spectral': dict(analysis['spectral']),
+        'stereo': dict(analysis['stereo']),
+    }
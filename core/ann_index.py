@@ -0,0 +1,327 @@
+import os
+import time
+import hashlib
+import numpy as np
+
+from config.settings import ANN_INDEX_DIR
+from core.similarity import score_batch, top_k
+
+# Version of the on-disk index layout; indexes with another version are rebuilt
+INDEX_VERSION = 1
+
+# Rows processed per matrix product during training and assignment
+_BLOCK_SIZE = 4096
+
+
+def index_path_for(directory, fmt=''):
+    """Location of the saved index for a music directory and embedding format"""
+    key = f'{os.path.abspath(directory)}|{fmt}'
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(ANN_INDEX_DIR, f'ivf_{digest}.npz')
+
+
+def _assign(vectors, centroids, spherical=True):
+    """Index of the nearest centroid for each vector, computed in blocks"""
+    if spherical:
+        bias = None
+    else:
+        bias = 0.5 * np.einsum('ij,ij->i', centroids, centroids)
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), _BLOCK_SIZE):
+        scores = vectors[start:start + _BLOCK_SIZE] @ centroids.T
+        if bias is not None:
+            scores -= bias
+        labels[start:start + _BLOCK_SIZE] = np.argmax(scores, axis=1)
+    return labels
+
+
+def kmeans(vectors, k, n_iter=20, spherical=True, seed=0):
+    """
+    Lloyd's k-means in pure NumPy.
+
+    With spherical=True centroids are kept unit length and assignment uses the
+    inner product, which matches cosine distance on normalized embeddings.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    k = min(k, len(vectors))
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+
+    for _ in range(n_iter):
+        labels = _assign(vectors, centroids, spherical)
+        order = np.argsort(labels, kind='stable')
+        counts = np.bincount(labels, minlength=k)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        nonempty = counts > 0
+
+        sums = np.zeros_like(centroids)
+        sums[nonempty] = np.add.reduceat(vectors[order], starts[nonempty], axis=0)
+        if spherical:
+            norms = np.linalg.norm(sums[nonempty], axis=1, keepdims=True)
+            centroids[nonempty] = sums[nonempty] / np.maximum(norms, 1e-12)
+        else:
+            centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+
+        # Re-seed empty clusters from random points
+        empty = np.flatnonzero(~nonempty)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index over L2-normalized embeddings.
+
+    Vectors are bucketed by their nearest coarse centroid and a query only
+    scans the nprobe closest buckets. With pq_subvectors set, residuals are
+    product-quantized to one byte per subvector instead of storing the full
+    float32 vectors, trading some accuracy for a much smaller index.
+    Distances are cosine distances, like calculate_song_similarity.
+    """
+
+    def __init__(self, dim, n_lists=None, pq_subvectors=None):
+        if pq_subvectors and dim % pq_subvectors:
+            raise ValueError(f"Dimension {dim} is not divisible by {pq_subvectors} subvectors")
+        self.dim = dim
+        self.n_lists = n_lists
+        self.pq_subvectors = pq_subvectors or None
+        self.centroids = None
+        self.codebooks = None
+        self.paths = []
+        self._path_ids = {}
+        self._lists = []
+        self._list_ids = []
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def __len__(self):
+        return len(self._path_ids)
+
+    def __contains__(self, path):
+        return path in self._path_ids
+
+    def train(self, vectors, n_iter=20, seed=0):
+        """Learn coarse centroids (and PQ codebooks) from a sample of vectors"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n_lists = self.n_lists or max(1, int(4 * np.sqrt(len(vectors))))
+        self.centroids = kmeans(vectors, n_lists, n_iter, spherical=True, seed=seed)
+        self.n_lists = len(self.centroids)
+
+        if self.pq_subvectors:
+            residuals = vectors - self.centroids[_assign(vectors, self.centroids)]
+            sub_dim = self.dim // self.pq_subvectors
+            self.codebooks = np.stack([
+                kmeans(residuals[:, j * sub_dim:(j + 1) * sub_dim], 256, n_iter,
+                       spherical=False, seed=seed + j)
+                for j in range(self.pq_subvectors)
+            ])
+
+        self._lists = [self._empty_list() for _ in range(self.n_lists)]
+        self._list_ids = [np.empty(0, dtype=np.int64) for _ in range(self.n_lists)]
+
+    def _empty_list(self):
+        if self.pq_subvectors:
+            return np.empty((0, self.pq_subvectors), dtype=np.uint8)
+        return np.empty((0, self.dim), dtype=np.float32)
+
+    def _encode(self, vectors, labels):
+        residuals = vectors - self.centroids[labels]
+        sub_dim = self.dim // self.pq_subvectors
+        codes = np.empty((len(vectors), self.pq_subvectors), dtype=np.uint8)
+        for j, codebook in enumerate(self.codebooks):
+            sub = np.ascontiguousarray(residuals[:, j * sub_dim:(j + 1) * sub_dim])
+            codes[:, j] = _assign(sub, codebook, spherical=False)
+        return codes
+
+    def add(self, paths, vectors):
+        """Add or replace vectors; existing entries for the same paths are dropped first"""
+        if not self.is_trained:
+            raise RuntimeError("Index must be trained before adding vectors")
+        if len(paths) == 0:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.remove([p for p in paths if p in self._path_ids])
+
+        ids = np.arange(len(self.paths), len(self.paths) + len(paths))
+        for path, vector_id in zip(paths, ids):
+            self._path_ids[path] = int(vector_id)
+        self.paths.extend(paths)
+
+        labels = _assign(vectors, self.centroids)
+        stored = self._encode(vectors, labels) if self.pq_subvectors else vectors
+        for list_no in np.unique(labels):
+            members = labels == list_no
+            self._lists[list_no] = np.concatenate([self._lists[list_no], stored[members]])
+            self._list_ids[list_no] = np.concatenate([self._list_ids[list_no], ids[members]])
+
+    def remove(self, paths):
+        """Remove vectors by path; unknown paths are ignored"""
+        removed = {self._path_ids.pop(p) for p in paths if p in self._path_ids}
+        if not removed:
+            return
+        removed = np.fromiter(removed, dtype=np.int64)
+        for list_no, ids in enumerate(self._list_ids):
+            keep = ~np.isin(ids, removed)
+            if not keep.all():
+                self._lists[list_no] = self._lists[list_no][keep]
+                self._list_ids[list_no] = ids[keep]
+        for vector_id in removed:
+            self.paths[vector_id] = None
+
+    def compact(self):
+        """Renumber vectors so paths holds no slots of removed entries"""
+        live = np.array([p is not None for p in self.paths], dtype=bool)
+        if live.all():
+            return
+        new_ids = np.cumsum(live) - 1
+        self._list_ids = [new_ids[ids] for ids in self._list_ids]
+        self.paths = [p for p in self.paths if p is not None]
+        self._path_ids = {p: i for i, p in enumerate(self.paths)}
+
+    def search(self, query, k=10, nprobe=8):
+        """Return (paths, distances) for the approximate k nearest neighbours of query"""
+        query = np.asarray(query, dtype=np.float32)
+        nprobe = max(1, min(nprobe, self.n_lists))
+        coarse = self.centroids @ query
+        probe = np.argpartition(-coarse, nprobe - 1)[:nprobe]
+
+        if self.pq_subvectors:
+            sub_dim = self.dim // self.pq_subvectors
+            # Inner products of each query subvector with every codeword: (m, 256)
+            lut = np.einsum('jcd,jd->jc', self.codebooks,
+                            query.reshape(self.pq_subvectors, sub_dim))
+            columns = np.arange(self.pq_subvectors)
+
+        distances, ids = [], []
+        for list_no in probe:
+            stored = self._lists[list_no]
+            if len(stored) == 0:
+                continue
+            if self.pq_subvectors:
+                dots = coarse[list_no] + lut[columns, stored].sum(axis=1)
+                distances.append(1.0 - dots)
+            else:
+                distances.append(score_batch(query, stored))
+            ids.append(self._list_ids[list_no])
+
+        if not ids:
+            return [], np.empty(0, dtype=np.float32)
+        distances = np.concatenate(distances)
+        ids = np.concatenate(ids)
+        best = top_k(distances, k)
+        return [self.paths[i] for i in ids[best]], distances[best]
+
+    def save(self, file_path):
+        """Write the index to a single .npz file, dropping removed entries"""
+        self.compact()
+        counts = np.array([len(ids) for ids in self._list_ids], dtype=np.int64)
+        arrays = {
+            'version': np.array(INDEX_VERSION),
+            'dim': np.array(self.dim),
+            'pq_subvectors': np.array(self.pq_subvectors or 0),
+            'centroids': self.centroids,
+            'list_counts': counts,
+            'list_data': np.concatenate(self._lists) if self._lists else self._empty_list(),
+            'list_ids': np.concatenate(self._list_ids) if self._list_ids else np.empty(0, np.int64),
+            'paths': np.array(self.paths, dtype=object).astype(str),
+        }
+        if self.codebooks is not None:
+            arrays['codebooks'] = self.codebooks
+        os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+        tmp_path = file_path + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, file_path)
+
+    @classmethod
+    def load(cls, file_path):
+        """Load an index written by save(); returns None if missing or outdated"""
+        if not os.path.exists(file_path):
+            return None
+        with np.load(file_path, allow_pickle=False) as data:
+            if int(data['version']) != INDEX_VERSION:
+                return None
+            index = cls(int(data['dim']), pq_subvectors=int(data['pq_subvectors']) or None)
+            index.centroids = data['centroids']
+            index.n_lists = len(index.centroids)
+            if 'codebooks' in data:
+                index.codebooks = data['codebooks']
+            bounds = np.cumsum(data['list_counts'])[:-1]
+            index._lists = np.split(data['list_data'], bounds)
+            index._list_ids = np.split(data['list_ids'], bounds)
+            index.paths = data['paths'].tolist()
+        index._path_ids = {p: i for i, p in enumerate(index.paths)}
+        return index
+
+
+def build_index_from_store(store, n_lists=None, pq_subvectors=None, max_train=50000, seed=0):
+    """Train an IVFIndex on a sample of an EmbeddingStore and add all of its rows"""
+    sample = np.asarray(store.sample(max_train, np.random.default_rng(seed)), dtype=np.float32)
+    if len(sample) == 0:
+        return None
+    index = IVFIndex(sample.shape[1], n_lists, pq_subvectors)
+    index.train(sample, seed=seed)
+    for paths, vectors in store.blocks(_BLOCK_SIZE):
+        index.add(list(paths), vectors)
+    return index
+
+
+def build_index_from_cache(cache, paths, dim, n_lists=None, pq_subvectors=None,
+                           max_train=10000, seed=0, fmt=None, transform=None):
+    """
+    Build an IVFIndex from embeddings already stored in an EmbeddingCache.
+
+    Training uses a random sample and vectors are then added block by block,
+    so the full catalog is never held in memory at once. transform, if given,
+    maps a stacked block of cached embeddings to the vectors to index and dim
+    refers to the cached (untransformed) embedding size.
+    """
+    transform = transform or (lambda vectors: vectors)
+    rng = np.random.default_rng(seed)
+    paths = list(paths)
+    sample_paths = [paths[i] for i in rng.choice(len(paths), min(max_train, len(paths)), replace=False)]
+    sample = [
+        e for _, e in cache.iter_embeddings(sample_paths, fmt)
+        if e is not None and e.shape == (dim,)
+    ]
+    if not sample:
+        return None
+
+    sample = transform(np.vstack(sample))
+    index = IVFIndex(sample.shape[1], n_lists, pq_subvectors)
+    index.train(sample, seed=seed)
+    for start in range(0, len(paths), _BLOCK_SIZE):
+        block = [
+            (p, e) for p, e in cache.iter_embeddings(paths[start:start + _BLOCK_SIZE], fmt)
+            if e is not None and e.shape == (dim,)
+        ]
+        if block:
+            index.add([p for p, _ in block], transform(np.vstack([e for _, e in block])))
+    return index
+
+
+def recall_report(index, queries, exact, k=10, nprobe_values=(1, 2, 4, 8, 16, 32), query_paths=None):
+    """
+    Measure recall@k of the index against exact search for several nprobe values.
+
+    exact holds, for each query vector, the set of paths exact search ranks in
+    its top k. query_paths, for queries drawn from the indexed catalog, are
+    left out of their own results. Returns a list of {'nprobe', 'recall',
+    'query_ms'} dicts.
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    query_paths = query_paths or [None] * len(queries)
+    report = []
+    for nprobe in nprobe_values:
+        hits, total = 0, 0
+        start = time.perf_counter()
+        for query, path, truth in zip(queries, query_paths, exact):
+            found, _ = index.search(query, k + 1, nprobe)
+            found = [p for p in found if p != path][:k]
+            hits += len(truth.intersection(found))
+            total += len(truth)
+        query_ms = (time.perf_counter() - start) * 1000 / max(len(queries), 1)
+        report.append({'nprobe': nprobe, 'recall': hits / max(total, 1), 'query_ms': query_ms})
+    return report
@@ -1,12 +1,13 @@
-import librosa
-import numpy as np
-import librosa.display
-import matplotlib.pyplot as plt
 from PyQt5.QtCore import QObject, pyqtSignal
 
+from core.analyzer import AudioAnalyzer as _Analyzer
+from core.analysis_cache import shared_cache
+from core.streaming import measure_channels, measure_clipping
+from config.settings import CLIPPING_THRESHOLD
+
 class AudioAnalyzer(QObject):
     """
-    Core class for audio analysis functionality
+    Qt adapter over core.analyzer.AudioAnalyzer that reports through signals
     """
     analysis_complete = pyqtSignal(dict)
     error_occurred = pyqtSignal(str)
@@ -14,58 +15,42 @@ class AudioAnalyzer(QObject):
 
     def __init__(self):
         super().__init__()
-        self.current_audio = None
-        self.sr = None
+        self._analyzer = _Analyzer()
+        self._analysis = None
+        self._file_path = None
+
+    @property
+    def current_audio(self):
+        if self._analyzer._audio is None and self._analysis is not None:
+            return self._analysis['waveform']
+        return self._analyzer._audio
+
+    @property
+    def sr(self):
+        if self._analyzer._sr is None and self._analysis is not None:
+            return self._analysis['sample_rate']
+        return self._analyzer._sr
 
     def load_audio(self, file_path):
         """Load audio file and prepare for analysis"""
-        try:
-            self.current_audio, self.sr = librosa.load(file_path)
+        if self._analyzer.load_audio(file_path):
+            self._analysis = None
+            self._file_path = file_path
             return True
-        except Exception as e:
-            self.error_occurred.emit(f"Error loading audio: {str(e)}")
-            return False
+        self.error_occurred.emit(f"Error loading audio: {file_path}")
+        return False
 
     def analyze_audio(self, file_path):
-        """Perform complete audio analysis"""
-        if not self.load_audio(file_path):
-            return
-
-        try:
-            analysis_results = {}
-            
-            # Basic audio properties
-            analysis_results['duration'] = librosa.get_duration(y=self.current_audio, sr=self.sr)
-            self.progress_updated.emit(20)
-
-            # BPM detection
-            tempo, _ = librosa.beat.beat_track(y=self.current_audio, sr=self.sr)
-            analysis_results['bpm'] = float(tempo)
-            self.progress_updated.emit(40)
-
-            # Key detection
-            chroma = librosa.feature.chroma_cqt(y=self.current_audio, sr=self.sr)
-            key = self._estimate_key(chroma)
-            analysis_results['key'] = key
-            self.progress_updated.emit(60)
-
-            # Loudness analysis
-            rms = librosa.feature.rms(y=self.current_audio)
-            analysis_results['average_loudness'] = float(np.mean(rms))
-            analysis_results['peak_loudness'] = float(np.max(rms))
-            self.progress_updated.emit(80)
-
-            # Spectral analysis
-            spectral_centroids = librosa.feature.spectral_centroid(y=self.current_audio, sr=self.sr)
-            analysis_results['spectral_centroid'] = float(np.mean(spectral_centroids))
-
-            self.progress_updated.emit(100)
-            self.analysis_complete.emit(analysis_results)
-            return analysis_results
-
-        except Exception as e:
-            self.error_occurred.emit(f"Error during analysis: {str(e)}")
+        """Perform complete audio analysis (served from the shared analysis cache)"""
+        analysis_results = shared_cache().analyze(file_path, progress=self.progress_updated.emit)
+        self._analyzer = _Analyzer()
+        self._analysis = analysis_results
+        self._file_path = file_path
+        if analysis_results is None:
+            self.error_occurred.emit(f"Error during analysis: {file_path}")
             return None
+        self.analysis_complete.emit(analysis_results)
+        return analysis_results
 
     def get_waveform_data(self):
         """Generate waveform data for visualization"""
@@ -75,40 +60,38 @@ class AudioAnalyzer(QObject):
 
     def get_spectrum_data(self):
         """Generate spectrum data for visualization"""
+        if self._analysis is not None:
+            return self._analysis['spectrogram']
         if self.current_audio is None:
             return None
-        D = librosa.stft(self.current_audio)
-        S_db = librosa.amplitude_to_db(np.abs(D), ref=np.max)
-        return S_db
-
-    def _estimate_key(self, chroma):
-        """Estimate musical key from chroma features"""
-        keys = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-        chroma_avg = np.mean(chroma, axis=1)
-        key_index = np.argmax(chroma_avg)
-        return keys[key_index]
-
-    def detect_clipping(self, threshold=0.99):
-        """Check for potential clipping in the audio"""
-        if self.current_audio is None:
-            return False
-        return np.any(np.abs(self.current_audio) > threshold)
+        return self._analyzer.features.spectrogram_db
+
+    def detect_clipping(self, threshold=CLIPPING_THRESHOLD):
+        """
+        Clipping of the current file (see core.clipping): clipped samples,
+        regions and longest region per native channel, or None without a file
+        """
+        if self._analysis is not None and threshold == self._analysis['clipping']['threshold']:
+            return self._analysis['clipping']
+        if self._file_path is None:
+            return None
+        try:
+            return measure_clipping(self._file_path, threshold=threshold)['clipping']
+        except Exception as e:
+            self.error_occurred.emit(f"Error detecting clipping: {e}")
+            return None
 
     def get_stereo_info(self):
-        """Analyze stereo field information"""
-        if self.current_audio is None:
+        """
+        Stereo field of the current file (see core.stereo), measured on its
+        native channels rather than the mono mixdown used for everything else
+        """
+        if self._analysis is not None:
+            return self._analysis['stereo']
+        if self._file_path is None:
+            return None
+        try:
+            return measure_channels(self._file_path)['stereo']
+        except Exception as e:
+            self.error_occurred.emit(f"Error analyzing stereo field: {e}")
             return None
-        
-        if len(self.current_audio.shape) == 1:
-            return {"type": "mono"}
-        
-        # For stereo audio
-        left = self.current_audio[0]
-        right = self.current_audio[1]
-        correlation = np.corrcoef(left, right)[0,1]
-        
-        return {
-            "type": "stereo",
-            "correlation": correlation,
-            "balance": np.mean(np.abs(left)) / np.mean(np.abs(right))
-        }
\ No newline at end of file
@@ -0,0 +1,138 @@
+import os
+import shutil
+import subprocess
+import numpy as np
+
+# Fast excerpt decoding for embedding extraction. librosa.load decodes from the
+# start of the file (audioread for MP3/M4A) and resamples with a high-quality
+# filter; here we seek straight to the requested window and decode only that.
+
+# Resampler used when the file rate differs from the target rate. soxr is fast
+# enough that the cost is negligible once only a short excerpt is decoded, and
+# the faster soxr presets alias enough to shift embeddings measurably.
+RESAMPLE_TYPE = 'soxr_hq'
+
+# Formats libsndfile can seek in directly; everything else goes through ffmpeg
+SOUNDFILE_FORMATS = {'.wav', '.flac', '.aif', '.aiff', '.ogg', '.mp3'}
+
+
+def get_duration(file_path):
+    """Duration in seconds from file headers, or None if unknown"""
+    try:
+        import soundfile as sf
+        info = sf.info(file_path)
+        return info.frames / info.samplerate
+    except Exception:
+        pass
+    try:
+        import mutagen
+        audio = mutagen.File(file_path)
+        if audio is not None and hasattr(audio.info, 'length'):
+            return float(audio.info.length)
+    except Exception:
+        pass
+    return None
+
+
+def resolve_offset(offset, duration, total_duration):
+    """
+    Start time in seconds of a window of the given duration.
+
+    offset is either a number of seconds or 'middle' to center the window in
+    the track. The window is kept inside the track when its length is known.
+    """
+    if total_duration is None:
+        return 0.0 if offset == 'middle' else float(offset)
+    latest = max(0.0, total_duration - (duration or 0.0))
+    if offset == 'middle':
+        return latest / 2
+    return min(max(0.0, float(offset)), latest)
+
+
+def _resample(y, orig_sr, sr):
+    if orig_sr == sr:
+        return y
+    import librosa
+    try:
+        return librosa.resample(y, orig_sr=orig_sr, target_sr=sr, res_type=RESAMPLE_TYPE)
+    except Exception:
+        # Older librosa without soxr support
+        return librosa.resample(y, orig_sr=orig_sr, target_sr=sr, res_type='kaiser_fast')
+
+
+def _load_soundfile(file_path, sr, offset, duration):
+    import soundfile as sf
+    with sf.SoundFile(file_path) as f:
+        native_sr = f.samplerate
+        start = int(round(offset * native_sr))
+        frames = -1 if duration is None else int(round(duration * native_sr))
+        if f.seekable():
+            f.seek(min(start, f.frames))
+        else:
+            f.read(start, dtype='float32')
+        y = f.read(frames, dtype='float32', always_2d=True)
+    return _resample(y.mean(axis=1), native_sr, sr)
+
+
+def _native_rate(file_path):
+    """Sample rate of the first audio stream from tags or ffprobe, or None if unknown"""
+    try:
+        import mutagen
+        audio = mutagen.File(file_path)
+        if audio is not None and getattr(audio.info, 'sample_rate', None):
+            return int(audio.info.sample_rate)
+    except Exception:
+        pass
+    if shutil.which('ffprobe'):
+        command = ['ffprobe', '-v', 'error', '-select_streams', 'a:0',
+                   '-show_entries', 'stream=sample_rate', '-of', 'csv=p=0', file_path]
+        try:
+            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+            return int(result.stdout.split()[0])
+        except (subprocess.CalledProcessError, OSError, ValueError, IndexError):
+            pass
+    return None
+
+
+def _load_ffmpeg(file_path, sr, offset, duration):
+    # -ss before -i seeks in the demuxer. ffmpeg only downmixes: resampling
+    # with the same soxr filter as the soundfile path keeps embeddings of a
+    # track independent of the decoder (ffmpeg's swresample is only used when
+    # the native rate cannot be determined)
+    native_sr = _native_rate(file_path) or sr
+    command = ['ffmpeg', '-nostdin', '-v', 'error', '-ss', f'{offset:.3f}']
+    if duration is not None:
+        command += ['-t', f'{duration:.3f}']
+    command += ['-i', file_path, '-f', 'f32le', '-ac', '1', '-ar', str(native_sr), '-']
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return _resample(np.frombuffer(result.stdout, dtype=np.float32), native_sr, sr)
+
+
+def load_excerpt(file_path, sr=22050, duration=None, offset=0.0):
+    """
+    Decode a mono excerpt of file_path at sample rate sr.
+
+    Only [offset, offset + duration) is decoded. soundfile is used for formats
+    it can seek in, an ffmpeg pipe for the rest, and librosa.load as the last
+    resort. Returns (y, sr) like librosa.load.
+    """
+    if offset:
+        offset = resolve_offset(offset, duration, get_duration(file_path))
+    else:
+        offset = 0.0
+
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension in SOUNDFILE_FORMATS:
+        try:
+            return _load_soundfile(file_path, sr, offset, duration), sr
+        except Exception:
+            pass  # e.g. MP3 with an older libsndfile
+
+    if shutil.which('ffmpeg'):
+        try:
+            return _load_ffmpeg(file_path, sr, offset, duration), sr
+        except (subprocess.CalledProcessError, OSError):
+            pass
+
+    import librosa
+    return librosa.load(file_path, sr=sr, offset=offset, duration=duration, res_type=RESAMPLE_TYPE)
@@ -0,0 +1,49 @@
+import threading
+
+
+class CancelledError(Exception):
+    """Raised by CancellationToken.check() once the work has been cancelled"""
+
+
+class CancellationToken:
+    """
+    Cooperative cancel/pause flag shared between a worker and its owner.
+
+    Workers call check() between files or stages: it blocks while the token is
+    paused and raises CancelledError once it has been cancelled. Cancelling
+    also wakes up a paused worker so it can exit.
+    """
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+
+    def cancel(self):
+        self._cancelled.set()
+        self._running.set()
+
+    def pause(self):
+        if not self._cancelled.is_set():
+            self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    @property
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def is_paused(self):
+        return not self._running.is_set()
+
+    def check(self):
+        """Block while paused; raise CancelledError if cancelled"""
+        self._running.wait()
+        if self._cancelled.is_set():
+            raise CancelledError()
+
+    def sleep(self, seconds):
+        """Wait up to seconds, returning early (True) if cancelled"""
+        return self._cancelled.wait(seconds)
@@ -0,0 +1,366 @@
+import os
+import sys
+import json
+import hashlib
+import threading
+
+from config.settings import CATALOG_DIR, CATALOG_VERIFY_FILES, SUPPORTED_FORMATS
+
+# Bump when the saved catalog layout changes; older files are rescanned from scratch
+CATALOG_VERSION = 1
+
+
+class ScanResult:
+    """
+    Changes found by CatalogIndex.scan as sets of paths.
+
+    files ({path: (size, mtime_ns)} for the whole catalog) is only built when
+    first used, so callers that just need the changes stay O(changes).
+    """
+
+    def __init__(self, catalog, added, removed, modified):
+        self.added = added
+        self.removed = removed
+        self.modified = modified
+        self._catalog = catalog
+        self._files = None
+
+    @property
+    def changed(self):
+        return bool(self.added or self.removed or self.modified)
+
+    @property
+    def files(self):
+        if self._files is None:
+            self._files = self._catalog.files()
+        return self._files
+
+
+def catalog_path_for(directory):
+    digest = hashlib.sha1(os.path.abspath(directory).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(CATALOG_DIR, f'catalog_{digest}.json')
+
+
+def _is_audio(name):
+    return os.path.splitext(name)[1].lower() in SUPPORTED_FORMATS
+
+
+class CatalogIndex:
+    """
+    Persistent record of a music directory tree.
+
+    For every directory we keep its mtime, its audio files with their
+    (size, mtime_ns) and its subdirectories. A directory's mtime only changes
+    when entries are added, removed or renamed in it, so an unchanged
+    directory does not need to be listed again. With verify_files=False its
+    files are not stat'ed either, which is what makes rescans of large network
+    mounts fast; in-place edits are then only noticed once the directory
+    changes or a watcher reports it.
+    """
+
+    def __init__(self, root, file_path=None):
+        self.root = os.path.abspath(root)
+        self.file_path = file_path or catalog_path_for(self.root)
+        self.directories = {}
+
+    @classmethod
+    def load(cls, root):
+        catalog = cls(root)
+        try:
+            with open(catalog.file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == CATALOG_VERSION and data.get('root') == catalog.root:
+                catalog.directories = data['directories']
+        except (OSError, ValueError, KeyError):
+            pass
+        return catalog
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        tmp_path = self.file_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': CATALOG_VERSION,
+                'root': self.root,
+                'directories': self.directories,
+            }, f)
+        os.replace(tmp_path, self.file_path)
+
+    def files(self):
+        """{path: (size, mtime_ns)} for every audio file currently recorded"""
+        return {
+            os.path.join(directory, name): tuple(signature)
+            for directory, entry in self.directories.items()
+            for name, signature in entry['files'].items()
+        }
+
+    def scan(self, verify_files=False, dirty=None):
+        """
+        Bring the catalog up to date and report what changed.
+
+        dirty, if given, is the set of directories known to have changed (from a
+        CatalogWatcher); their files are always re-stat'ed and every other
+        recorded directory is trusted without any filesystem access.
+        """
+        previous = self.directories
+        directories = {}
+        self._scan_directory(self.root, directories, verify_files, dirty)
+        self.directories = directories
+
+        # Only directories whose entry was rebuilt can contain changes
+        added, removed, modified = set(), set(), set()
+        for directory in previous.keys() | directories.keys():
+            old = previous.get(directory)
+            new = directories.get(directory)
+            old_files = old['files'] if old is not None else {}
+            new_files = new['files'] if new is not None else {}
+            if old_files is new_files:
+                continue
+            for name, signature in new_files.items():
+                path = os.path.join(directory, name)
+                if name not in old_files:
+                    added.add(path)
+                elif list(old_files[name]) != list(signature):
+                    modified.add(path)
+            removed.update(
+                os.path.join(directory, name) for name in old_files if name not in new_files
+            )
+        return ScanResult(self, added, removed, modified)
+
+    def _scan_directory(self, directory, directories, verify_files, dirty):
+        known = self.directories.get(directory)
+        if dirty is not None and known is not None and directory not in dirty:
+            directories[directory] = known
+            for name in known['subdirs']:
+                self._scan_directory(os.path.join(directory, name), directories, verify_files, dirty)
+            return
+
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return
+
+        if known is not None and known['mtime'] == mtime:
+            # Same entries as last time; files rewritten in place only show up in their stats
+            files = known['files']
+            if verify_files or dirty is not None:
+                files = {}
+                for name in known['files']:
+                    try:
+                        stats = os.stat(os.path.join(directory, name))
+                    except OSError:
+                        continue
+                    files[name] = [stats.st_size, stats.st_mtime_ns]
+            entry = {'mtime': mtime, 'files': files, 'subdirs': known['subdirs']}
+        else:
+            entry = {'mtime': mtime, 'files': {}, 'subdirs': []}
+            try:
+                with os.scandir(directory) as entries:
+                    for item in entries:
+                        try:
+                            # d_type from readdir: no stat needed to tell dirs from files
+                            if item.is_dir(follow_symlinks=False):
+                                entry['subdirs'].append(item.name)
+                            elif _is_audio(item.name) and item.is_file():
+                                stats = item.stat()
+                                entry['files'][item.name] = [stats.st_size, stats.st_mtime_ns]
+                        except OSError:
+                            continue
+            except OSError:
+                return
+
+        directories[directory] = entry
+        for name in entry['subdirs']:
+            self._scan_directory(os.path.join(directory, name), directories, verify_files, dirty)
+
+
+class CatalogWatcher:
+    """
+    Linux inotify watcher that records which catalog directories changed.
+
+    Used while the application runs so a search can rescan only the dirty
+    directories. pop_dirty() returns None when the watcher cannot vouch for
+    the tree (not started, unsupported platform or event queue overflow), in
+    which case callers fall back to a normal scan.
+    """
+
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_NONBLOCK = 0o4000
+    WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                  IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._valid = False
+        self._watches = {}
+        self._watched = set()
+        self._fd = None
+        self._libc = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def is_supported():
+        return sys.platform.startswith('linux')
+
+    def start(self, directories):
+        """Watch the given directories; returns False if inotify is unavailable"""
+        if not self.is_supported():
+            return False
+        import ctypes
+        import ctypes.util
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            self._fd = self._libc.inotify_init1(self.IN_NONBLOCK)
+        except (OSError, AttributeError):
+            return False
+        if self._fd < 0:
+            return False
+
+        self._valid = True
+        self.add_directories(directories)
+        self._thread = threading.Thread(target=self._read_events, daemon=True)
+        self._thread.start()
+        return True
+
+    def add_directories(self, directories):
+        """
+        Watch directories not yet covered. Each one starts out dirty: it was
+        scanned before its watch existed, so the next rescan picks up anything
+        that changed in between.
+        """
+        if self._fd is None:
+            return
+        for directory in directories:
+            if directory in self._watched:
+                continue
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), self.WATCH_MASK)
+            if wd < 0:
+                # Typically ENOSPC (fs.inotify.max_user_watches too low for the
+                # tree); a partially watched tree cannot be trusted
+                self._invalidate()
+                return
+            with self._lock:
+                self._watches[wd] = directory
+                self._watched.add(directory)
+                self._dirty.add(directory)
+
+    def pop_dirty(self):
+        """Directories changed since the last call, or None if a full scan is needed"""
+        with self._lock:
+            if not self._valid:
+                return None
+            dirty, self._dirty = self._dirty, set()
+            return dirty
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._invalidate()
+
+    def _invalidate(self):
+        with self._lock:
+            self._valid = False
+
+    def _read_events(self):
+        import select
+        import struct
+        header = struct.Struct('iIII')
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self._fd], [], [], 0.5)
+            if not ready:
+                continue
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            except OSError:
+                self._invalidate()
+                return
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = header.unpack_from(data, offset)
+                offset += header.size + length
+                if mask & self.IN_Q_OVERFLOW:
+                    self._invalidate()
+                    continue
+                with self._lock:
+                    directory = self._watches.get(wd)
+                    if directory is None:
+                        continue
+                    self._dirty.add(directory)
+                    if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF | self.IN_IGNORED):
+                        # The path no longer names this watch; forget it so a
+                        # directory recreated there gets a fresh one
+                        self._dirty.add(os.path.dirname(directory))
+                        del self._watches[wd]
+                        self._watched.discard(directory)
+                if mask & self.IN_MOVE_SELF:
+                    # Still watching the moved inode under its old path
+                    self._libc.inotify_rm_watch(self._fd, wd)
+
+
+_watchers = {}
+
+
+def get_watcher(directory):
+    return _watchers.get(os.path.abspath(directory))
+
+
+def stop_watching(directory=None):
+    """Stop the watcher for directory, or all watchers"""
+    roots = [os.path.abspath(directory)] if directory else list(_watchers)
+    for root in roots:
+        watcher = _watchers.pop(root, None)
+        if watcher is not None:
+            watcher.stop()
+
+
+def scan_catalog(directory, verify_files=CATALOG_VERIFY_FILES, watch=False):
+    """Load the saved catalog of a music directory and bring it up to date"""
+    return update_catalog(CatalogIndex.load(directory), verify_files, watch)
+
+
+def update_catalog(catalog, verify_files=CATALOG_VERIFY_FILES, watch=False):
+    """
+    Rescan a CatalogIndex using any running watcher, saving it if it changed.
+
+    With a healthy watcher only its dirty directories are touched. watch=True
+    starts a watcher after the scan if none is running; newly discovered
+    directories are added to it so it keeps covering the whole tree.
+    """
+    directory = catalog.root
+    watcher = get_watcher(directory)
+    dirty = watcher.pop_dirty() if watcher is not None else None
+    previous = catalog.directories
+    result = catalog.scan(verify_files=verify_files, dirty=dirty)
+    if catalog.directories != previous or not os.path.exists(catalog.file_path):
+        catalog.save()
+
+    if watcher is not None and dirty is None:
+        # Ran out of watches or overflowed; replace it after this full scan
+        stop_watching(directory)
+        watcher = None
+    if watcher is not None:
+        watcher.add_directories(catalog.directories.keys())
+    elif watch and CatalogWatcher.is_supported():
+        watcher = CatalogWatcher(catalog.root)
+        if watcher.start(catalog.directories.keys()):
+            _watchers[catalog.root] = watcher
+    return result
@@ -0,0 +1,117 @@
+import numpy as np
+
+from config.settings import CLIPPING_THRESHOLD, CLIPPING_MAX_REGIONS
+
+# Clipping regions (runs of consecutive samples at or over CLIPPING_THRESHOLD)
+# per channel, at the file's native rate. Each block is run-length encoded
+# with one diff over a (channels, samples) mask, so every channel is handled
+# by the same few array operations; a run that reaches the end of a block is
+# carried into the next one.
+
+
+class ClippingDetector:
+    """
+    Clipped samples and regions of a signal fed in blocks of (samples, channels).
+
+    Region positions are kept for the first max_regions regions only; counts
+    and lengths cover every region.
+    """
+
+    def __init__(self, sr, channels, threshold=CLIPPING_THRESHOLD, max_regions=CLIPPING_MAX_REGIONS):
+        self.sr = sr
+        self.channels = channels
+        self.threshold = threshold
+        self.max_regions = max_regions
+        self.position = 0  # samples per channel seen so far
+        self.samples = np.zeros(channels, dtype=np.int64)
+        self.regions = np.zeros(channels, dtype=np.int64)
+        self.longest = np.zeros(channels, dtype=np.int64)
+        self._open = np.full(channels, -1, dtype=np.int64)  # start of a run still going at the last block's end
+        self._found = []  # (channel, start, length) arrays
+        self._kept = 0
+
+    def add(self, block):
+        n = len(block)
+        if not n:
+            return
+        # Zero columns on both sides make every run show up as a +1 edge and a -1 edge
+        mask = np.zeros((self.channels, n + 2), dtype=np.int8)
+        np.greater_equal(np.abs(block).T, self.threshold, out=mask[:, 1:-1].view(bool))
+        counts = np.count_nonzero(mask, axis=1)
+        self.samples += counts
+
+        open_channels = np.flatnonzero(self._open >= 0)
+        if not counts.any() and not len(open_channels):
+            self.position += n
+            return
+        edges = np.diff(mask, axis=1)
+        channels, starts = np.nonzero(edges == 1)
+        _, ends = np.nonzero(edges == -1)  # pairs up with starts: same channel order, one end per start
+
+        starts = starts + self.position
+        ends = ends + self.position
+        # Runs open at the previous block's end continue from their original start...
+        continued = (starts == self.position) & (self._open[channels] >= 0)
+        starts[continued] = self._open[channels[continued]]
+        # ...or, if this block starts unclipped, ended exactly at the boundary
+        ended = open_channels[mask[open_channels, 1] == 0]
+        if len(ended):
+            channels = np.concatenate([ended, channels])
+            starts = np.concatenate([self._open[ended], starts])
+            ends = np.concatenate([np.full(len(ended), self.position), ends])
+
+        # Runs reaching this block's end stay open for the next one
+        self._open[:] = -1
+        running = ends == self.position + n
+        self._open[channels[running]] = starts[running]
+        self._record(channels[~running], starts[~running], ends[~running])
+        self.position += n
+
+    def _record(self, channels, starts, ends):
+        if not len(channels):
+            return
+        lengths = ends - starts
+        self.regions += np.bincount(channels, minlength=self.channels)
+        np.maximum.at(self.longest, channels, lengths)
+        room = self.max_regions - self._kept
+        if room > 0:
+            self._found.append(np.stack([channels, starts, lengths], axis=1)[:room])
+            self._kept += min(room, len(channels))
+
+    def result(self):
+        """
+        (summary, regions): summary counts clipped samples and regions per
+        channel (lists, so the dict is JSON-friendly), regions is an int64
+        (n, 3) array of (channel, start sample, length in samples) in time
+        order. Call once, after the last block.
+        """
+        still_open = np.flatnonzero(self._open >= 0)
+        self._record(still_open, self._open[still_open], np.full(len(still_open), self.position))
+        self._open[:] = -1
+
+        regions = np.concatenate(self._found) if self._found else np.zeros((0, 3), dtype=np.int64)
+        regions = regions[np.lexsort((regions[:, 0], regions[:, 1]))]
+        summary = {
+            'threshold': self.threshold,
+            'sample_rate': self.sr,
+            'samples': self.samples.tolist(),
+            'regions': self.regions.tolist(),
+            'longest': self.longest.tolist(),  # samples
+            'truncated': bool(self.regions.sum() > len(regions)),
+        }
+        return summary, regions
+
+
+def describe_clipping(clipping):
+    """One-line human-readable summary of a clipping result"""
+    total = sum(clipping['regions'])
+    if not total:
+        return "none"
+    longest = max(clipping['longest']) / clipping['sample_rate'] * 1000
+    text = f"{sum(clipping['samples'])} samples in {total} regions (longest {longest:.1f} ms)"
+    if len(clipping['regions']) > 1:
+        per_channel = ', '.join(
+            f"ch{channel + 1} {regions}" for channel, regions in enumerate(clipping['regions'])
+        )
+        text += f"; regions per channel: {per_channel}"
+    return text
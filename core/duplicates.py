@@ -0,0 +1,143 @@
+import os
+import numpy as np
+
+from core.cancellation import CancellationToken
+from core.embeddings import embedding_format
+from core.embedding_store import EmbeddingStore
+from core.search import index_directory
+from core.similarity import score_batch
+from config.settings import DEFAULT_DUPLICATE_THRESHOLD, DEFAULT_EMBEDDING_MODE
+
+# Catalog-wide near-duplicate detection. All pairs are scored tile by tile
+# straight from the memory-mapped embedding store, so memory stays bounded by
+# two tiles and their score block however large the catalog is.
+
+# Rows per tile: two 1024 x 16,384 float32 tiles plus a 1024 x 1024 score block
+# is about 140 MB for mel embeddings, and far less in compact mode
+DUPLICATE_BLOCK_SIZE = 1024
+
+
+def _ignore(*args):
+    pass
+
+
+def duplicate_pairs(matrix, threshold=DEFAULT_DUPLICATE_THRESHOLD, rows=None,
+                    block_size=DUPLICATE_BLOCK_SIZE, token=None, progress=None):
+    """
+    Yield (i, j, distance) with i < j for every pair of rows within threshold.
+
+    matrix may be a memmap; rows restricts the search to those row numbers.
+    Only the upper triangle of tiles is scored, each with one matrix product,
+    and only pairs passing the threshold are kept.
+    """
+    progress = progress or _ignore
+    rows = np.arange(len(matrix)) if rows is None else np.asarray(rows)
+    starts = range(0, len(rows), block_size)
+    total = len(starts) * (len(starts) + 1) // 2
+    done = 0
+    for a in starts:
+        rows_a = rows[a:a + block_size]
+        tile_a = np.asarray(matrix[rows_a], dtype=np.float32)
+        for b in starts[a // block_size:]:
+            if token is not None:
+                token.check()
+            rows_b = rows[b:b + block_size]
+            tile_b = tile_a if b == a else np.asarray(matrix[rows_b], dtype=np.float32)
+            distances = score_batch(tile_a, tile_b)
+            hits = distances <= threshold
+            if b == a:
+                hits = np.triu(hits, k=1)
+            for i, j in zip(*np.nonzero(hits)):
+                yield int(rows_a[i]), int(rows_b[j]), float(distances[i, j])
+            done += 1
+            progress(int(done / total * 100))
+
+
+def cluster_pairs(pairs):
+    """Group (i, j, distance) pairs into connected components with union-find"""
+    parent = {}
+
+    def find(x):
+        root = x
+        while parent.setdefault(root, root) != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    nearest = {}
+    for i, j, distance in pairs:
+        parent[find(i)] = find(j)
+        nearest[i] = min(nearest.get(i, distance), distance)
+        nearest[j] = min(nearest.get(j, distance), distance)
+
+    clusters = {}
+    for row in nearest:
+        clusters.setdefault(find(row), []).append(row)
+    return [
+        {row: nearest[row] for row in sorted(members, key=nearest.get)}
+        for members in sorted(clusters.values(), key=len, reverse=True)
+    ]
+
+
+class DuplicateFinder:
+    """
+    Find clusters of near-identical tracks (the same master in several folders
+    or formats) in a music directory.
+
+    run() returns a list of clusters, largest first, each {path: distance to
+    the closest other member}. Tracks are linked when their embeddings are
+    within threshold (cosine distance), and clusters are the connected groups.
+    """
+
+    def __init__(self, directory, threshold=DEFAULT_DUPLICATE_THRESHOLD, workers=None,
+                 embedding_mode=DEFAULT_EMBEDDING_MODE, token=None):
+        self.directory = directory
+        self.threshold = threshold
+        self.workers = workers
+        self.embedding_mode = embedding_mode
+        self.token = token or CancellationToken()
+
+    def run(self, progress=None):
+        progress = progress or _ignore
+        # Embeddings first (cached files are only looked up), then the pair scan
+        index_directory(
+            self.directory, self.embedding_mode, self.workers,
+            progress=lambda value: progress(value // 2), token=self.token
+        )
+        store = EmbeddingStore.open(self.directory, embedding_format(self.embedding_mode))
+        if len(store) < 2:
+            progress(100)
+            return []
+
+        rows = np.array(sorted(store.rows.values()))
+        pairs = duplicate_pairs(
+            store.matrix, self.threshold, rows, token=self.token,
+            progress=lambda value: progress(50 + value // 2)
+        )
+        clusters = cluster_pairs(pairs)
+        progress(100)
+        return [
+            {store.row_paths[row]: distance for row, distance in cluster.items()}
+            for cluster in clusters
+        ]
+
+
+def cluster_rows(clusters):
+    """Flatten clusters into export rows: cluster, path, name, format, size, distance"""
+    rows = []
+    for number, cluster in enumerate(clusters, start=1):
+        for path, distance in cluster.items():
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = None
+            rows.append({
+                'cluster': number,
+                'path': path,
+                'name': os.path.basename(path),
+                'format': os.path.splitext(path)[1].lstrip('.').lower(),
+                'size': size,
+                'distance': round(distance, 6),
+            })
+    return rows
@@ -0,0 +1,160 @@
+import os
+import sqlite3
+import threading
+import numpy as np
+
+from config.settings import EMBEDDING_CACHE_PATH
+from core.embeddings import embedding_format
+
+# Bump whenever the table layout changes; older caches are dropped and rebuilt
+SCHEMA_VERSION = 2
+
+
+def file_signature(file_path):
+    """Return the (size, mtime) pair used to detect changed files"""
+    stats = os.stat(file_path)
+    return stats.st_size, stats.st_mtime_ns
+
+
+class EmbeddingCache:
+    """
+    Persistent on-disk store of audio embeddings keyed by path, size and mtime.
+
+    Each row also records the embedding format (see embedding_format), so
+    embeddings of different modes or versions can coexist and never mix.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or EMBEDDING_CACHE_PATH
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._init_schema()
+
+    def _init_schema(self):
+        version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self._conn.execute('DROP TABLE IF EXISTS embeddings')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                path TEXT NOT NULL,
+                format TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                dtype TEXT,
+                embedding BLOB,
+                PRIMARY KEY (path, format)
+            )
+        """)
+        self._conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        self._conn.commit()
+
+    def lookup(self, file_paths, fmt=None, signatures=None):
+        """
+        Split file_paths into fresh and stale entries.
+
+        A path is fresh when it is cached and its size and mtime still match;
+        everything else (new, modified or unreadable files) is stale. Only the
+        metadata columns are read, so this is cheap even for large catalogs.
+        signatures ({path: (size, mtime)}, e.g. from a catalog scan) avoids
+        stat'ing the files again.
+        """
+        fmt = fmt or embedding_format()
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT path, size, mtime FROM embeddings WHERE format = ?', (fmt,)
+            ).fetchall()
+        known = {row[0]: (row[1], row[2]) for row in rows}
+
+        fresh = []
+        stale = []
+        for path in file_paths:
+            try:
+                if signatures is not None and path in signatures:
+                    signature = tuple(signatures[path])
+                else:
+                    signature = file_signature(path)
+                is_fresh = known.get(path) == signature
+            except OSError:
+                is_fresh = False
+            if is_fresh:
+                fresh.append(path)
+            else:
+                stale.append(path)
+        return fresh, stale
+
+    def iter_embeddings(self, file_paths, fmt=None):
+        """
+        Yield (path, embedding) for each of file_paths present in the cache.
+
+        Files that previously failed to decode are cached as None so they are
+        not retried until they change.
+        """
+        fmt = fmt or embedding_format()
+        for path in file_paths:
+            with self._lock:
+                row = self._conn.execute(
+                    'SELECT dtype, embedding FROM embeddings WHERE path = ? AND format = ?',
+                    (path, fmt)
+                ).fetchone()
+            if row is None:
+                continue
+            dtype, blob = row
+            yield path, None if blob is None else np.frombuffer(blob, dtype=dtype)
+
+    def get(self, file_path, fmt=None):
+        """Return the cached embedding for file_path, or None if missing or stale"""
+        fresh, _ = self.lookup([file_path], fmt)
+        if not fresh:
+            return None
+        for _, embedding in self.iter_embeddings(fresh, fmt):
+            return embedding
+        return None
+
+    def put(self, file_path, embedding, fmt=None):
+        """Store an embedding (or None for an undecodable file); call commit() to persist"""
+        try:
+            size, mtime = file_signature(file_path)
+        except OSError:
+            return
+        if embedding is None:
+            dtype, blob = None, None
+        else:
+            embedding = np.ascontiguousarray(embedding)
+            dtype, blob = embedding.dtype.str, embedding.tobytes()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO embeddings (path, format, size, mtime, dtype, embedding) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (file_path, fmt or embedding_format(), size, mtime, dtype, blob)
+            )
+
+    def remove(self, file_paths):
+        """Drop all formats cached for file_paths (e.g. files deleted from the catalog)"""
+        with self._lock:
+            self._conn.executemany(
+                'DELETE FROM embeddings WHERE path = ?', [(path,) for path in file_paths]
+            )
+            self._conn.commit()
+
+    def prune(self, existing_paths, directory=None):
+        """Drop entries under directory for files that are no longer in the catalog"""
+        existing = set(existing_paths)
+        prefix = os.path.join(directory, '') if directory else ''
+        with self._lock:
+            rows = self._conn.execute('SELECT DISTINCT path FROM embeddings').fetchall()
+            removed = [
+                (row[0],) for row in rows
+                if row[0].startswith(prefix) and row[0] not in existing
+            ]
+            self._conn.executemany('DELETE FROM embeddings WHERE path = ?', removed)
+            self._conn.commit()
+        return len(removed)
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
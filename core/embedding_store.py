@@ -0,0 +1,375 @@
+import os
+import json
+import hashlib
+import contextlib
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+from config.settings import EMBEDDING_STORE_DIR
+
+# Version of the on-disk store layout; stores with another version are rebuilt
+STORE_VERSION = 1
+
+# Compact once dead rows outnumber live ones (and there are at least this many)
+COMPACT_MIN_DEAD = 1024
+
+# Rows copied per write while compacting
+_BLOCK_SIZE = 4096
+
+
+def store_path_for(directory, fmt=''):
+    """Base path (without extension) of the store for a music directory and embedding format"""
+    key = f'{os.path.abspath(directory)}|{fmt}'
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(EMBEDDING_STORE_DIR, f'store_{digest}')
+
+
+class EmbeddingStore:
+    """
+    Append-only, memory-mapped matrix of the embeddings of one catalog.
+
+    Vectors live in <base>.vec as fixed-stride rows of the embedding's own
+    dtype (float32 for mel, float16 for compact), opened with numpy.memmap so
+    searches page rows in on demand and concurrent processes share the OS page
+    cache instead of each holding a copy. <base>.rows is the sidecar table: a
+    JSON header line, then one JSON line per appended row (["+", size, mtime,
+    path]; the row number is its position) or removal (["-", row]). Adding
+    tracks appends to both files; replaced and removed rows are only marked
+    dead until compact() rewrites the store.
+
+    Writers hold an exclusive flock on <base>.lock and readers a shared one
+    while they catch up with the sidecar, so a store can be shared by the GUI,
+    the CLI and `mast serve`.
+    """
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self.vectors_path = base_path + '.vec'
+        self.rows_path = base_path + '.rows'
+        self.lock_path = base_path + '.lock'
+        self.dim = None
+        self.dtype = None
+        self.row_paths = []       # path of every row, None once dead
+        self.row_signatures = []  # (size, mtime) of every row
+        self.rows = {}            # live path -> row
+        self._rows_ino = None
+        self._rows_offset = 0
+        self._matrix = None
+        self._dead_rows = None
+
+    @classmethod
+    def open(cls, directory, fmt=''):
+        store = cls(store_path_for(directory, fmt))
+        store.reload()
+        return store
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, path):
+        return path in self.rows
+
+    @property
+    def row_count(self):
+        """Rows in the vector file, dead ones included"""
+        return len(self.row_paths)
+
+    @property
+    def dead_count(self):
+        return self.row_count - len(self.rows)
+
+    @property
+    def dead_rows(self):
+        """Row numbers of dead rows, for masking scores of the whole matrix"""
+        if self._dead_rows is None:
+            self._dead_rows = np.array(
+                [row for row, path in enumerate(self.row_paths) if path is None], dtype=np.int64
+            )
+        return self._dead_rows
+
+    @property
+    def generation(self):
+        """Changes whenever the store is rewritten and its rows are renumbered"""
+        return self._rows_ino
+
+    @property
+    def stride(self):
+        return self.dim * np.dtype(self.dtype).itemsize
+
+    @contextlib.contextmanager
+    def _locked(self, exclusive):
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(self.lock_path) or '.', exist_ok=True)
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _reset(self):
+        self.dim = None
+        self.dtype = None
+        self.row_paths = []
+        self.row_signatures = []
+        self.rows = {}
+        self._rows_ino = None
+        self._rows_offset = 0
+        self._matrix = None
+        self._dead_rows = None
+
+    def _apply(self, entry):
+        if entry[0] == '+':
+            _, size, mtime, path = entry
+            previous = self.rows.get(path)
+            if previous is not None:
+                self.row_paths[previous] = None
+            self.rows[path] = len(self.row_paths)
+            self.row_paths.append(path)
+            self.row_signatures.append((size, mtime))
+        elif entry[0] == '-':
+            row = entry[1]
+            path = self.row_paths[row]
+            if path is not None and self.rows.get(path) == row:
+                del self.rows[path]
+            self.row_paths[row] = None
+
+    def _read_rows(self):
+        """Catch up with the sidecar, re-reading it fully if it was replaced"""
+        try:
+            stats = os.stat(self.rows_path)
+        except FileNotFoundError:
+            self._reset()
+            return
+        if stats.st_ino != self._rows_ino:
+            self._reset()
+        if stats.st_size == self._rows_offset:
+            return
+        with open(self.rows_path, 'rb') as f:
+            f.seek(self._rows_offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1  # ignore a torn final line
+        for line in data[:end].splitlines():
+            entry = json.loads(line)
+            if isinstance(entry, dict):
+                if entry.get('version') != STORE_VERSION:
+                    self._reset()
+                    return
+                self.dim = entry['dim']
+                self.dtype = entry['dtype']
+            else:
+                self._apply(entry)
+        self._rows_ino = stats.st_ino
+        self._rows_offset += end
+        self._matrix = None
+        self._dead_rows = None
+
+    def reload(self):
+        """Pick up rows appended (or a compaction done) by other processes"""
+        with self._locked(exclusive=False):
+            self._read_rows()
+            if self.dim is None and os.path.exists(self.rows_path):
+                # Unreadable or outdated layout: start over on the next append
+                self._remove_files()
+            self._open_matrix()
+
+    def _open_matrix(self):
+        if self._matrix is not None or self.dim is None:
+            return
+        if self.row_count == 0:
+            self._matrix = np.empty((0, self.dim), dtype=self.dtype)
+        else:
+            self._matrix = np.memmap(
+                self.vectors_path, dtype=self.dtype, mode='r', shape=(self.row_count, self.dim)
+            )
+
+    @property
+    def matrix(self):
+        """Read-only (row_count, dim) memmap of every row, dead ones included"""
+        self._open_matrix()
+        return self._matrix
+
+    def _remove_files(self):
+        for path in (self.vectors_path, self.rows_path):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+        self._reset()
+
+    def _write_header(self, dim, dtype):
+        header = {'version': STORE_VERSION, 'dim': int(dim), 'dtype': np.dtype(dtype).str}
+        with open(self.rows_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(header) + '\n')
+        open(self.vectors_path, 'wb').close()
+
+    def append(self, paths, vectors, signatures):
+        """
+        Append embeddings for paths, replacing any rows they already have.
+
+        vectors is (N, dim) and signatures gives each path's (size, mtime).
+        The first append fixes the store's dimension and dtype.
+        """
+        if len(paths) == 0:
+            return
+        vectors = np.ascontiguousarray(vectors)
+        with self._locked(exclusive=True):
+            self._read_rows()
+            if self.dim is None:
+                os.makedirs(os.path.dirname(self.base_path) or '.', exist_ok=True)
+                self._write_header(vectors.shape[1], vectors.dtype)
+                self._read_rows()
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Store holds {self.dim}-dimensional embeddings, got {vectors.shape[1]}")
+            vectors = vectors.astype(self.dtype, copy=False)
+
+            # Vectors first, so the sidecar never references missing rows; a
+            # crash between the two writes leaves bytes that are truncated here
+            with open(self.vectors_path, 'r+b') as f:
+                f.truncate(self.row_count * self.stride)
+                f.seek(0, os.SEEK_END)
+                f.write(vectors.tobytes())
+            lines = [
+                json.dumps(['+', int(signatures[path][0]), int(signatures[path][1]), path])
+                for path in paths
+            ]
+            with open(self.rows_path, 'a', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+            self._read_rows()
+
+    def remove(self, paths):
+        """Mark the rows of paths as dead; unknown paths are ignored"""
+        with self._locked(exclusive=True):
+            self._read_rows()
+            dead = [self.rows[path] for path in paths if path in self.rows]
+            if not dead:
+                return
+            with open(self.rows_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(['-', row]) + '\n' for row in dead))
+            self._read_rows()
+
+    def compact(self, force=False):
+        """Rewrite the store without dead rows once they outnumber live ones"""
+        with self._locked(exclusive=True):
+            self._read_rows()
+            if self.dim is None:
+                return False
+            if not force and (self.dead_count < COMPACT_MIN_DEAD or self.dead_count <= len(self.rows)):
+                return False
+            matrix = self.matrix
+            live = np.flatnonzero([path is not None for path in self.row_paths])
+            tmp_vectors = self.vectors_path + '.tmp'
+            tmp_rows = self.rows_path + '.tmp'
+            with open(tmp_vectors, 'wb') as f:
+                for start in range(0, len(live), _BLOCK_SIZE):
+                    f.write(np.ascontiguousarray(matrix[live[start:start + _BLOCK_SIZE]]).tobytes())
+            header = {'version': STORE_VERSION, 'dim': self.dim, 'dtype': self.dtype}
+            with open(tmp_rows, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(header) + '\n')
+                for row in live:
+                    size, mtime = self.row_signatures[row]
+                    f.write(json.dumps(['+', size, mtime, self.row_paths[row]]) + '\n')
+            # Readers hold the shared lock while opening both files, so they
+            # never pair the new sidecar with the old vectors
+            os.replace(tmp_vectors, self.vectors_path)
+            os.replace(tmp_rows, self.rows_path)
+            self._read_rows()
+            return True
+
+    def blocks(self, block_size, exclude=()):
+        """Yield (paths, vectors) for the live rows in blocks of up to block_size rows"""
+        matrix = self.matrix
+        if matrix is None:
+            return
+        for start in range(0, self.row_count, block_size):
+            paths = self.row_paths[start:start + block_size]
+            keep = [i for i, path in enumerate(paths) if path is not None and path not in exclude]
+            if not keep:
+                continue
+            block = matrix[start:start + len(paths)]
+            if len(keep) == len(paths):
+                yield paths, np.asarray(block)
+            else:
+                yield [paths[i] for i in keep], block[keep]
+
+    def take(self, rows, block_size):
+        """Yield (paths, vectors) for the given row numbers in blocks of up to block_size"""
+        matrix = self.matrix
+        rows = np.asarray(rows, dtype=np.int64)
+        for start in range(0, len(rows), block_size):
+            chunk = rows[start:start + block_size]
+            yield [self.row_paths[row] for row in chunk], matrix[chunk]
+
+    def sample(self, n, rng=None):
+        """Up to n live embeddings drawn at random"""
+        rng = rng or np.random.default_rng()
+        live = [row for row in self.rows.values()]
+        if not live:
+            return np.empty((0, self.dim or 0), dtype=self.dtype or np.float32)
+        chosen = np.sort(rng.choice(live, min(n, len(live)), replace=False))
+        return np.asarray(self.matrix[chosen])
+
+
+def sync_store(store, cache, signatures, fmt=None):
+    """
+    Make store match the catalog described by signatures ({path: (size, mtime)}).
+
+    Rows of files that were removed or changed are dropped and embeddings the
+    EmbeddingCache holds for the remaining catalog files are appended, so after
+    a cache update the store only needs the rows that are actually new.
+    """
+    outdated = [
+        path for path, row in store.rows.items()
+        if tuple(signatures.get(path, ())) != tuple(store.row_signatures[row])
+    ]
+    if outdated:
+        store.remove(outdated)
+
+    missing = [path for path in signatures if path not in store]
+    if missing:
+        fresh, _ = cache.lookup(missing, fmt, signatures)
+        paths, vectors = [], []
+
+        def flush():
+            if paths:
+                store.append(paths, np.vstack(vectors), signatures)
+                paths.clear()
+                vectors.clear()
+
+        for path, embedding in cache.iter_embeddings(fresh, fmt):
+            if embedding is None:
+                continue
+            if store.dim is not None and embedding.shape != (store.dim,):
+                continue
+            if store.dim is None and vectors and embedding.shape != vectors[0].shape:
+                continue
+            paths.append(path)
+            vectors.append(embedding)
+            if len(paths) >= _BLOCK_SIZE:
+                flush()
+        flush()
+    store.compact()
+
+
+def sync_derived(derived, source, transform):
+    """
+    Keep derived holding transform(vector) for every live row of source.
+
+    Used for small per-track signatures computed from the stored embeddings,
+    so deriving them never needs the audio again.
+    """
+    signatures = {path: source.row_signatures[row] for path, row in source.rows.items()}
+    outdated = [
+        path for path, row in derived.rows.items()
+        if tuple(signatures.get(path, ())) != tuple(derived.row_signatures[row])
+    ]
+    if outdated:
+        derived.remove(outdated)
+    missing = sorted(source.rows[path] for path in signatures if path not in derived)
+    for paths, vectors in source.take(missing, _BLOCK_SIZE):
+        derived.append(paths, transform(vectors), signatures)
+    derived.compact()
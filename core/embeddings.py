@@ -0,0 +1,237 @@
+import os
+import hashlib
+import functools
+import numpy as np
+
+from config.settings import (
+    MAX_ANALYSIS_DURATION, EMBEDDING_PCA_PATH, DEFAULT_EMBEDDING_MODE, EMBEDDING_OFFSET
+)
+from core.audio_io import load_excerpt
+
+# Kept free of PyQt5 imports so worker processes start quickly
+
+# Embedding modes and the format tag stored alongside cached vectors.
+# Bump a version whenever the extracted features change.
+EMBEDDING_FORMATS = {
+    'mel': 'mel-v1',          # 128x128 mel block flattened to 16,384 float32
+    'compact': 'stats-v1',    # pooled mel statistics, 896 float16
+}
+
+
+def embedding_format(mode=DEFAULT_EMBEDDING_MODE, offset=EMBEDDING_OFFSET):
+    """Format tag for embeddings produced in the given mode and excerpt offset"""
+    if mode not in EMBEDDING_FORMATS:
+        raise ValueError(f"Unknown embedding mode: {mode}")
+    if offset:
+        return f'{EMBEDDING_FORMATS[mode]}@{offset}'
+    return EMBEDDING_FORMATS[mode]
+
+
+def extract_embedding(file_path, mode=DEFAULT_EMBEDDING_MODE, offset=EMBEDDING_OFFSET):
+    """Extract an embedding in the given mode; returns None on failure"""
+    if mode == 'compact':
+        return extract_compact_embedding(file_path, offset)
+    return extract_audio_embedding(file_path, offset=offset)
+
+
+def extract_audio_embedding(file_path, max_length=128, offset=EMBEDDING_OFFSET,
+                            sr=22050, hop_length=512, n_fft=2048):
+    try:
+        import librosa
+        # Decode just enough audio for max_length frames instead of 30 seconds
+        window = (max_length * hop_length + n_fft) / sr
+        y, sr = load_excerpt(file_path, sr=sr, duration=window, offset=offset)
+        mel_spec = librosa.feature.melspectrogram(y=y, sr=sr, n_fft=n_fft, hop_length=hop_length)
+        mel_spec = librosa.power_to_db(mel_spec)
+
+        if mel_spec.shape[1] > max_length:
+            mel_spec = mel_spec[:, :max_length]
+        else:
+            pad_width = max_length - mel_spec.shape[1]
+            mel_spec = np.pad(mel_spec, ((0,0),(0,pad_width)), mode='constant')
+
+        embedding = mel_spec.flatten()
+        return embedding / np.linalg.norm(embedding)
+    except Exception as e:
+        print(f"Error processing {file_path}: {e}")
+        return None
+
+
+def extract_compact_embedding(file_path, offset=EMBEDDING_OFFSET):
+    """
+    Pooled mel statistics over the whole analysis window.
+
+    Pooling over time makes the embedding independent of where in the excerpt
+    a musical event happens and needs no padding for short files.
+    """
+    try:
+        import librosa
+        y, sr = load_excerpt(file_path, duration=MAX_ANALYSIS_DURATION, offset=offset)
+        mel_spec = librosa.power_to_db(librosa.feature.melspectrogram(y=y, sr=sr))
+        return compact_features(mel_spec)
+    except Exception as e:
+        print(f"Error processing {file_path}: {e}")
+        return None
+
+
+def compact_features(mel_db):
+    """
+    Per-band mean, std, 10/50/90th percentiles and delta statistics of a dB mel
+    spectrogram, L2-normalized and stored as float16 (7 values per band).
+    """
+    if mel_db.shape[1] < 2:
+        raise ValueError("Audio too short for a compact embedding")
+    # Remove overall level so tracks mastered at different loudness still match
+    centered = mel_db - np.mean(mel_db)
+    delta = np.diff(mel_db, axis=1)
+    features = np.concatenate([
+        np.mean(centered, axis=1),
+        np.std(mel_db, axis=1),
+        *np.percentile(centered, [10, 50, 90], axis=1),
+        np.mean(np.abs(delta), axis=1),
+        np.std(delta, axis=1),
+    ])
+    return (features / np.linalg.norm(features)).astype(np.float16)
+
+
+# Size of the coarse signatures used by two-stage search, and the seed of
+# the fixed projection producing them
+COARSE_DIMENSIONS = 64
+COARSE_SEED = 1770
+
+
+def coarse_format(fmt, dims=COARSE_DIMENSIONS):
+    """Format tag of the coarse signatures derived from embeddings of format fmt"""
+    return f'{fmt}-rp{dims}.{COARSE_SEED}'
+
+
+@functools.lru_cache(maxsize=4)
+def _coarse_basis(input_dim, dims):
+    rng = np.random.default_rng(COARSE_SEED)
+    return rng.standard_normal((input_dim, dims), dtype=np.float32)
+
+
+def coarse_signature(embeddings, dims=COARSE_DIMENSIONS):
+    """
+    Low-dimensional signature of embeddings for the first stage of a search.
+
+    A fixed Gaussian random projection: inner products, and so cosine
+    distances, are preserved in expectation, while scoring a signature costs
+    a few dozen multiply-adds instead of 16,384. It needs no fitting, so a
+    track's signature never changes. Accepts one embedding or an (N, D) stack
+    and returns L2-normalized float32.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    signatures = np.atleast_2d(embeddings) @ _coarse_basis(embeddings.shape[-1], dims)
+    signatures /= np.maximum(np.linalg.norm(signatures, axis=1, keepdims=True), 1e-12)
+    return signatures[0] if embeddings.ndim == 1 else signatures
+
+
+class EmbeddingProjection:
+    """
+    PCA projection that reduces compact embeddings to a few hundred dimensions.
+
+    The projection is fitted once on a sample of the catalog and stored under
+    DATA_DIR; its id becomes part of the format of everything derived from it.
+    """
+
+    def __init__(self, mean, components):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32)
+        digest = hashlib.sha1(self.components.tobytes()).hexdigest()[:8]
+        self.id = f'pca{self.components.shape[1]}-{digest}'
+
+    @property
+    def input_dim(self):
+        return self.components.shape[0]
+
+    @classmethod
+    def fit(cls, vectors, n_components=128):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        mean = vectors.mean(axis=0)
+        _, _, vt = np.linalg.svd(vectors - mean, full_matrices=False)
+        n_components = min(n_components, vt.shape[0])
+        return cls(mean, vt[:n_components].T)
+
+    def apply(self, vectors):
+        """Project (N, D) or (D,) vectors and re-normalize them, returning float16"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        projected = (vectors - self.mean) @ self.components
+        norms = np.linalg.norm(projected, axis=-1, keepdims=True)
+        return (projected / np.maximum(norms, 1e-12)).astype(np.float16)
+
+    def save(self, file_path=None):
+        file_path = file_path or EMBEDDING_PCA_PATH
+        tmp_path = file_path + '.tmp.npz'
+        np.savez(tmp_path, mean=self.mean, components=self.components)
+        os.replace(tmp_path, file_path)
+
+    @classmethod
+    def load(cls, file_path=None):
+        """Load the stored projection, or None if none has been fitted yet"""
+        file_path = file_path or EMBEDDING_PCA_PATH
+        if not os.path.exists(file_path):
+            return None
+        with np.load(file_path) as data:
+            return cls(data['mean'], data['components'])
+
+
+def default_worker_count():
+    """Number of physical cores, falling back to logical cores"""
+    try:
+        import psutil
+        count = psutil.cpu_count(logical=False)
+    except ImportError:
+        count = None
+    return count or os.cpu_count() or 1
+
+
+def _init_worker():
+    # One BLAS thread per process, otherwise N workers oversubscribe the CPU
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(1)
+    except ImportError:
+        pass
+
+
+def extract_embeddings_parallel(file_paths, workers=None, mode=DEFAULT_EMBEDDING_MODE):
+    """
+    Extract embeddings in a process pool, yielding (path, embedding) as they finish.
+
+    At most a few tasks per worker are in flight at once, so memory stays bounded
+    and the consumer can stop early by simply not iterating further.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+    workers = workers or default_worker_count()
+    pending_paths = iter(file_paths)
+    max_in_flight = workers * 4
+
+    # spawn avoids forking a process that already runs Qt and BLAS threads
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker) as executor:
+        in_flight = {}
+        try:
+            while True:
+                for path in pending_paths:
+                    in_flight[executor.submit(extract_embedding, path, mode)] = path
+                    if len(in_flight) >= max_in_flight:
+                        break
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = in_flight.pop(future)
+                    try:
+                        embedding = future.result()
+                    except Exception as e:
+                        print(f"Error processing {path}: {e}")
+                        embedding = None
+                    yield path, embedding
+        finally:
+            for future in in_flight:
+                future.cancel()
@@ -0,0 +1,199 @@
+import asyncio
+import functools
+from collections import namedtuple
+
+from core.cancellation import CancellationToken
+from core.embeddings import extract_embedding
+from core.search import SimilaritySearch, index_directory
+from core.duplicates import DuplicateFinder
+from core.mastering import master_track
+from core.analyzer import analysis_summary
+from core.analysis_cache import shared_cache
+from config.settings import (
+    DEFAULT_SIMILARITY_THRESHOLD, DEFAULT_MAX_RESULTS, DEFAULT_ANN_NPROBE,
+    DEFAULT_EMBEDDING_MODE, DEFAULT_DUPLICATE_THRESHOLD, DEFAULT_CANDIDATE_POOL,
+    DEFAULT_ANALYSIS_DEPTH
+)
+
+# Pure-Python entry point to analysis, embedding, search and mastering. Nothing
+# here imports PyQt5; the UI uses the QThread adapters in core.workers and the
+# CLI and services call the engine directly.
+
+# Item yielded by AsyncEngine event streams: kind is 'progress' (percentage),
+# 'partial' (interim results) or 'result' (the return value, always last)
+EngineEvent = namedtuple('EngineEvent', ['kind', 'value'])
+
+
+class Engine:
+    """
+    Synchronous engine API.
+
+    Long-running methods accept a CancellationToken and a progress callback
+    and raise core.cancellation.CancelledError when cancelled; failures raise
+    ordinary exceptions instead of being reported through signals.
+    """
+
+    def __init__(self, embedding_mode=DEFAULT_EMBEDDING_MODE, workers=None, use_cache=True):
+        self.embedding_mode = embedding_mode
+        # 1 decodes in the calling thread, None uses one process per physical core
+        self.workers = workers
+        self.use_cache = use_cache
+
+    def embed(self, file_path):
+        """Embedding of one file in the engine's mode (not cached)"""
+        embedding = extract_embedding(file_path, self.embedding_mode)
+        if embedding is None:
+            raise RuntimeError(f"Could not extract embedding for {file_path}")
+        return embedding
+
+    def search(self, reference_song, directory, threshold=DEFAULT_SIMILARITY_THRESHOLD,
+               max_results=DEFAULT_MAX_RESULTS, nprobe=DEFAULT_ANN_NPROBE, token=None,
+               progress=None, partial=None, candidate_pool=DEFAULT_CANDIDATE_POOL):
+        """{path: distance} of the songs in directory closest to reference_song"""
+        results = self.search_many(
+            [reference_song], directory, threshold, max_results, nprobe, token, progress,
+            partial=partial and (lambda results: partial(results[reference_song])),
+            skip_failed=False, candidate_pool=candidate_pool
+        )
+        return results[reference_song]
+
+    def search_many(self, reference_songs, directory, threshold=DEFAULT_SIMILARITY_THRESHOLD,
+                    max_results=DEFAULT_MAX_RESULTS, nprobe=DEFAULT_ANN_NPROBE, token=None,
+                    progress=None, partial=None, skip_failed=True,
+                    candidate_pool=DEFAULT_CANDIDATE_POOL):
+        """{reference: {path: distance}} for several references in one catalog pass"""
+        search = SimilaritySearch(
+            reference_songs, directory, threshold, max_results, self.use_cache,
+            self.workers, nprobe, self.embedding_mode, token, skip_failed=skip_failed,
+            candidate_pool=candidate_pool
+        )
+        return search.run(progress=progress, partial=partial)
+
+    def index(self, directory, nprobe=DEFAULT_ANN_NPROBE, token=None, progress=None):
+        """Cache embeddings (and build the ANN index) for directory; returns file counts"""
+        return index_directory(
+            directory, self.embedding_mode, self.workers, nprobe, progress=progress, token=token
+        )
+
+    def duplicates(self, directory, threshold=DEFAULT_DUPLICATE_THRESHOLD, token=None,
+                   progress=None):
+        """Clusters of near-identical tracks in directory, each {path: distance}"""
+        finder = DuplicateFinder(directory, threshold, self.workers, self.embedding_mode, token)
+        return finder.run(progress=progress)
+
+    def analyze(self, file_path, token=None, progress=None, depth=DEFAULT_ANALYSIS_DEPTH,
+                budget=None):
+        """Duration, tempo, key and loudness of file_path at depth, or within budget seconds"""
+        analysis = shared_cache().analyze(
+            file_path, progress=progress, token=token, depth=depth, budget=budget
+        )
+        if analysis is None:
+            raise RuntimeError(f"Could not analyze {file_path}")
+        return analysis_summary(analysis)
+
+    def master(self, target_path, reference_path, output_path, options, token=None,
+               progress=None):
+        """Master target_path to match reference_path; returns output_path"""
+        return master_track(
+            target_path, reference_path, output_path, options, token=token, progress=progress
+        )
+
+
+class AsyncEngine:
+    """
+    asyncio front end to Engine.
+
+    Each method runs the synchronous call in an executor thread, so the event
+    loop stays responsive: ``await engine.search(...)``. Cancelling the
+    awaiting task cancels the underlying work through its token. The
+    *_events methods return async iterators of EngineEvent instead, for
+    callers that want progress and partial results as they arrive.
+    """
+
+    def __init__(self, engine=None, executor=None):
+        self.engine = engine or Engine()
+        self.executor = executor
+
+    async def _call(self, method, *args, **kwargs):
+        token = kwargs.pop('token', None) or CancellationToken()
+        loop = asyncio.get_running_loop()
+        call = functools.partial(method, *args, token=token, **kwargs)
+        future = loop.run_in_executor(self.executor, call)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            token.cancel()
+            try:
+                await future
+            except Exception:
+                pass  # CancelledError from the token, or whatever stopped the work
+            raise
+
+    async def _events(self, method, *args, partial=False, **kwargs):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def emit(kind, value):
+            loop.call_soon_threadsafe(queue.put_nowait, EngineEvent(kind, value))
+
+        kwargs['progress'] = lambda value: emit('progress', value)
+        if partial:
+            kwargs['partial'] = lambda value: emit('partial', value)
+        task = asyncio.ensure_future(self._call(method, *args, **kwargs))
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield event
+            yield EngineEvent('result', task.result())
+        finally:
+            if not task.done():
+                task.cancel()
+
+    async def embed(self, file_path):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.engine.embed, file_path)
+
+    async def search(self, reference_song, directory, **kwargs):
+        return await self._call(self.engine.search, reference_song, directory, **kwargs)
+
+    async def search_many(self, reference_songs, directory, **kwargs):
+        return await self._call(self.engine.search_many, reference_songs, directory, **kwargs)
+
+    async def index(self, directory, **kwargs):
+        return await self._call(self.engine.index, directory, **kwargs)
+
+    async def duplicates(self, directory, **kwargs):
+        return await self._call(self.engine.duplicates, directory, **kwargs)
+
+    async def analyze(self, file_path, **kwargs):
+        return await self._call(self.engine.analyze, file_path, **kwargs)
+
+    async def master(self, target_path, reference_path, output_path, options, **kwargs):
+        return await self._call(
+            self.engine.master, target_path, reference_path, output_path, options, **kwargs
+        )
+
+    def search_events(self, reference_song, directory, **kwargs):
+        return self._events(self.engine.search, reference_song, directory, partial=True, **kwargs)
+
+    def search_many_events(self, reference_songs, directory, **kwargs):
+        return self._events(
+            self.engine.search_many, reference_songs, directory, partial=True, **kwargs
+        )
+
+    def index_events(self, directory, **kwargs):
+        return self._events(self.engine.index, directory, **kwargs)
+
+    def duplicates_events(self, directory, **kwargs):
+        return self._events(self.engine.duplicates, directory, **kwargs)
+
+    def analyze_events(self, file_path, **kwargs):
+        return self._events(self.engine.analyze, file_path, **kwargs)
+
+    def master_events(self, target_path, reference_path, output_path, options, **kwargs):
+        return self._events(
+            self.engine.master, target_path, reference_path, output_path, options, **kwargs
+        )
@@ -0,0 +1,111 @@
+from functools import cached_property
+import numpy as np
+
+# Shared spectral features for track analysis. librosa's feature functions each
+# run their own STFT when handed a signal; a FeatureGraph runs it once per file
+# and derives every feature from that magnitude spectrogram, computing each one
+# only when it is first asked for. The CQT is never part of the shared path.
+
+ANALYSIS_N_FFT = 2048
+ANALYSIS_HOP_LENGTH = 512
+CQT_SAMPLE_RATE = 11025  # the chroma CQT's 7 octaves from C1 end below 4.2 kHz
+CQT_EXCERPT_DURATION = 60  # seconds from the middle of the track used for the chroma CQT
+
+
+def rms_from_magnitude(magnitude, n_fft=ANALYSIS_N_FFT, hop_length=ANALYSIS_HOP_LENGTH):
+    """Frame RMS from Hann-windowed STFT magnitudes, on the scale of librosa.feature.rms(y=...)"""
+    import librosa
+    # Dividing by the window's own RMS undoes the windowing
+    window = librosa.filters.get_window('hann', n_fft, fftbins=True)
+    rms = librosa.feature.rms(S=magnitude, frame_length=n_fft, hop_length=hop_length)[0]
+    return rms / np.sqrt(np.mean(window ** 2))
+
+
+class FeatureGraph:
+    """
+    Lazily computed features of one signal, all built on a single STFT.
+
+    Attributes are evaluated on first access and kept, so asking for rms,
+    chroma and the tempo costs one STFT and one mel projection in total.
+    """
+
+    def __init__(self, y, sr, n_fft=ANALYSIS_N_FFT, hop_length=ANALYSIS_HOP_LENGTH):
+        import librosa
+        self._librosa = librosa
+        self.y = y
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+
+    @cached_property
+    def duration(self):
+        return len(self.y) / self.sr
+
+    @cached_property
+    def magnitude(self):
+        return np.abs(self._librosa.stft(self.y, n_fft=self.n_fft, hop_length=self.hop_length))
+
+    @cached_property
+    def power(self):
+        return self.magnitude ** 2
+
+    @cached_property
+    def rms(self):
+        return rms_from_magnitude(self.magnitude, self.n_fft, self.hop_length)
+
+    @cached_property
+    def centroid(self):
+        return self._librosa.feature.spectral_centroid(
+            S=self.magnitude, sr=self.sr, n_fft=self.n_fft, hop_length=self.hop_length
+        )[0]
+
+    @cached_property
+    def chroma(self):
+        # tuning=0 skips librosa's pitch-tracking tuning estimate, which costs
+        # more than the STFT itself and does not move 12-bin key profiles
+        return self._librosa.feature.chroma_stft(
+            S=self.power, sr=self.sr, n_fft=self.n_fft, hop_length=self.hop_length, tuning=0.0
+        )
+
+    @cached_property
+    def mel(self):
+        return self._librosa.feature.melspectrogram(S=self.power, sr=self.sr, n_fft=self.n_fft)
+
+    @cached_property
+    def onset_envelope(self):
+        return self._librosa.onset.onset_strength(
+            S=self._librosa.power_to_db(self.mel), sr=self.sr, hop_length=self.hop_length
+        )
+
+    @cached_property
+    def _beat(self):
+        tempo, beats = self._librosa.beat.beat_track(
+            onset_envelope=self.onset_envelope, sr=self.sr, hop_length=self.hop_length
+        )
+        # librosa >= 0.10 returns the tempo as a 1-element array
+        return float(np.atleast_1d(tempo)[0]), beats
+
+    @property
+    def tempo(self):
+        return self._beat[0]
+
+    @property
+    def beats(self):
+        return self._beat[1]
+
+    @cached_property
+    def spectrogram_db(self):
+        """Display spectrogram in dB relative to its peak"""
+        return self._librosa.amplitude_to_db(self.magnitude, ref=np.max)
+
+    @cached_property
+    def chroma_cqt(self):
+        """
+        Constant-Q chroma of the middle CQT_EXCERPT_DURATION seconds at
+        CQT_SAMPLE_RATE; a separate transform, only computed when asked for.
+        Meant for key estimation, so its frames do not line up with the STFT's.
+        """
+        excerpt = int(CQT_EXCERPT_DURATION * self.sr)
+        start = max(0, (len(self.y) - excerpt) // 2)
+        y = self._librosa.resample(self.y[start:start + excerpt], orig_sr=self.sr, target_sr=CQT_SAMPLE_RATE)
+        return self._librosa.feature.chroma_cqt(y=y, sr=CQT_SAMPLE_RATE, hop_length=self.hop_length)
@@ -0,0 +1,41 @@
+import numpy as np
+
+# Key estimation by template matching: a track's mean chroma is correlated with
+# the Krumhansl-Kessler probe-tone profiles of all 24 major and minor keys at
+# once, as one (24, 12) matrix product over z-scored vectors.
+
+KEY_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+_MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+_MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+
+def _zscore(values):
+    values = values - values.mean(axis=-1, keepdims=True)
+    norm = np.linalg.norm(values, axis=-1, keepdims=True)
+    return np.divide(values, norm, out=np.zeros_like(values), where=norm > 0)
+
+
+# Rows 0-11: C major ... B major, rows 12-23: C minor ... B minor
+_KEY_TEMPLATES = _zscore(np.array(
+    [np.roll(_MAJOR_PROFILE, tonic) for tonic in range(12)]
+    + [np.roll(_MINOR_PROFILE, tonic) for tonic in range(12)]
+))
+
+
+def key_correlations(chroma_profile):
+    """Pearson correlation of a 12-bin chroma profile with each of the 24 key templates"""
+    return _KEY_TEMPLATES @ _zscore(np.asarray(chroma_profile, dtype=np.float64))
+
+
+def estimate_key(chroma):
+    """
+    (key, scale, confidence) of a chromagram (12, frames) or a mean 12-bin
+    chroma profile. confidence is the best key's correlation with its
+    template, from -1 to 1; tonal music typically scores above 0.6, and a flat
+    profile (silence, noise) scores 0.
+    """
+    chroma = np.asarray(chroma)
+    profile = chroma.mean(axis=1) if chroma.ndim == 2 else chroma
+    correlations = key_correlations(profile)
+    best = int(np.argmax(correlations))
+    return KEY_NAMES[best % 12], 'major' if best < 12 else 'minor', float(correlations[best])
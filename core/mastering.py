@@ -1,45 +1,86 @@
-from PyQt5.QtCore import QThread, pyqtSignal
-import matchering as mg
+import multiprocessing
+import os
 from pathlib import Path
 
-class MasteringThread(QThread):
-    progress_updated = pyqtSignal(int)
-    error_occurred = pyqtSignal(str)
-    
-    def __init__(self, target_path, reference_path, output_path, options):
-        super().__init__()
-        self.target_path = target_path
-        self.reference_path = reference_path
-        self.output_path = output_path
-        self.options = options
-
-    def run(self):
-        try:
-            self.progress_updated.emit(10)
-            
-            from matchering import Result
-            
-            # Configure Result based on format options
-            format_ext = self.options['format']
-            subtype = self.options['subtype']
-            
-            if format_ext == 'mp3':
-                # Handle MP3 format (no subtype needed)
-                result = Result(self.output_path)
-            else:
-                # Handle WAV/FLAC with subtype
-                result = Result(self.output_path, subtype=subtype)
-            
-            mg.process(
-                target=self.target_path,
-                reference=self.reference_path,
-                results=[result]
-            )
-            
-            self.progress_updated.emit(100)
-
-        except Exception as e:
-            print(f"Matchering error details: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            self.error_occurred.emit(str(e))
\ No newline at end of file
+from core.cancellation import CancellationToken, CancelledError
+
+
+def partial_output_path(output_path):
+    """Temporary file matchering writes to; keeps the extension so the format is unchanged"""
+    path = Path(output_path)
+    return str(path.with_name(f"{path.stem}.partial{path.suffix}"))
+
+
+def _run_matchering(target_path, reference_path, output_path, options, errors):
+    """Child-process entry point; reports failures through the errors queue"""
+    try:
+        import matchering as mg
+        from matchering import Result
+
+        # Configure Result based on format options
+        format_ext = options['format']
+        subtype = options['subtype']
+
+        if format_ext == 'mp3':
+            # Handle MP3 format (no subtype needed)
+            result = Result(output_path)
+        else:
+            # Handle WAV/FLAC with subtype
+            result = Result(output_path, subtype=subtype)
+
+        mg.process(
+            target=target_path,
+            reference=reference_path,
+            results=[result]
+        )
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        errors.put(str(e))
+
+
+def master_track(target_path, reference_path, output_path, options, token=None, progress=None):
+    """
+    Master target_path to match reference_path with matchering.
+
+    Returns output_path once it has been written. Raises RuntimeError if
+    matchering fails and CancelledError if the token is cancelled; output_path
+    is left untouched in both cases.
+    """
+    token = token or CancellationToken()
+    progress = progress or (lambda value: None)
+    # matchering has no way to interrupt mg.process, so it runs in a child
+    # process that can be terminated, writing to a temporary file that only
+    # replaces output_path once mastering succeeds.
+    partial_path = partial_output_path(output_path)
+    context = multiprocessing.get_context('spawn')
+    errors = context.Queue()
+    process = context.Process(
+        target=_run_matchering,
+        args=(target_path, reference_path, partial_path, options, errors),
+        daemon=True
+    )
+    try:
+        progress(10)
+        process.start()
+
+        while process.is_alive():
+            if token.sleep(0.1):
+                process.terminate()
+                process.join()
+                raise CancelledError()
+
+        process.join()
+        if not errors.empty():
+            raise RuntimeError(errors.get())
+        if process.exitcode != 0:
+            raise RuntimeError(f"Mastering process exited with code {process.exitcode}")
+
+        os.replace(partial_path, output_path)
+        progress(100)
+        return output_path
+    finally:
+        if process.is_alive():
+            process.terminate()
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
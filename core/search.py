@@ -0,0 +1,582 @@
+import itertools
+import os
+import time
+import numpy as np
+
+from core.embeddings import (
+    extract_embedding, extract_embeddings_parallel, embedding_format, EmbeddingProjection,
+    coarse_format, coarse_signature
+)
+from core.similarity import stack_embeddings, score_batch, top_k, TopK
+from core.ann_index import (
+    IVFIndex, build_index_from_cache, build_index_from_store, index_path_for, recall_report
+)
+from core.cancellation import CancellationToken, CancelledError
+from core.catalog import scan_catalog
+from core.embedding_store import EmbeddingStore, sync_store, sync_derived
+from config.settings import (
+    ANN_MIN_CATALOG_SIZE, DEFAULT_EMBEDDING_MODE, PCA_COMPONENTS, PCA_MIN_CATALOG_SIZE,
+    DEFAULT_CANDIDATE_POOL
+)
+
+# Qt-free similarity search. Progress and partial results are reported through
+# plain callbacks; core.workers wraps this in QThreads for the UI.
+
+# Number of catalog embeddings scored per matrix product
+SCORE_BLOCK_SIZE = 1024
+
+# Compact embeddings sampled during a scan to fit the PCA projection
+PCA_SAMPLE_SIZE = 5000
+
+# Minimum seconds between partial result callbacks while streaming
+PARTIAL_RESULTS_INTERVAL = 0.25
+
+
+def _ignore(*args):
+    pass
+
+
+def open_coarse_store(store, directory, fmt):
+    """Coarse signature store for a mel embedding store, brought up to date"""
+    coarse = EmbeddingStore.open(directory, coarse_format(fmt))
+    sync_derived(coarse, store, coarse_signature)
+    return coarse
+
+
+def coarse_candidates(coarse, store, queries, pool, excluded=()):
+    """
+    First stage of the two-stage search: rank the whole catalog by coarse
+    signature and return the sorted store rows of the pool best matches of
+    every query (raw embeddings, (Q, D)).
+    """
+    distances = np.atleast_2d(score_batch(coarse_signature(queries), coarse.matrix))
+    distances[:, coarse.dead_rows] = np.inf
+    excluded_rows = [coarse.rows[path] for path in excluded if path in coarse.rows]
+    if excluded_rows:
+        distances[:, excluded_rows] = np.inf
+    rows = set()
+    for row in distances:
+        best = top_k(row, pool)
+        rows.update(store.rows[coarse.row_paths[i]] for i in best if np.isfinite(row[i]))
+    return sorted(rows)
+
+
+def get_embedding(cache, file_path, embedding_mode=DEFAULT_EMBEDDING_MODE):
+    """Return the embedding for file_path, decoding it only if not cached"""
+    if cache is None:
+        return extract_embedding(file_path, embedding_mode)
+    fmt = embedding_format(embedding_mode)
+    embedding = cache.get(file_path, fmt)
+    if embedding is None:
+        embedding = extract_embedding(file_path, embedding_mode)
+        if embedding is not None:
+            cache.put(file_path, embedding, fmt)
+            cache.commit()
+    return embedding
+
+
+class SimilaritySearch:
+    """
+    Search a music directory for the songs closest to one or more references.
+
+    run() returns {reference: {path: distance}} ordered best first. A reference
+    that cannot be decoded raises RuntimeError, unless skip_failed is set, in
+    which case it is left out (and RuntimeError is raised only if none is left).
+    Cancelling the token raises core.cancellation.CancelledError.
+
+    With candidate_pool set, mel searches run in two stages: coarse signatures
+    rank the whole catalog and only the candidate_pool best tracks per
+    reference are scored with the full embeddings.
+    """
+
+    def __init__(self, reference_songs, directory, threshold=0.5, max_results=50, use_cache=True,
+                 workers=None, nprobe=0, embedding_mode=DEFAULT_EMBEDDING_MODE, token=None,
+                 watch=False, skip_failed=False, candidate_pool=DEFAULT_CANDIDATE_POOL):
+        self.reference_songs = list(dict.fromkeys(reference_songs))
+        self.directory = directory
+        self.threshold = threshold
+        self.max_results = max_results
+        self.use_cache = use_cache
+        # 1 decodes in this thread, 0/None uses one process per physical core
+        self.workers = workers
+        # IVF lists probed per query; 0 searches the catalog exhaustively
+        self.nprobe = nprobe
+        self.embedding_mode = embedding_mode
+        self.embedding_format = embedding_format(embedding_mode)
+        self.projection = None
+        self.token = token or CancellationToken()
+        # Keep an inotify watcher on the directory so the next search skips the rescan
+        self.watch = watch
+        self.skip_failed = skip_failed
+        # Tracks per reference re-ranked with full embeddings; 0 scores them all
+        self.candidate_pool = candidate_pool
+
+    def run(self, progress=None, partial=None, done=None):
+        """
+        Run the search and return the results.
+
+        progress gets a percentage and partial gets interim results. done gets
+        the final results as soon as they are known, before the PCA projection
+        and ANN index are refreshed for the next search; errors and
+        cancellation after that point are not raised.
+        """
+        progress = progress or _ignore
+        partial = partial or _ignore
+        done = done or _ignore
+        cache = None
+        try:
+            if self.use_cache:
+                from core.embedding_cache import EmbeddingCache
+                cache = EmbeddingCache()
+            return self._run(cache, progress, partial, done)
+        finally:
+            if cache is not None:
+                cache.close()
+
+    def _run(self, cache, progress, partial, done):
+        references = self._get_reference_embeddings(cache)
+        reference_paths = list(references)
+        reference_raw = stack_embeddings(list(references.values()))
+        embedding_shape = reference_raw.shape[1:]
+
+        # Compact embeddings are reduced with the stored PCA projection, if fitted
+        if self.embedding_mode == 'compact':
+            projection = EmbeddingProjection.load()
+            if projection is not None and projection.input_dim == reference_raw.shape[1]:
+                self.projection = projection
+        # One row per reference: every catalog block is scored against all of
+        # them with a single matrix-matrix product
+        reference_embeddings = self._project(reference_raw)
+
+        # Incremental rescan: only changed directories are listed again
+        catalog = scan_catalog(self.directory, watch=self.watch)
+        if cache is not None and catalog.removed:
+            cache.remove(catalog.removed)
+        excluded = {os.path.abspath(path) for path in self.reference_songs}
+        song_files = [f for f in sorted(catalog.files) if os.path.abspath(f) not in excluded]
+        self.token.check()
+
+        best = [TopK(self.max_results, self.threshold) for _ in reference_paths]
+        total_files = len(song_files)
+
+        def results():
+            return {path: top.results() for path, top in zip(reference_paths, best)}
+
+        # Cached embeddings are scored straight from the memory-mapped store,
+        # then only new or modified files are decoded
+        store = None
+        cached = iter(())
+        if cache is not None:
+            fresh, stale = cache.lookup(song_files, self.embedding_format, catalog.files)
+            store = EmbeddingStore.open(self.directory, self.embedding_format)
+            sync_store(store, cache, catalog.files, self.embedding_format)
+            if store.dim is not None and (store.dim,) != embedding_shape:
+                # Cannot happen for a consistent format tag; read the cache row by row
+                store = None
+                cached = cache.iter_embeddings(fresh, self.embedding_format)
+        else:
+            fresh, stale = [], song_files
+
+        def extract_stale():
+            if self.workers == 1 or len(stale) < 2:
+                extracted = (
+                    (path, extract_embedding(path, self.embedding_mode)) for path in stale
+                )
+            else:
+                extracted = extract_embeddings_parallel(stale, self.workers, self.embedding_mode)
+            pending = []
+
+            def flush():
+                usable = [(p, e) for p, e in pending if e is not None and e.shape == embedding_shape]
+                if store is not None and usable:
+                    store.append(
+                        [p for p, _ in usable], np.vstack([e for _, e in usable]), catalog.files
+                    )
+                pending.clear()
+                cache.commit()
+
+            try:
+                for path, embedding in extracted:
+                    if cache is not None:
+                        cache.put(path, embedding, self.embedding_format)
+                        pending.append((path, embedding))
+                        if len(pending) >= 50:
+                            flush()
+                    yield path, embedding
+            finally:
+                # Stops the worker pool promptly when the search is cancelled
+                extracted.close()
+                if cache is not None:
+                    flush()
+
+        if self.nprobe and cache is not None and total_files >= ANN_MIN_CATALOG_SIZE:
+            indexed = self._search_index(
+                cache, embedding_shape, reference_paths, reference_embeddings,
+                song_files, fresh, stale, extract_stale, progress
+            )
+            if indexed is not None:
+                progress(100)
+                done(indexed)
+                return indexed
+
+        # Score in blocks so each block is one BLAS call and memory stays bounded.
+        # A block is also flushed whenever partial results are due, so the
+        # first matches show up within a fraction of a second.
+        block_paths, block_embeddings = [], []
+        pca_sample = []
+        rng = np.random.default_rng()
+        last_emit = time.monotonic()
+        dirty = False
+        scored = 0
+
+        def score(paths, matrix):
+            nonlocal dirty
+            # Stored compact embeddings are float16; score in float32
+            distances = score_batch(
+                reference_embeddings, self._project(np.asarray(matrix, dtype=np.float32))
+            )
+            for top, row in zip(best, distances):
+                dirty = top.push_many(paths, row) or dirty
+
+        def score_block():
+            if block_paths:
+                score(block_paths, stack_embeddings(block_embeddings))
+                block_paths.clear()
+                block_embeddings.clear()
+
+        def emit_partial():
+            nonlocal dirty, last_emit
+            now = time.monotonic()
+            if now - last_emit >= PARTIAL_RESULTS_INTERVAL:
+                score_block()
+                if dirty:
+                    partial(results())
+                    dirty = False
+                last_emit = now
+
+        # Two-stage search: only the coarse-signature candidates are read in full
+        candidates = None
+        total_work = total_files
+        if (store is not None and self.embedding_mode == 'mel' and self.candidate_pool
+                and len(store) > self.candidate_pool):
+            coarse = open_coarse_store(store, self.directory, self.embedding_format)
+            candidates = coarse_candidates(
+                coarse, store, reference_raw, self.candidate_pool, excluded
+            )
+            total_work = len(candidates) + len(stale)
+            self.token.check()
+
+        if store is not None:
+            if candidates is None:
+                blocks = store.blocks(SCORE_BLOCK_SIZE, exclude=excluded)
+            else:
+                blocks = store.take(candidates, SCORE_BLOCK_SIZE)
+            for paths, matrix in blocks:
+                self.token.check()
+                score(paths, matrix)
+                scored += len(paths)
+                emit_partial()
+                progress(int((scored / max(total_work, 1)) * 100))
+
+        for other_song_path, other_embedding in itertools.chain(cached, extract_stale()):
+            self.token.check()
+            scored += 1
+            if other_embedding is not None:
+                if other_embedding.shape != embedding_shape:
+                    print(f"Error processing {other_song_path}: embedding shape mismatch")
+                else:
+                    block_paths.append(other_song_path)
+                    block_embeddings.append(other_embedding)
+                    # Reservoir sample of compact embeddings for fitting PCA
+                    # (with a store the sample is drawn from it afterwards)
+                    if store is None and self.embedding_mode == 'compact' and self.projection is None:
+                        if len(pca_sample) < PCA_SAMPLE_SIZE:
+                            pca_sample.append(other_embedding)
+                        else:
+                            slot = rng.integers(0, scored)
+                            if slot < PCA_SAMPLE_SIZE:
+                                pca_sample[slot] = other_embedding
+                    if len(block_paths) >= SCORE_BLOCK_SIZE:
+                        score_block()
+
+            emit_partial()
+            progress(int((scored / total_work) * 100))
+        score_block()
+        final = results()
+        done(final)
+
+        # The results are delivered, so a failed or cancelled refresh must not
+        # be reported as a failed search; the next search simply retries it
+        try:
+            self._refresh_derived(cache, store, pca_sample, rng, song_files, reference_raw.shape[1],
+                                  total_files)
+        except CancelledError:
+            pass
+        except Exception as e:
+            print(f"Error refreshing the search index: {e}")
+        return final
+
+    def _refresh_derived(self, cache, store, pca_sample, rng, song_files, dim, total_files):
+        """Fit the PCA projection and rebuild the ANN index for the next search"""
+        self.token.check()
+        if store is not None and self.embedding_mode == 'compact' and self.projection is None:
+            if len(store) >= PCA_MIN_CATALOG_SIZE:
+                pca_sample = store.sample(PCA_SAMPLE_SIZE, rng)
+        if len(pca_sample) >= PCA_MIN_CATALOG_SIZE:
+            self.projection = EmbeddingProjection.fit(pca_sample, PCA_COMPONENTS)
+            self.projection.save()
+
+        # Every catalog embedding is cached now, so the next search can use an index
+        if self.nprobe and cache is not None and total_files >= ANN_MIN_CATALOG_SIZE:
+            cache.commit()
+            index = build_index_from_cache(
+                cache, song_files, dim, fmt=self.embedding_format, transform=self._project
+            )
+            if index is not None:
+                index.save(index_path_for(self.directory, self._index_format()))
+
+    def _get_reference_embeddings(self, cache):
+        """{reference: raw embedding} for every reference that could be decoded"""
+        references = {}
+        for path in self.reference_songs:
+            self.token.check()
+            embedding = self._get_embedding(cache, path)
+            if embedding is not None:
+                references[path] = embedding
+            elif self.skip_failed:
+                print(f"Error processing {path}: could not extract embedding, skipping target")
+            else:
+                raise RuntimeError(f"Could not extract embedding for {path}")
+        if not references:
+            raise RuntimeError("Could not extract embeddings for any of the target songs")
+        return references
+
+    def _project(self, vectors):
+        """Apply the PCA projection (if any) to raw embeddings for scoring"""
+        if self.projection is None:
+            return vectors
+        return self.projection.apply(vectors).astype(np.float32)
+
+    def _index_format(self):
+        """Format tag of the vectors held in the ANN index"""
+        if self.projection is None:
+            return self.embedding_format
+        return f'{self.embedding_format}-{self.projection.id}'
+
+    def _search_index(self, cache, embedding_shape, reference_paths, reference_embeddings,
+                      song_files, fresh, stale, extract_stale, progress):
+        """
+        Bring the saved IVF index up to date with the catalog and query it.
+
+        Returns {reference: {path: distance}}, or None when no usable index
+        exists yet, so the caller falls back to the exhaustive search (which
+        then builds one).
+        """
+        index_path = index_path_for(self.directory, self._index_format())
+        index = IVFIndex.load(index_path)
+        if index is None or index.dim != reference_embeddings.shape[1]:
+            return None
+
+        initial_size = len(index)
+        current = set(song_files)
+        index.remove([p for p in index.paths if p is not None and p not in current])
+        index.remove(stale)
+
+        def usable(embedding):
+            return embedding is not None and embedding.shape == embedding_shape
+
+        # Files cached by an earlier search that the index has not seen yet
+        missing = [p for p in fresh if p not in index]
+        added = [
+            (p, e) for p, e in cache.iter_embeddings(missing, self.embedding_format) if usable(e)
+        ]
+
+        for i, (path, embedding) in enumerate(extract_stale()):
+            self.token.check()
+            if usable(embedding):
+                added.append((path, embedding))
+            progress(int(((i + 1) / len(stale)) * 100))
+
+        if added:
+            index.add([p for p, _ in added], self._project(stack_embeddings([e for _, e in added])))
+        if added or len(index) != initial_size:
+            index.save(index_path)
+
+        # Reference songs may be part of the catalog; ask for extras so they can be dropped
+        excluded = {os.path.abspath(path) for path in self.reference_songs}
+        results = {}
+        for reference, query in zip(reference_paths, reference_embeddings):
+            paths, distances = index.search(query, self.max_results + len(excluded), self.nprobe)
+            matches = {
+                path: float(dist) for path, dist in zip(paths, distances)
+                if dist <= self.threshold and os.path.abspath(path) not in excluded
+            }
+            results[reference] = dict(itertools.islice(matches.items(), self.max_results))
+        return results
+
+    def _get_embedding(self, cache, file_path):
+        return get_embedding(cache, file_path, self.embedding_mode)
+
+
+def index_directory(directory, embedding_mode=DEFAULT_EMBEDDING_MODE, workers=None, nprobe=0,
+                    progress=None, token=None, catalog=None):
+    """
+    Bring the embedding cache and store (and, with nprobe, the ANN index) of a directory up to date.
+
+    Lets catalogs be indexed ahead of time on headless machines; a later
+    search then only has to score. progress, if given, is called with a
+    percentage. catalog is a ScanResult the caller already has; by default
+    the directory is rescanned. Returns counts of the files seen.
+    """
+    from core.embedding_cache import EmbeddingCache
+
+    progress = progress or _ignore
+    token = token or CancellationToken()
+    fmt = embedding_format(embedding_mode)
+    catalog = catalog or scan_catalog(directory)
+    song_files = sorted(catalog.files)
+    cache = EmbeddingCache()
+    try:
+        if catalog.removed:
+            cache.remove(catalog.removed)
+        fresh, stale = cache.lookup(song_files, fmt, catalog.files)
+        token.check()
+
+        if workers == 1 or len(stale) < 2:
+            extracted = ((path, extract_embedding(path, embedding_mode)) for path in stale)
+        else:
+            extracted = extract_embeddings_parallel(stale, workers, embedding_mode)
+        failed = 0
+        try:
+            for i, (path, embedding) in enumerate(extracted):
+                token.check()
+                cache.put(path, embedding, fmt)
+                failed += embedding is None
+                if (i + 1) % 50 == 0:
+                    cache.commit()
+                progress(int(((i + 1) / len(stale)) * 100))
+        finally:
+            extracted.close()
+        cache.commit()
+        store = EmbeddingStore.open(directory, fmt)
+        sync_store(store, cache, catalog.files, fmt)
+
+        indexed = 0
+        if nprobe and len(song_files) >= ANN_MIN_CATALOG_SIZE:
+            dim = next((len(e) for _, e in cache.iter_embeddings(song_files, fmt) if e is not None), None)
+            projection = None
+            if embedding_mode == 'compact' and dim is not None:
+                projection = EmbeddingProjection.load()
+                if projection is not None and projection.input_dim != dim:
+                    projection = None
+            transform = None
+            index_fmt = fmt
+            if projection is not None:
+                transform = lambda vectors: projection.apply(vectors).astype(np.float32)
+                index_fmt = f'{fmt}-{projection.id}'
+            index = None
+            if dim is not None:
+                index = build_index_from_cache(cache, song_files, dim, fmt=fmt, transform=transform)
+            if index is not None:
+                index.save(index_path_for(directory, index_fmt))
+                indexed = len(index)
+
+        return {
+            'files': len(song_files),
+            'cached': len(fresh),
+            'extracted': len(stale) - failed,
+            'failed': failed,
+            'removed': len(catalog.removed),
+            'indexed': indexed,
+        }
+    finally:
+        cache.close()
+
+
+def _benchmark_queries(store, k, n_queries, seed):
+    """
+    Sample query embeddings from a store and rank each exhaustively.
+
+    Returns (queries, query_paths, exact, exact_ms, exact_top), where exact
+    holds the set of top k paths per query (the query itself excluded) and
+    exact_top(query, path, candidate_rows=None) repeats that ranking,
+    optionally over a subset of rows.
+    """
+    rows = np.array(sorted(store.rows.values()))
+    rng = np.random.default_rng(seed)
+    query_rows = np.sort(rng.choice(rows, min(n_queries, len(rows)), replace=False))
+    queries = np.asarray(store.matrix[query_rows], dtype=np.float32)
+    query_paths = [store.row_paths[row] for row in query_rows]
+
+    def exact_top(query, path, candidate_rows=None):
+        best = TopK(k)
+        blocks = (
+            store.blocks(SCORE_BLOCK_SIZE, exclude={path}) if candidate_rows is None
+            else store.take(candidate_rows, SCORE_BLOCK_SIZE)
+        )
+        for paths, matrix in blocks:
+            best.push_many(paths, score_batch(query, np.asarray(matrix, dtype=np.float32)))
+        return set(best.results())
+
+    start = time.perf_counter()
+    exact = [exact_top(query, path) for query, path in zip(queries, query_paths)]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    return queries, query_paths, exact, exact_ms, exact_top
+
+
+def candidate_pool_report(directory, pool_sizes=(100, 300, 1000), k=10, n_queries=50,
+                          embedding_mode='mel', seed=0):
+    """
+    Measure the two-stage search against the exhaustive one on an indexed catalog.
+
+    Queries are sampled from the catalog's stored embeddings and each is
+    excluded from its own results. Returns a list of {'candidates', 'recall',
+    'query_ms', 'exact_ms', 'speedup'} dicts, where recall is the fraction of
+    the exhaustive top k that the two-stage search also returns.
+    """
+    fmt = embedding_format(embedding_mode)
+    store = EmbeddingStore.open(directory, fmt)
+    if len(store) < 2:
+        return []
+    coarse = open_coarse_store(store, directory, fmt)
+    queries, query_paths, exact, exact_ms, exact_top = _benchmark_queries(store, k, n_queries, seed)
+
+    report = []
+    for pool in pool_sizes:
+        hits, total = 0, 0
+        start = time.perf_counter()
+        for query, path, truth in zip(queries, query_paths, exact):
+            candidates = coarse_candidates(coarse, store, query[np.newaxis], pool, {path})
+            found = exact_top(query, path, candidates)
+            hits += len(truth & found)
+            total += len(truth)
+        query_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        report.append({
+            'candidates': pool,
+            'recall': hits / max(total, 1),
+            'query_ms': query_ms,
+            'exact_ms': exact_ms,
+            'speedup': exact_ms / max(query_ms, 1e-9),
+        })
+    return report
+
+
+def ann_recall_report(directory, nprobe_values=(1, 4, 16), k=10, n_queries=50,
+                      embedding_mode='mel', pq_subvectors=None, seed=0):
+    """
+    Measure an IVF index built over an indexed catalog against exhaustive search.
+
+    The index is trained on the catalog's stored embeddings (product-quantized
+    when pq_subvectors is set) and queried like candidate_pool_report. Returns
+    a list of {'nprobe', 'recall', 'query_ms', 'exact_ms', 'speedup'} dicts.
+    """
+    store = EmbeddingStore.open(directory, embedding_format(embedding_mode))
+    if len(store) < 2:
+        return []
+    index = build_index_from_store(store, pq_subvectors=pq_subvectors, seed=seed)
+    queries, query_paths, exact, exact_ms, _ = _benchmark_queries(store, k, n_queries, seed)
+    report = recall_report(index, queries, exact, k, nprobe_values, query_paths)
+    for entry in report:
+        entry['exact_ms'] = exact_ms
+        entry['speedup'] = exact_ms / max(entry['query_ms'], 1e-9)
+    return report
@@ -0,0 +1,660 @@
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+
+from core.cancellation import CancellationToken, CancelledError
+from core.catalog import CatalogIndex, update_catalog, stop_watching
+from core.embedding_store import EmbeddingStore
+from core.embeddings import embedding_format, EmbeddingProjection
+from core.search import get_embedding, index_directory, SCORE_BLOCK_SIZE
+from core.similarity import stack_embeddings, score_batch, TopK
+from config.settings import (
+    SERVICE_HOST, SERVICE_PORT, SERVICE_TIMEOUT, SERVICE_TOKEN_PATH, DEFAULT_EMBEDDING_MODE,
+    DEFAULT_SIMILARITY_THRESHOLD, DEFAULT_MAX_RESULTS, DEFAULT_ANALYSIS_DEPTH
+)
+
+# Long-running local search service (`mast serve`). Catalog embeddings stay
+# mapped between requests and librosa is imported and JIT-compiled once, so a
+# query only pays for a catalog rescan (near free with the inotify watcher) and
+# one blocked pass of matrix products. Speaks JSON over HTTP on the loopback
+# interface.
+#
+# Searches run as jobs: the client starts one, then polls it for progress and
+# interim results, and can pause or cancel it between polls, so no request
+# blocks for longer than a poll.
+#
+# Browsers can reach loopback ports too (cross-origin form posts, DNS
+# rebinding), so every request must name the loopback host in Host, send its
+# body as application/json (which a page cannot do without a CORS preflight,
+# never answered here) and carry the per-session token that serve() writes to
+# SERVICE_TOKEN_PATH, readable only by the user running it.
+
+SERVICE_VERSION = 2
+JOB_POLL_INTERVAL = 0.2  # seconds between a client's polls
+JOB_POLL_TIMEOUT = 10  # seconds a client waits for a poll to be answered
+JOB_ABANDON_TIMEOUT = 60  # seconds without a poll before a job is cancelled and dropped
+TOKEN_HEADER = 'X-MAST-Token'
+
+
+class ServiceUnavailable(Exception):
+    """No MAST service is listening (or it stopped responding)"""
+
+
+class ResidentCatalog:
+    """
+    Embeddings of one music directory kept ready between requests.
+
+    Rows are scored straight from the memory-mapped EmbeddingStore, so they
+    stay in the OS page cache shared with other MAST processes. Compact
+    embeddings with a PCA projection are projected into memory once; later
+    refreshes only project the rows appended since.
+    """
+
+    def __init__(self, directory, embedding_mode=DEFAULT_EMBEDDING_MODE, workers=None):
+        self.directory = os.path.abspath(directory)
+        self.embedding_mode = embedding_mode
+        self.embedding_format = embedding_format(embedding_mode)
+        self.workers = workers
+        self.catalog = CatalogIndex.load(self.directory)
+        self.lock = threading.Lock()
+        self.store = None
+        self.projection = None
+        self._projected = None
+        self._state = None
+        self._indexed = False  # False until a refresh has decoded everything its scan found
+
+    def __len__(self):
+        return len(self.store) if self.store is not None else 0
+
+    @property
+    def dim(self):
+        return self.store.dim if self.store is not None else None
+
+    def _current_projection(self):
+        if self.embedding_mode != 'compact' or self.dim is None:
+            return None
+        projection = EmbeddingProjection.load()
+        if projection is not None and projection.input_dim != self.dim:
+            return None
+        return projection
+
+    def refresh(self, cache, progress=None, token=None, interim=None):
+        """
+        Bring the catalog up to date. If files have to be decoded first,
+        interim is called once the rows already stored can be searched, and
+        progress gets the percentage of the decoding.
+        """
+        scan = update_catalog(self.catalog, watch=True)
+        if self.store is None:
+            self.store = EmbeddingStore.open(self.directory, self.embedding_format)
+        else:
+            self.store.reload()  # rows appended by other processes
+        if scan.changed or not self._indexed:
+            if interim is not None and len(self.store):
+                self._sync()
+                interim(scan.removed)
+            # Decodes new and modified files and brings the store up to date. If
+            # that is cancelled, the next refresh picks up where it stopped
+            self._indexed = False
+            index_directory(
+                self.directory, self.embedding_mode, self.workers, progress=progress,
+                token=token, catalog=scan
+            )
+            self._indexed = True
+            self.store.reload()
+        self._sync()
+
+    def _sync(self):
+        """Project the rows added to the store since the last call"""
+        store = self.store
+        state = (store.generation, store.row_count, len(store))
+        projection = self._current_projection()
+        if projection is None:
+            self.projection = self._projected = None
+        else:
+            renumbered = self._state is None or self._state[0] != store.generation
+            if self._projected is None or renumbered or projection.id != self.projection.id:
+                self._projected = np.empty((0, projection.components.shape[1]), dtype=np.float32)
+            self.projection = projection
+            start = len(self._projected)
+            if start < store.row_count:
+                added = np.asarray(store.matrix[start:], dtype=np.float32)
+                self._projected = np.vstack([self._projected, self._project(added)])
+        self._state = state
+
+    def _project(self, vectors):
+        if self.projection is None:
+            return np.asarray(vectors, dtype=np.float32)
+        return self.projection.apply(vectors).astype(np.float32)
+
+    def search(self, references, threshold, max_results, removed=()):
+        """
+        {reference: [(path, distance), ...]} for raw reference embeddings;
+        paths in removed never match
+        """
+        return self.score(self.snapshot(references, removed), references, threshold, max_results)
+
+    def snapshot(self, references=(), removed=()):
+        """
+        The rows a search scores, taken while holding the lock. Refreshes
+        replace the matrix rather than modify it and rows only ever turn dead,
+        so the snapshot can be scored after the lock is released.
+        """
+        store = self.store
+        if store is None or not len(store):
+            return None
+        # Dead rows, and references that are part of the catalog, never match
+        excluded = [
+            store.rows[p] for p in map(os.path.abspath, [*references, *removed]) if p in store.rows
+        ]
+        return {
+            'matrix': self._projected if self._projected is not None else store.matrix,
+            'paths': store.row_paths,
+            'projection': self.projection,
+            'excluded': np.union1d(store.dead_rows, np.array(excluded, dtype=np.int64)),
+        }
+
+    @staticmethod
+    def score(snapshot, references, threshold, max_results, token=None):
+        """search() over a snapshot, scoring SCORE_BLOCK_SIZE rows at a time"""
+        if snapshot is None:
+            return {reference: [] for reference in references}
+        queries = stack_embeddings(list(references.values()))
+        if snapshot['projection'] is not None:
+            queries = snapshot['projection'].apply(queries)
+        queries = np.asarray(queries, dtype=np.float32)
+        matrix, excluded = snapshot['matrix'], snapshot['excluded']
+        best = [TopK(max_results, threshold) for _ in references]
+        for start in range(0, len(matrix), SCORE_BLOCK_SIZE):
+            if token is not None:
+                token.check()
+            block = np.asarray(matrix[start:start + SCORE_BLOCK_SIZE], dtype=np.float32)
+            distances = np.atleast_2d(score_batch(queries, block))
+            skip = excluded[(excluded >= start) & (excluded < start + len(block))]
+            distances[:, skip - start] = np.inf
+            rows = np.arange(start, start + len(block))
+            for found, row in zip(best, distances):
+                found.push_many(rows, row)
+
+        paths = snapshot['paths']
+        return {
+            reference: [
+                (paths[row], distance) for row, distance in found.results().items()
+                if paths[row] is not None  # removed since the snapshot
+            ]
+            for reference, found in zip(references, best)
+        }
+
+
+class SimilarityService:
+    """Request handling independent of the HTTP layer"""
+
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.catalogs = {}
+        self._lock = threading.Lock()
+        self._engine = None
+        self.jobs = {}
+
+    def resident(self, directory, embedding_mode):
+        key = (os.path.abspath(directory), embedding_mode)
+        with self._lock:
+            if key not in self.catalogs:
+                self.catalogs[key] = ResidentCatalog(directory, embedding_mode, self.workers)
+            return self.catalogs[key]
+
+    def status(self):
+        return {
+            'service': 'mast',
+            'version': SERVICE_VERSION,
+            'pid': os.getpid(),
+            'catalogs': [
+                {'directory': c.directory, 'mode': c.embedding_mode, 'tracks': len(c)}
+                for c in list(self.catalogs.values())
+            ],
+        }
+
+    def preload(self, directory, embedding_mode=DEFAULT_EMBEDDING_MODE):
+        from core.embedding_cache import EmbeddingCache
+
+        resident = self.resident(directory, embedding_mode)
+        cache = EmbeddingCache()
+        try:
+            with resident.lock:
+                resident.refresh(cache)
+        finally:
+            cache.close()
+        return {'directory': resident.directory, 'mode': embedding_mode, 'tracks': len(resident)}
+
+    def search(self, references, directory, threshold=DEFAULT_SIMILARITY_THRESHOLD,
+               max_results=DEFAULT_MAX_RESULTS, embedding_mode=DEFAULT_EMBEDDING_MODE,
+               progress=None, partial=None, token=None):
+        """
+        Search directory for the closest tracks to references. progress gets a
+        percentage, partial gets interim results (from the tracks already
+        stored, while new ones are decoded) and token is checked between
+        stages.
+        """
+        from core.embedding_cache import EmbeddingCache
+
+        progress = progress or (lambda value: None)
+        partial = partial or (lambda results: None)
+        token = token or CancellationToken()
+        started = time.perf_counter()
+        resident = self.resident(directory, embedding_mode)
+        cache = EmbeddingCache()
+        try:
+            embeddings = {}
+            errors = {}
+            references = list(dict.fromkeys(references))
+            for i, path in enumerate(references):
+                token.check()
+                embedding = get_embedding(cache, path, embedding_mode)
+                if embedding is None:
+                    errors[path] = f"Could not extract embedding for {path}"
+                else:
+                    embeddings[path] = embedding
+                progress(int(10 * (i + 1) / len(references)))
+
+            def usable():
+                if resident.dim is not None:
+                    for path in [p for p, e in embeddings.items() if len(e) != resident.dim]:
+                        errors[path] = f"Embedding of {path} does not match the catalog"
+                        del embeddings[path]
+                return embeddings
+
+            def interim(removed):
+                if usable():
+                    partial(_matches(resident.search(embeddings, threshold, max_results, removed)))
+
+            with resident.lock:
+                token.check()
+                resident.refresh(
+                    cache, progress=lambda value: progress(10 + int(0.85 * value)), token=token,
+                    interim=interim
+                )
+                token.check()
+                usable()
+                snapshot = resident.snapshot(embeddings)
+            # Scored outside the lock, so searches of one catalog run side by side
+            results = resident.score(snapshot, embeddings, threshold, max_results, token) if embeddings else {}
+        finally:
+            cache.close()
+        progress(100)
+        return {
+            'results': _matches(results),
+            'errors': errors,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 2),
+        }
+
+    def start_search(self, **kwargs):
+        """Run search(**kwargs) as a job; returns its id"""
+        with self._lock:
+            self._drop_abandoned()
+            job = _Job(lambda token, progress, partial: self.search(
+                progress=progress, partial=partial, token=token, **kwargs
+            ))
+            self.jobs[job.id] = job
+        job.start()
+        return job.id
+
+    def job(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            raise KeyError(f"no job {job_id}")
+        return job
+
+    def poll(self, job_id, since=0):
+        """State of a job; jobs that have finished are dropped once reported"""
+        job = self.job(job_id)
+        state = job.poll(since)
+        if state['state'] != 'running':
+            with self._lock:
+                self.jobs.pop(job_id, None)
+        return state
+
+    def cancel(self, job_id):
+        """Cancel a job and forget it; its thread stops at the next check"""
+        self.job(job_id).token.cancel()
+        with self._lock:
+            self.jobs.pop(job_id, None)
+
+    def _drop_abandoned(self):
+        # Jobs whose client stopped polling (it crashed or was killed) are cancelled
+        now = time.monotonic()
+        for job_id, job in list(self.jobs.items()):
+            if now - job.last_poll > JOB_ABANDON_TIMEOUT:
+                job.token.cancel()
+                del self.jobs[job_id]
+
+    def analyze(self, file_path, depth=DEFAULT_ANALYSIS_DEPTH, budget=None):
+        from core.engine import Engine
+
+        if self._engine is None:
+            self._engine = Engine()
+        return {'analysis': self._engine.analyze(file_path, depth=depth, budget=budget)}
+
+
+def _matches(results):
+    """{reference: [(path, distance), ...]} in JSON form"""
+    return {ref: [[p, d] for p, d in matches] for ref, matches in results.items()}
+
+
+class _Job:
+    """A search running in its own thread, reporting through poll()"""
+
+    def __init__(self, work):
+        self.id = secrets.token_hex(8)
+        self.token = CancellationToken()
+        self.last_poll = time.monotonic()
+        self._work = work
+        self._lock = threading.Lock()
+        self._state = 'running'
+        self._progress = 0
+        self._partial = None
+        self._sequence = 0  # bumped by every interim result
+        self._outcome = None
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _set_progress(self, value):
+        self._progress = value
+
+    def _set_partial(self, results):
+        with self._lock:
+            self._partial = results
+            self._sequence += 1
+
+    def _run(self):
+        try:
+            outcome, state = self._work(self.token, self._set_progress, self._set_partial), 'done'
+        except CancelledError:
+            outcome, state = None, 'cancelled'
+        except Exception as e:
+            print(f"Service error in job {self.id}: {e}")
+            outcome, state = {'error': str(e)}, 'error'
+        with self._lock:
+            self._outcome, self._state = outcome, state
+
+    def poll(self, since=0):
+        """State, progress, the interim results newer than sequence number since, and the outcome once finished"""
+        self.last_poll = time.monotonic()
+        with self._lock:
+            state = {'state': self._state, 'progress': self._progress, 'sequence': self._sequence}
+            if self._partial is not None and self._sequence > since:
+                state['partial'] = self._partial
+            if self._outcome is not None:
+                state.update(self._outcome if self._state == 'error' else {'result': self._outcome})
+            return state
+
+
+def warm_up():
+    """Import librosa and compile its numba kernels before the first request"""
+    import librosa
+    from core.features import FeatureGraph
+    y = np.random.default_rng(0).standard_normal(22050 * 5).astype(np.float32) * 0.1
+    librosa.power_to_db(librosa.feature.melspectrogram(y=y, sr=22050))
+    features = FeatureGraph(y, 22050)
+    features.tempo, features.chroma, features.rms, features.spectrogram_db
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'MAST/' + str(SERVICE_VERSION)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _authorized(self, body=True):
+        """Reply 403 and return False unless the request comes from a MAST client"""
+        port = self.server.server_address[1]
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if self.headers.get('Host') not in (f'127.0.0.1:{port}', f'localhost:{port}'):
+            reason = 'unexpected Host'
+        elif body and content_type != 'application/json':
+            reason = 'expected Content-Type: application/json'
+        elif not hmac.compare_digest(self.headers.get(TOKEN_HEADER, ''), self.server.token):
+            reason = 'missing or wrong token'
+        else:
+            return True
+        self._reply(403, {'error': f'Forbidden: {reason}'})
+        return False
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if not self._authorized(body=False):
+            return
+        if self.path == '/health':
+            self._reply(200, self.server.service.status())
+        else:
+            self._reply(404, {'error': f'Unknown path {self.path}'})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        service = self.server.service
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if self.path == '/jobs/search':
+                response = {'job': service.start_search(
+                    references=list(request['references']), directory=request['directory'],
+                    threshold=float(request.get('threshold', DEFAULT_SIMILARITY_THRESHOLD)),
+                    max_results=int(request.get('max_results', DEFAULT_MAX_RESULTS)),
+                    embedding_mode=request.get('embedding_mode', DEFAULT_EMBEDDING_MODE)
+                )}
+            elif self.path == '/jobs/poll':
+                response = service.poll(request['job'], int(request.get('since', 0)))
+            elif self.path == '/jobs/cancel':
+                service.cancel(request['job'])
+                response = {'job': request['job']}
+            elif self.path in ('/jobs/pause', '/jobs/resume'):
+                token = service.job(request['job']).token
+                if self.path == '/jobs/pause':
+                    token.pause()
+                else:
+                    token.resume()
+                response = {'job': request['job']}
+            elif self.path == '/analyze':
+                budget = request.get('budget')
+                response = service.analyze(
+                    request['file'], depth=request.get('depth', DEFAULT_ANALYSIS_DEPTH),
+                    budget=None if budget is None else float(budget)
+                )
+            elif self.path == '/preload':
+                response = service.preload(
+                    request['directory'], request.get('embedding_mode', DEFAULT_EMBEDDING_MODE)
+                )
+            else:
+                self._reply(404, {'error': f'Unknown path {self.path}'})
+                return
+        except (KeyError, ValueError) as e:
+            self._reply(400, {'error': f'Bad request: {e}'})
+            return
+        except Exception as e:
+            print(f"Service error on {self.path}: {e}")
+            self._reply(500, {'error': str(e)})
+            return
+        self._reply(200, response)
+
+
+def _write_token(path):
+    """Write a new session token to path, readable by this user only"""
+    token = secrets.token_urlsafe(32)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        if hasattr(os, 'fchmod'):
+            os.fchmod(f.fileno(), 0o600)  # the file may predate this session
+        f.write(token)
+    return token
+
+
+def _read_token(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def serve(host=SERVICE_HOST, port=SERVICE_PORT, preload=(), embedding_mode=DEFAULT_EMBEDDING_MODE,
+          workers=None, verbose=False, token_path=SERVICE_TOKEN_PATH):
+    """Run the service until interrupted"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.service = SimilarityService(workers)
+    server.verbose = verbose
+    server.token = _write_token(token_path)
+
+    print("Warming up...")
+    warm_up()
+    for directory in preload:
+        status = server.service.preload(directory, embedding_mode)
+        print(f"Loaded {status['tracks']} tracks from {status['directory']}")
+    print(f"MAST service listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        stop_watching()
+        if _read_token(token_path) == server.token:
+            os.remove(token_path)
+
+
+class ServiceClient:
+    """Client for a running MAST service; methods raise ServiceUnavailable if none is up"""
+
+    def __init__(self, host=SERVICE_HOST, port=SERVICE_PORT, timeout=SERVICE_TIMEOUT,
+                 token_path=SERVICE_TOKEN_PATH):
+        self.base_url = f'http://{host}:{port}'
+        self.timeout = timeout
+        self.token_path = token_path
+
+    def _request(self, path, payload=None, timeout=None):
+        token = _read_token(self.token_path)
+        if token is None:
+            raise ServiceUnavailable(f"No service token at {self.token_path}")
+        data = None if payload is None else json.dumps(payload).encode('utf-8')
+        request = urllib.request.Request(
+            self.base_url + path, data=data,
+            headers={'Content-Type': 'application/json', TOKEN_HEADER: token}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout or self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get('error', str(e))
+            except ValueError:
+                message = str(e)
+            raise RuntimeError(message)
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise ServiceUnavailable(str(e))
+
+    def is_running(self):
+        try:
+            return self._request('/health', timeout=0.5).get('service') == 'mast'
+        except (ServiceUnavailable, RuntimeError):
+            return False
+
+    def search(self, references, directory, threshold=DEFAULT_SIMILARITY_THRESHOLD,
+               max_results=DEFAULT_MAX_RESULTS, embedding_mode=DEFAULT_EMBEDDING_MODE,
+               progress=None, partial=None, token=None):
+        """
+        Returns ({reference: {path: distance}}, {reference: error}) with matches
+        ordered best first, like SimilaritySearch.run with skip_failed=True.
+
+        The search runs as a job on the service, polled every
+        JOB_POLL_INTERVAL: progress gets its percentage, partial its interim
+        results, and pausing or cancelling token pauses or cancels the job
+        (cancelling raises CancelledError).
+        """
+        progress = progress or (lambda value: None)
+        partial = partial or (lambda results: None)
+        token = token or CancellationToken()
+        # Report results under the paths the caller passed in
+        originals = {os.path.abspath(path): path for path in references}
+
+        def by_reference(results):
+            return {
+                originals.get(reference, reference): {path: distance for path, distance in matches}
+                for reference, matches in results.items()
+            }
+
+        try:
+            job = self._request('/jobs/search', {
+                'references': list(originals),
+                'directory': os.path.abspath(directory),
+                'threshold': threshold,
+                'max_results': max_results,
+                'embedding_mode': embedding_mode,
+            }, timeout=JOB_POLL_TIMEOUT)['job']
+        except RuntimeError as e:
+            # A service from before jobs existed, or one that could not start
+            # the job; the caller searches in-process instead
+            raise ServiceUnavailable(str(e))
+
+        paused = False
+        sequence = 0
+        try:
+            while True:
+                if token.is_cancelled:
+                    raise CancelledError()
+                if token.is_paused != paused:
+                    paused = token.is_paused
+                    self._request('/jobs/pause' if paused else '/jobs/resume', {'job': job},
+                                  timeout=JOB_POLL_TIMEOUT)
+                state = self._request('/jobs/poll', {'job': job, 'since': sequence},
+                                      timeout=JOB_POLL_TIMEOUT)
+                progress(state['progress'])
+                if 'partial' in state:
+                    sequence = state['sequence']
+                    partial(by_reference(state['partial']))
+                if state['state'] == 'done':
+                    response = state['result']
+                    break
+                if state['state'] == 'error':
+                    raise RuntimeError(state['error'])
+                if state['state'] == 'cancelled':
+                    raise CancelledError()
+                token.sleep(JOB_POLL_INTERVAL)
+        except CancelledError:
+            try:
+                self._request('/jobs/cancel', {'job': job}, timeout=JOB_POLL_TIMEOUT)
+            except (ServiceUnavailable, RuntimeError):
+                pass
+            raise
+
+        errors = {
+            originals.get(reference, reference): error
+            for reference, error in response['errors'].items()
+        }
+        return by_reference(response['results']), errors
+
+    def analyze(self, file_path, depth=DEFAULT_ANALYSIS_DEPTH, budget=None):
+        return self._request(
+            '/analyze', {'file': os.path.abspath(file_path), 'depth': depth, 'budget': budget}
+        )['analysis']
+
+    def preload(self, directory, embedding_mode=DEFAULT_EMBEDDING_MODE):
+        return self._request(
+            '/preload', {'directory': os.path.abspath(directory), 'embedding_mode': embedding_mode}
+        )
@@ -0,0 +1,97 @@
+import numpy as np
+
+# Vectorized scoring of one or more query embeddings against a stacked catalog.
+# Scores are distances (lower is more similar), matching calculate_song_similarity.
+
+
+def stack_embeddings(embeddings, dtype=np.float32):
+    """Stack a sequence of 1-D embeddings into a contiguous (N, D) matrix"""
+    if len(embeddings) == 0:
+        return np.empty((0, 0), dtype=dtype)
+    return np.ascontiguousarray(np.vstack(embeddings), dtype=dtype)
+
+
+def score_batch(query, matrix, method='cosine', normalized=True):
+    """
+    Distance from query to every row of matrix using a single matrix product.
+
+    query is one embedding (returns shape (N,)) or a (Q, D) stack of queries
+    (returns (Q, N)), so many queries cost one matrix-matrix product. With
+    normalized=True the rows and queries are assumed to be L2-normalized, as
+    returned by extract_audio_embedding, and the norm computation is skipped.
+    """
+    matrix = np.asarray(matrix)
+    query = np.asarray(query, dtype=matrix.dtype)
+    dots = query @ matrix.T
+
+    if method == 'cosine':
+        if not normalized:
+            query_norms = np.linalg.norm(query, axis=-1, keepdims=True)
+            norms = np.linalg.norm(matrix, axis=1) * query_norms
+            dots = dots / np.maximum(norms, np.finfo(matrix.dtype).tiny)
+        return 1.0 - dots
+    elif method == 'euclidean':
+        if normalized:
+            squared = 2.0 - 2.0 * dots
+        else:
+            row_norms = np.einsum('ij,ij->i', matrix, matrix)
+            query_norms = np.einsum('...d,...d->...', query, query)[..., np.newaxis]
+            squared = row_norms + query_norms - 2.0 * dots
+        return np.sqrt(np.maximum(squared, 0.0))
+    raise ValueError(f"Unknown similarity method: {method}")
+
+
+def top_k(distances, k, threshold=None):
+    """Indices of the k smallest distances (optionally <= threshold), best first"""
+    distances = np.asarray(distances)
+    candidates = np.arange(len(distances))
+    if threshold is not None:
+        candidates = np.flatnonzero(distances <= threshold)
+    if k is not None and k <= 0:
+        return candidates[:0]
+    if k is not None and len(candidates) > k:
+        partition = np.argpartition(distances[candidates], k - 1)[:k]
+        candidates = candidates[partition]
+    return candidates[np.argsort(distances[candidates], kind='stable')]
+
+
+def rank_matches(query, matrix, paths, k=None, threshold=None, method='cosine'):
+    """Score query against matrix and return {path: distance} for the best matches"""
+    if len(paths) == 0:
+        return {}
+    distances = score_batch(query, matrix, method)
+    return {paths[i]: float(distances[i]) for i in top_k(distances, k, threshold)}
+
+
+class TopK:
+    """
+    Bounded collection of the k best (smallest-distance) matches seen so far.
+
+    Memory is O(k) however many candidates are pushed.
+    """
+
+    def __init__(self, k, threshold=None):
+        self.k = k
+        self.threshold = threshold
+        self._heap = []  # max-heap on distance via negation
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push_many(self, paths, distances):
+        """Offer candidates; returns True if the current best set changed"""
+        import heapq
+        changed = False
+        for i in top_k(distances, self.k, self.threshold):
+            entry = (-float(distances[i]), paths[i])
+            if len(self._heap) < self.k:
+                heapq.heappush(self._heap, entry)
+                changed = True
+            elif entry > self._heap[0]:
+                heapq.heapreplace(self._heap, entry)
+                changed = True
+        return changed
+
+    def results(self):
+        """{path: distance} ordered best first"""
+        return {path: -neg for neg, path in sorted(self._heap, reverse=True)}
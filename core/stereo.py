@@ -0,0 +1,125 @@
+import numpy as np
+
+# Stereo-field metrics from the file's native channels (analysis otherwise
+# works on a mono mixdown). Everything is accumulated block by block from
+# running sums and an averaged mid/side power spectrum, so a file is read once
+# and no full-length channel copies are held.
+
+STEREO_FRAME_SIZE = 4096  # FFT size of the mid/side power spectra
+STEREO_BANDS = (
+    ('low', 0, 250),
+    ('low_mid', 250, 2000),
+    ('high_mid', 2000, 8000),
+    ('high', 8000, None),
+)
+
+
+def _width(mid, side):
+    """Side share of mid + side energy: 0 is mono, 0.5 uncorrelated, 1 fully out of phase"""
+    total = mid + side
+    return float(side / total) if total > 0 else 0.0
+
+
+class StereoAccumulator:
+    """
+    Running stereo statistics of a signal fed in blocks of (samples, channels).
+
+    Files with more than two channels are measured on the first two (front
+    left and right).
+    """
+
+    def __init__(self, sr, channels, frame_size=STEREO_FRAME_SIZE):
+        from scipy.fft import rfft
+        self._rfft = rfft
+        self.sr = sr
+        self.channels = channels
+        self.frame_size = frame_size
+        self.window = np.hanning(frame_size).astype(np.float32)
+        self.count = 0
+        self.sums = np.zeros(5)  # L, R, L^2, R^2, LR
+        self.abs_sums = np.zeros(2)
+        self.spectra = np.zeros((2, frame_size // 2 + 1))  # mid, side
+        self._carry = np.zeros((2, 0), dtype=np.float32)  # mid/side samples short of a frame
+
+    def add(self, block):
+        if self.channels < 2 or not len(block):
+            return
+        # Contiguous channel rows: reductions over interleaved columns are several times slower
+        left, right = np.ascontiguousarray(block[:, :2].T, dtype=np.float64)
+        self.count += len(left)
+        self.sums += (left.sum(), right.sum(), left @ left, right @ right, left @ right)
+        self.abs_sums += (np.abs(left).sum(), np.abs(right).sum())
+
+        # Whole frames go into the spectra; the remainder waits for the next block
+        mid_side = np.array([left + right, left - right], dtype=np.float32)
+        mid_side *= 0.5
+        if self._carry.shape[1]:
+            mid_side = np.hstack([self._carry, mid_side])
+        usable = mid_side.shape[1] // self.frame_size * self.frame_size
+        self._carry = mid_side[:, usable:]
+        if usable:
+            self._add_spectra(mid_side[:, :usable])
+
+    def _add_spectra(self, mid_side):
+        """Add the windowed power spectra of whole frames of the (2, samples) mid/side signal"""
+        frames = mid_side.reshape(2, -1, self.frame_size) * self.window
+        spectra = self._rfft(frames, axis=-1)  # complex64 for float32 input
+        self.spectra += (spectra.real ** 2 + spectra.imag ** 2).sum(axis=1)
+
+    def result(self):
+        """Stereo metrics as a JSON-friendly dict; call once, after the last block"""
+        if self.channels < 2:
+            return {'type': 'mono', 'channels': self.channels}
+        if self._carry.shape[1]:
+            # Zero padding the last partial frame adds no energy
+            tail = np.zeros((2, self.frame_size), dtype=np.float32)
+            tail[:, :self._carry.shape[1]] = self._carry
+            self._add_spectra(tail)
+            self._carry = self._carry[:, :0]
+
+        n = max(self.count, 1)
+        sum_l, sum_r, sum_ll, sum_rr, sum_lr = self.sums
+        var_l = sum_ll / n - (sum_l / n) ** 2
+        var_r = sum_rr / n - (sum_r / n) ** 2
+        covariance = sum_lr / n - (sum_l / n) * (sum_r / n)
+        denominator = np.sqrt(max(var_l, 0.0) * max(var_r, 0.0))
+
+        frequencies = np.fft.rfftfreq(self.frame_size, 1.0 / self.sr)
+        mid, side = self.spectra
+        bands = {}
+        for name, low, high in STEREO_BANDS:
+            mask = frequencies >= low
+            if high is not None:
+                mask &= frequencies < high
+            bands[name] = _width(mid[mask].sum(), side[mask].sum())
+
+        mid_energy, side_energy = mid.sum(), side.sum()
+        return {
+            'type': 'stereo' if self.channels == 2 else 'multichannel',
+            'channels': self.channels,
+            'correlation': float(covariance / denominator) if denominator > 0 else 1.0,
+            'balance': float(self.abs_sums[0] / self.abs_sums[1]) if self.abs_sums[1] > 0 else None,
+            'balance_db': float(10 * np.log10(sum_ll / sum_rr)) if sum_ll > 0 and sum_rr > 0 else None,
+            'side_to_mid_db': (
+                float(10 * np.log10(side_energy / mid_energy))
+                if side_energy > 0 and mid_energy > 0 else None
+            ),
+            'width': _width(mid_energy, side_energy),
+            'bands': bands,
+        }
+
+
+def describe_stereo(stereo):
+    """One-line human-readable summary of a stereo result"""
+    if stereo.get('type') == 'mono':
+        return "mono"
+    side_to_mid = stereo['side_to_mid_db']
+    bands = ', '.join(
+        f"{name.replace('_', '-')} {width:.2f}" for name, width in stereo['bands'].items()
+    )
+    text = f"correlation {stereo['correlation']:.2f}"
+    if stereo['balance_db'] is not None:
+        text += f", L/R balance {stereo['balance_db']:+.1f} dB"
+    if side_to_mid is not None:
+        text += f", side/mid {side_to_mid:.1f} dB"
+    return text + f", width {stereo['width']:.2f} ({bands})"
@@ -0,0 +1,280 @@
+import numpy as np
+
+from core.features import ANALYSIS_N_FFT, ANALYSIS_HOP_LENGTH, rms_from_magnitude
+from core.clipping import ClippingDetector
+from core.loudness import LoudnessMeter
+from core.stereo import StereoAccumulator
+from config.settings import CLIPPING_THRESHOLD
+
+# Block-streaming analysis for long recordings (DJ mixes, live sets). The file
+# is read with soundfile one block at a time and every statistic is
+# accumulated as it goes, so memory stays at a couple of blocks plus
+# fixed-size display arrays and a 4-byte-per-frame onset envelope, however
+# long the file is. librosa.load would hold the whole signal and a
+# full-resolution spectrogram instead. measure_channels reads every file the
+# same way for the measurements that need its native channels and rate.
+
+STREAM_BLOCK_FRAMES = 512  # STFT frames per block, about 6 s at 44.1 kHz
+NATIVE_BLOCK_SIZE = 1 << 18  # samples per channel read at a time by measure_channels
+STREAM_SPECTROGRAM_COLUMNS = 2048  # time columns of the display spectrogram
+STREAM_WAVEFORM_BINS = 8192  # min/max pairs in the display waveform
+_TEMPOGRAM_WINDOW = 384  # librosa's default tempogram window, in onset frames
+_TEMPOGRAM_SEGMENT = 8192  # onset frames per tempogram pass
+
+
+def _ignore(*args):
+    pass
+
+
+def stream_duration(file_path):
+    """Duration in seconds if soundfile can stream file_path, else None"""
+    import soundfile as sf
+    try:
+        return sf.info(file_path).duration
+    except Exception:
+        return None
+
+
+def _native_blocks(file_path, block_size, offset=0.0, duration=None):
+    """
+    (sample rate, channels, blocks) of file_path, or of duration seconds of
+    it from offset, at its native rate and channel layout, blocks being
+    float32 arrays of (samples, channels). Files soundfile cannot read are
+    decoded whole with librosa (mono=False).
+    """
+    import soundfile as sf
+    try:
+        info = sf.info(file_path)
+    except Exception:
+        info = None
+    if info is not None:
+        return info.samplerate, info.channels, sf.blocks(
+            file_path, blocksize=block_size, dtype='float32', always_2d=True,
+            start=int(offset * info.samplerate),
+            frames=-1 if duration is None else int(duration * info.samplerate)
+        )
+
+    import librosa
+    y, sr = librosa.load(file_path, sr=None, mono=False, offset=offset, duration=duration)
+    y = np.atleast_2d(y)
+    return sr, y.shape[0], (y[:, start:start + block_size].T for start in range(0, y.shape[1], block_size))
+
+
+def _channel_results(loudness, stereo, clipping):
+    summary, momentary, short_term = loudness.result()
+    clipping_summary, clip_regions = clipping.result()
+    return {
+        'peak': loudness.sample_peak,
+        'clipped_samples': sum(clipping_summary['samples']),
+        'clipping': clipping_summary,
+        'clip_regions': clip_regions,
+        'lufs': summary,
+        'momentary_lufs': momentary,
+        'short_term_lufs': short_term,
+        'stereo': stereo.result(),
+    }
+
+
+def measure_channels(file_path, token=None, block_size=NATIVE_BLOCK_SIZE, offset=0.0, duration=None):
+    """
+    Sample peak, clipping regions (see core.clipping), BS.1770 loudness (see
+    core.loudness) and stereo field (see core.stereo) of file_path, in one
+    pass over its native channels. Returns the 'peak', 'clipped_samples',
+    'clipping', 'clip_regions', 'lufs', 'momentary_lufs', 'short_term_lufs'
+    and 'stereo' analysis entries. With duration, only that many seconds from
+    offset are measured, and clip region positions count from offset.
+    """
+    sr, channels, blocks = _native_blocks(file_path, block_size, offset, duration)
+    loudness = LoudnessMeter(sr, channels)
+    stereo = StereoAccumulator(sr, channels)
+    clipping = ClippingDetector(sr, channels)
+    for block in blocks:
+        if token is not None:
+            token.check()
+        loudness.add(block)
+        stereo.add(block)
+        clipping.add(block)
+    return _channel_results(loudness, stereo, clipping)
+
+
+def measure_clipping(file_path, threshold=CLIPPING_THRESHOLD, token=None, block_size=NATIVE_BLOCK_SIZE):
+    """
+    Clipping regions of file_path's native channels (see core.clipping) at
+    threshold, without the other measure_channels measurements. Returns the
+    'clipping' and 'clip_regions' analysis entries.
+    """
+    sr, channels, blocks = _native_blocks(file_path, block_size)
+    clipping = ClippingDetector(sr, channels, threshold=threshold)
+    for block in blocks:
+        if token is not None:
+            token.check()
+        clipping.add(block)
+    summary, regions = clipping.result()
+    return {'clipping': summary, 'clip_regions': regions}
+
+
+def _pool(values, start, step, ufunc):
+    """
+    Reduce values along the last axis, whose entries sit at positions start,
+    start + 1, ..., into bins of step positions. Returns (bins, reduced).
+    """
+    bins = (start + np.arange(values.shape[-1])) // step
+    edges = np.concatenate([[0], np.flatnonzero(np.diff(bins)) + 1])
+    return bins[edges], ufunc.reduceat(values, edges, axis=-1)
+
+
+def _rhythm(onset_envelope, sr, hop_length):
+    """(bpm, beat frames) from an onset envelope, without a full-length tempogram"""
+    import librosa
+    # The tempo estimate only needs the time-averaged tempogram, so it is
+    # summed over segments rather than built for the whole envelope at once
+    total = np.zeros(_TEMPOGRAM_WINDOW)
+    columns = 0
+    for start in range(0, len(onset_envelope), _TEMPOGRAM_SEGMENT):
+        context = max(0, start - _TEMPOGRAM_WINDOW)
+        tempogram = librosa.feature.tempogram(
+            onset_envelope=onset_envelope[context:start + _TEMPOGRAM_SEGMENT], sr=sr,
+            hop_length=hop_length, win_length=_TEMPOGRAM_WINDOW
+        )[:, start - context:]
+        total += tempogram.sum(axis=1)
+        columns += tempogram.shape[1]
+    tempo = librosa.feature.tempo(
+        tg=(total / max(columns, 1))[:, None], sr=sr, hop_length=hop_length
+    )
+    bpm = float(np.atleast_1d(tempo)[0])
+    _, beats = librosa.beat.beat_track(
+        onset_envelope=onset_envelope, sr=sr, hop_length=hop_length, bpm=bpm
+    )
+    return bpm, beats
+
+
+def analyze_stream(file_path, progress=None, token=None, n_fft=ANALYSIS_N_FFT,
+                   hop_length=ANALYSIS_HOP_LENGTH, block_frames=STREAM_BLOCK_FRAMES):
+    """
+    Analyze file_path block by block. Raises if soundfile cannot read it.
+
+    Returns the entries of AudioAnalyzer.analyze_audio except the key ones,
+    plus 'chroma_profile' (the mean 12-bin chroma) to detect them from.
+    'waveform' is an interleaved min/max envelope with 'waveform_rate' points
+    per second, and 'spectrogram' a max-pooled dB spectrogram with
+    'spectrogram_hop' samples per column. Channels are mixed to mono for
+    everything but the measure_channels entries, which are accumulated from
+    the same blocks.
+    """
+    import librosa
+    import soundfile as sf
+    progress = progress or _ignore
+
+    info = sf.info(file_path)
+    sr, total = info.samplerate, info.frames
+    n_frames = max(1, 1 + (total - n_fft) // hop_length)
+    column_step = -(-n_frames // STREAM_SPECTROGRAM_COLUMNS)
+    sample_step = max(1, -(-total // STREAM_WAVEFORM_BINS))
+
+    spectrum = np.zeros((1 + n_fft // 2, -(-n_frames // column_step)), dtype=np.float32)
+    lower = np.full(-(-max(total, 1) // sample_step), np.inf, dtype=np.float32)
+    upper = np.full(len(lower), -np.inf, dtype=np.float32)
+    onset_envelope = np.zeros(n_frames, dtype=np.float32)
+    mel_basis = librosa.filters.mel(sr=sr, n_fft=n_fft)
+    chroma_basis = librosa.filters.chroma(sr=sr, n_fft=n_fft, tuning=0.0)
+    frequencies = librosa.fft_frequencies(sr=sr, n_fft=n_fft)
+
+    rms_sum, rms_min, rms_max = 0.0, np.inf, 0.0
+    centroid_sum = centroid_squares = 0.0
+    chroma_sum = np.zeros(12)
+    loudness = LoudnessMeter(sr, info.channels)
+    stereo = StereoAccumulator(sr, info.channels)
+    clipping = ClippingDetector(sr, info.channels)
+    frames_done = 0
+    previous_mel = None
+    position = 0  # samples read so far
+
+    # Consecutive blocks overlap by n_fft - hop_length samples, so each STFT
+    # frame is computed exactly once with center=False
+    overlap = n_fft - hop_length
+    blocks = sf.blocks(
+        file_path, blocksize=block_frames * hop_length + overlap, overlap=overlap,
+        dtype='float32', always_2d=True
+    )
+    for block in blocks:
+        if token is not None:
+            token.check()
+        fresh = block if position == 0 else block[overlap:]
+        block_start = position - (len(block) - len(fresh))
+        mono = block.mean(axis=1)
+
+        if len(fresh):
+            loudness.add(fresh)
+            stereo.add(fresh)
+            clipping.add(fresh)
+            fresh_mono = mono[len(block) - len(fresh):]
+            bins, low = _pool(fresh_mono, position, sample_step, np.minimum)
+            _, high = _pool(fresh_mono, position, sample_step, np.maximum)
+            lower[bins] = np.minimum(lower[bins], low)
+            upper[bins] = np.maximum(upper[bins], high)
+            position += len(fresh)
+
+        if len(mono) < n_fft:
+            continue
+        first_frame = block_start // hop_length
+        S = np.abs(librosa.stft(mono, n_fft=n_fft, hop_length=hop_length, center=False))
+        S = S[:, :n_frames - first_frame]
+        power = S ** 2
+
+        rms = rms_from_magnitude(S, n_fft, hop_length)
+        rms_sum += float(rms.sum())
+        rms_min = min(rms_min, float(rms.min()))
+        rms_max = max(rms_max, float(rms.max()))
+
+        energy = S.sum(axis=0)
+        centroid = np.divide(frequencies @ S, energy, out=np.zeros_like(energy), where=energy > 0)
+        centroid_sum += float(centroid.sum())
+        centroid_squares += float((centroid.astype(np.float64) ** 2).sum())
+        chroma_sum += librosa.util.normalize(chroma_basis @ power, norm=np.inf, axis=0).sum(axis=1)
+
+        # Spectral flux of the log-mel spectrogram, carried across block edges
+        mel = librosa.power_to_db(mel_basis @ power, top_db=None)
+        if previous_mel is not None:
+            mel = np.hstack([previous_mel[:, None], mel])
+        flux = np.maximum(0.0, np.diff(mel, axis=1)).mean(axis=0)
+        onset_envelope[first_frame + S.shape[1] - len(flux):first_frame + S.shape[1]] = flux
+        previous_mel = mel[:, -1]
+
+        columns, pooled = _pool(S, first_frame, column_step, np.maximum)
+        spectrum[:, columns] = np.maximum(spectrum[:, columns], pooled)
+
+        frames_done += S.shape[1]
+        progress(int(90 * position / max(total, 1)))
+
+    if token is not None:
+        token.check()
+    bpm, beats = _rhythm(onset_envelope, sr, hop_length)
+    progress(95)
+
+    frames_done = max(frames_done, 1)
+    centroid_mean = centroid_sum / frames_done
+    waveform = np.empty(2 * len(lower), dtype=np.float32)
+    waveform[0::2] = np.where(np.isfinite(lower), lower, 0.0)
+    waveform[1::2] = np.where(np.isfinite(upper), upper, 0.0)
+    return {
+        **_channel_results(loudness, stereo, clipping),
+        'duration': total / sr,
+        'sample_rate': sr,
+        'loudness': {
+            'mean': rms_sum / frames_done,
+            'max': rms_max,
+            'min': rms_min if np.isfinite(rms_min) else 0.0,
+            'dynamic_range': rms_max - (rms_min if np.isfinite(rms_min) else 0.0)
+        },
+        'spectral': {
+            'centroid_mean': centroid_mean,
+            'centroid_std': float(np.sqrt(max(centroid_squares / frames_done - centroid_mean ** 2, 0.0)))
+        },
+        'waveform': waveform,
+        'waveform_rate': 2 * sr / sample_step,
+        'spectrogram': librosa.amplitude_to_db(spectrum, ref=np.max),
+        'spectrogram_hop': hop_length * column_step,
+        'bpm': bpm,
+        'beats': beats,
+        'chroma_profile': chroma_sum / frames_done,
+    }
@@ -0,0 +1,184 @@
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from core.cancellation import CancellationToken, CancelledError
+from core.search import SimilaritySearch
+from core.duplicates import DuplicateFinder
+from core.service import ServiceClient, ServiceUnavailable
+from core.mastering import master_track
+from config.settings import (
+    DEFAULT_EMBEDDING_MODE, DEFAULT_DUPLICATE_THRESHOLD, DEFAULT_CANDIDATE_POOL
+)
+
+# Thin QThread adapters over the Qt-free engine: they only translate callbacks,
+# return values and exceptions into signals for the UI.
+
+
+class SimilarityThread(QThread):
+    update_progress = pyqtSignal(int)
+    comparison_complete = pyqtSignal(dict)
+    partial_results = pyqtSignal(dict)
+    error_occurred = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, reference_song, directory, threshold=0.5, max_results=50, use_cache=True,
+                 workers=None, nprobe=0, embedding_mode=DEFAULT_EMBEDDING_MODE, token=None,
+                 watch=False, use_service=True, candidate_pool=DEFAULT_CANDIDATE_POOL):
+        super().__init__()
+        self.reference_song = reference_song
+        self.token = token or CancellationToken()
+        # A running `mast serve` answers from its warm catalog; it relies on the cache
+        self.use_service = use_service and use_cache
+        self.search = SimilaritySearch(
+            self._references(reference_song), directory, threshold, max_results, use_cache,
+            workers, nprobe, embedding_mode, self.token, watch, skip_failed=self._skip_failed(),
+            candidate_pool=candidate_pool
+        )
+
+    def _references(self, reference_song):
+        return [reference_song]
+
+    def _skip_failed(self):
+        return False
+
+    def _package_results(self, results):
+        """Shape of partial_results/comparison_complete payloads: {path: distance}"""
+        return results[self.reference_song]
+
+    def cancel(self):
+        self.token.cancel()
+
+    def pause(self):
+        self.token.pause()
+
+    def resume(self):
+        self.token.resume()
+
+    def _run_service(self):
+        """
+        Search through a running service; returns False if there is none, or
+        if the search needs options it does not support (it always scores
+        every track exactly, so IVF and two-stage searches run in-process)
+        """
+        search = self.search
+        if search.nprobe or search.candidate_pool:
+            return False
+        client = ServiceClient()
+        if not client.is_running():
+            return False
+        self.update_progress.emit(0)
+        try:
+            results, errors = client.search(
+                search.reference_songs, search.directory, search.threshold,
+                search.max_results, search.embedding_mode, progress=self.update_progress.emit,
+                partial=lambda results: self.partial_results.emit(self._package_results(results)),
+                token=self.token
+            )
+        except ServiceUnavailable:
+            return False
+        for path, error in errors.items():
+            if not self._skip_failed():
+                raise RuntimeError(error)
+            print(f"Error processing {path}: {error}, skipping target")
+        if not results:
+            raise RuntimeError("Could not extract embeddings for any of the target songs")
+        self.token.check()
+        self.update_progress.emit(100)
+        self.comparison_complete.emit(self._package_results(results))
+        return True
+
+    def run(self):
+        try:
+            if self.use_service and self._run_service():
+                return
+            self.search.run(
+                progress=self.update_progress.emit,
+                partial=lambda results: self.partial_results.emit(self._package_results(results)),
+                done=lambda results: self.comparison_complete.emit(self._package_results(results))
+            )
+        except CancelledError:
+            self.cancelled.emit()
+        except Exception as e:
+            self.error_occurred.emit(str(e))
+
+
+class BatchSimilarityThread(SimilarityThread):
+    """
+    Search the catalog for several target songs in one pass.
+
+    Results are emitted as {target: {path: distance}}. Targets that cannot be
+    decoded are skipped.
+    """
+
+    def __init__(self, target_songs, directory, **kwargs):
+        self.target_songs = list(target_songs)
+        super().__init__(target_songs[0], directory, **kwargs)
+
+    def _references(self, reference_song):
+        return self.target_songs
+
+    def _skip_failed(self):
+        return True
+
+    def _package_results(self, results):
+        return results
+
+
+class DuplicateThread(QThread):
+    update_progress = pyqtSignal(int)
+    duplicates_found = pyqtSignal(list)  # [{path: distance}, ...], largest cluster first
+    error_occurred = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, directory, threshold=DEFAULT_DUPLICATE_THRESHOLD, workers=None,
+                 embedding_mode=DEFAULT_EMBEDDING_MODE, token=None):
+        super().__init__()
+        self.token = token or CancellationToken()
+        self.finder = DuplicateFinder(directory, threshold, workers, embedding_mode, self.token)
+
+    def cancel(self):
+        self.token.cancel()
+
+    def pause(self):
+        self.token.pause()
+
+    def resume(self):
+        self.token.resume()
+
+    def run(self):
+        try:
+            self.duplicates_found.emit(self.finder.run(progress=self.update_progress.emit))
+        except CancelledError:
+            self.cancelled.emit()
+        except Exception as e:
+            self.error_occurred.emit(str(e))
+
+
+class MasteringThread(QThread):
+    progress_updated = pyqtSignal(int)
+    mastering_complete = pyqtSignal(str)  # Output path
+    error_occurred = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, target_path, reference_path, output_path, options, token=None):
+        super().__init__()
+        self.target_path = target_path
+        self.reference_path = reference_path
+        self.output_path = output_path
+        self.options = options
+        self.token = token or CancellationToken()
+
+    def cancel(self):
+        self.token.cancel()
+
+    def run(self):
+        try:
+            output_path = master_track(
+                self.target_path, self.reference_path, self.output_path, self.options,
+                token=self.token, progress=self.progress_updated.emit
+            )
+            self.mastering_complete.emit(output_path)
+        except CancelledError:
+            self.cancelled.emit()
+        except Exception as e:
+            print(f"Matchering error details: {str(e)}")
+            self.error_occurred.emit(str(e))
@@ -1,4 +1,5 @@
 import sys
+import multiprocessing
 from PyQt5.QtWidgets import QApplication, QSplashScreen, QLabel
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QPixmap, QColor
@@ -58,4 +59,6 @@ def main():
         return 1
 
 if __name__ == '__main__':
+    # Required for the embedding worker pool in frozen builds
+    multiprocessing.freeze_support()
     sys.exit(main())
\ No newline at end of file
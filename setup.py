@@ -4,6 +4,7 @@ setup(
     name="mast",
     version="1.0.0",
     packages=find_packages(),
+    py_modules=['main', 'cli'],
     install_requires=[
         'PyQt5>=5.15.0',
         'numpy>=1.19.0',
@@ -14,7 +15,7 @@ setup(
     ],
     entry_points={
         'console_scripts': [
-            'mast=main:main',
+            'mast=cli:main',
         ],
     },
     author="JK",
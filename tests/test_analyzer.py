@@ -0,0 +1,44 @@
+import numpy as np
+import soundfile as sf
+from unittest import mock
+
+from core import analyzer
+from config.settings import STREAMING_ANALYSIS_DURATION
+
+
+def test_long_file_soundfile_cannot_stream_is_loaded_whole(tmp_path):
+    # A long M4A/MP3 that soundfile cannot open: librosa still reports a duration
+    path = str(tmp_path / 'track.wav')
+    sr = 22050
+    t = np.arange(5 * sr) / sr
+    sf.write(path, (0.3 * np.sin(2 * np.pi * 440 * t)).astype(np.float32), sr)
+
+    with mock.patch.object(analyzer, 'stream_duration', return_value=None), \
+            mock.patch.object(analyzer, 'file_duration', return_value=STREAMING_ANALYSIS_DURATION + 60.0), \
+            mock.patch.object(analyzer.AudioAnalyzer, '_analyze_stream') as streamed:
+        analysis = analyzer.AudioAnalyzer().analyze_audio(path, depth='standard')
+
+    streamed.assert_not_called()
+    assert analysis is not None
+    assert analysis['depth'] == 'standard'
+    assert analysis['key'] is not None
+
+
+def test_shallower_result_is_not_cached_for_the_requested_depth(tmp_path):
+    from core.analysis_cache import AnalysisCache
+
+    path = str(tmp_path / 'track.wav')
+    sf.write(path, np.zeros(22050, dtype=np.float32), 22050)
+    cache = AnalysisCache(str(tmp_path / 'cache'))
+    calls = []
+
+    def analyze_audio(self, file_path, depth, **kwargs):
+        calls.append(depth)
+        return {'depth': 'standard', 'duration': 1.0}
+
+    with mock.patch.object(analyzer.AudioAnalyzer, 'analyze_audio', analyze_audio):
+        assert cache.analyze(path, depth='full')['depth'] == 'standard'
+        cache.analyze(path, depth='full')
+        assert cache.analyze(path, depth='standard')['depth'] == 'standard'
+
+    assert calls == ['full', 'full']
@@ -2,11 +2,68 @@ from PyQt5.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QLabel, 
     QTabWidget, QWidget
 )
-from PyQt5.QtCore import Qt
-from ..widgets.visualizers import WaveformVisualizer, SpectrogramVisualizer
+from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from ..widgets.visualizers import (
+    WaveformVisualizer, SpectrogramVisualizer, waveform_envelope, reduce_spectrogram, clip_spans
+)
 from core.analyzer import AudioAnalyzer
-import numpy as np
-import librosa
+from core.analysis_cache import shared_cache
+from core.cancellation import CancellationToken, CancelledError
+from core.clipping import describe_clipping
+from core.loudness import describe_loudness, rms_dbfs
+from core.stereo import describe_stereo
+
+class AnalysisThread(QThread):
+    """Analyzes one file, publishing each stage's results as soon as they are ready"""
+    partial_results = pyqtSignal(dict, int)  # Stage results, file number
+    analysis_complete = pyqtSignal(dict, int)
+    error_occurred = pyqtSignal(str)
+    cancelled = pyqtSignal(int)
+
+    def __init__(self, file_path, file_num, token=None):
+        super().__init__()
+        self.file_path = file_path
+        self.file_num = file_num
+        self.token = token or CancellationToken()
+        self.sample_rate = None
+        self.duration = None
+
+    def cancel(self):
+        self.token.cancel()
+
+    def _publish(self, results):
+        # Plot data is reduced to screen resolution here so the GUI thread only draws
+        results = dict(results)
+        self.sample_rate = results.get('sample_rate', self.sample_rate)
+        self.duration = results.get('duration', self.duration)
+        if 'waveform' in results:
+            results['waveform_plot'] = waveform_envelope(
+                results['waveform'], results['waveform_rate']
+            )
+        if 'spectrogram' in results:
+            results['spectrogram_plot'] = reduce_spectrogram(
+                results['spectrogram'], self.sample_rate, results['spectrogram_hop']
+            )
+        if 'clip_regions' in results:
+            results['clip_plot'] = clip_spans(
+                results['clip_regions'], results['clipping']['sample_rate'], self.duration
+            )
+        self.partial_results.emit(results, self.file_num)
+
+    def run(self):
+        try:
+            # The detailed report: a full-depth analysis, which also serves later lighter requests
+            analysis = shared_cache().analyze(
+                self.file_path, token=self.token, partial=self._publish, depth='full'
+            )
+            if analysis is None:
+                self.error_occurred.emit(f"Could not analyze {self.file_path}")
+                return
+            self.analysis_complete.emit(analysis, self.file_num)
+        except CancelledError:
+            self.cancelled.emit(self.file_num)
+        except Exception as e:
+            self.error_occurred.emit(str(e))
 
 class AudioAnalysisDialog(QDialog):
     def __init__(self, parent=None):
@@ -14,6 +71,8 @@ class AudioAnalysisDialog(QDialog):
         self.file_path = None
         self.reference_path = None
         self.analyzer = AudioAnalyzer()
+        self.analyses = {1: {}, 2: {}}
+        self.threads = []
         self.setWindowModality(Qt.NonModal)
         self.setWindowFlags(Qt.Window | Qt.WindowSystemMenuHint | Qt.WindowCloseButtonHint)
 
@@ -21,8 +80,8 @@ class AudioAnalysisDialog(QDialog):
         self.file_path = file_path
         self.reference_path = reference_path
         self.initUI()
-        self.analyze_files()
         self.show()
+        self.analyze_files()
 
     def initUI(self):
         if not self.file_path:
@@ -48,13 +107,6 @@ class AudioAnalysisDialog(QDialog):
             waveform_layout.addWidget(QLabel("Reference Waveform"))
             waveform_layout.addWidget(self.waveform_viz2)
         
-        # Initialize with dummy data
-        dummy_data = np.zeros(1000)
-        sr = 44100
-        self.waveform_viz1.plot_waveform(dummy_data, sr)
-        if self.reference_path:
-            self.waveform_viz2.plot_waveform(dummy_data, sr)
-        
         tab_widget.addTab(waveform_tab, "Waveforms")
 
         # Spectrum tab
@@ -71,17 +123,12 @@ class AudioAnalysisDialog(QDialog):
             spectrum_layout.addWidget(QLabel("Reference Spectrum"))
             spectrum_layout.addWidget(self.spectrum_viz2)
         
-        # Initialize with dummy spectrograms
-        self.spectrum_viz1.plot_spectrogram(np.zeros((100,100)), sr)
-        if self.reference_path:
-            self.spectrum_viz2.plot_spectrogram(np.zeros((100,100)), sr)
-        
         tab_widget.addTab(spectrum_tab, "Spectrums")
         
         # Info tab
         info_tab = QWidget()
         info_layout = QVBoxLayout(info_tab)
-        self.info_label = QLabel()
+        self.info_label = QLabel("Analyzing...")
         info_layout.addWidget(self.info_label)
         tab_widget.addTab(info_tab, "Audio Info")
         
@@ -112,57 +159,82 @@ class AudioAnalysisDialog(QDialog):
         """)
 
     def analyze_files(self):
-        """Analyze the loaded audio files"""
-        try:
-            y, sr = librosa.load(self.file_path)
-            if len(y) == 0:
-                print("Error: No audio data loaded")
-                return
+        """Analyze the loaded audio files in the background; panels fill in stage by stage"""
+        files = [(self.file_path, 1)]
+        if self.reference_path:
+            files.append((self.reference_path, 2))
+        for path, file_num in files:
+            # Shared with the comparison dialog and the engine, so reopening is instant
+            thread = AnalysisThread(path, file_num)
+            thread.partial_results.connect(self.handle_partial_results)
+            thread.error_occurred.connect(self.handle_error)
+            self.threads.append(thread)
+            thread.start()
+
+    def handle_partial_results(self, results, file_num):
+        analysis = self.analyses[file_num]
+        analysis.update(results)
+        sr = analysis.get('sample_rate')
+        waveform_viz = self.waveform_viz1 if file_num == 1 else self.waveform_viz2
+        spectrum_viz = self.spectrum_viz1 if file_num == 1 else self.spectrum_viz2
+        if 'waveform_plot' in results:
+            waveform_viz.plot_waveform(results['waveform_plot'], sr)
+        if 'clip_plot' in analysis and ('clip_plot' in results or 'waveform_plot' in results):
+            waveform_viz.plot_clipping(analysis['clip_plot'])
+        if 'spectrogram_plot' in results:
+            spectrum_viz.plot_spectrogram(results['spectrogram_plot'], sr)
+        self.update_info(file_num, analysis)
+
+    def handle_error(self, error_msg):
+        print(f"Error analyzing file: {error_msg}")
 
-            # Calculate spectrogram
-            spec = np.abs(librosa.stft(y))
-            spec_db = librosa.amplitude_to_db(spec, ref=np.max)
-            
-            # Update visualizations
-            self.waveform_viz1.plot_waveform(y, sr)
-            self.spectrum_viz1.plot_spectrogram(spec_db, sr)
-            
-            # Calculate audio info
-            tempo, beats = librosa.beat.beat_track(y=y, sr=sr)
-            chroma = librosa.feature.chroma_cqt(y=y, sr=sr)
-            rms = librosa.feature.rms(y=y)[0]
-            
-            analysis = {
-                'duration': len(y) / sr,
-                'bpm': float(tempo),
-                'loudness': {
-                    'mean': float(np.mean(rms)),
-                    'max': float(np.max(rms)),
-                    'min': float(np.min(rms)),
-                    'dynamic_range': float(np.max(rms) - np.min(rms))
-                }
-            }
-            
-            self.update_info(1, analysis)
-            
-        except Exception as e:
-            print(f"Error analyzing file: {str(e)}")
-            
     def update_info(self, file_num, analysis):
-        info_text = f"""
-        <b>Duration:</b> {analysis['duration']:.2f} seconds<br>
-        <b>BPM:</b> {analysis['bpm']:.1f}<br>
+        self.analyses[file_num] = analysis
+        sections = []
+        for num, title in ((1, 'Target'), (2, 'Reference')):
+            if num == 2 and not self.reference_path:
+                continue
+            sections.append(self._info_text(title, self.analyses[num]))
+        self.info_label.setText('<br>'.join(sections))
+        self.info_label.setTextFormat(Qt.RichText)
+
+    def _info_text(self, title, analysis):
+        """Info for one file; values that are still being analyzed show as ..."""
+        pending = '...'
+        header = f"<b>{title}</b><br>" if self.reference_path else ''
+        if 'duration' not in analysis:
+            return header + "Analyzing...<br>"
+        bpm = f"{analysis['bpm']:.1f}" if 'bpm' in analysis else pending
+        key = (
+            f"{analysis['key']} {analysis['scale']} (confidence {analysis['key_confidence']:.2f})"
+            if 'key' in analysis else pending
+        )
+        stereo = describe_stereo(analysis['stereo']) if 'stereo' in analysis else pending
+        clipping = describe_clipping(analysis['clipping']) if 'clipping' in analysis else pending
+        readings = describe_loudness(analysis['lufs']) if 'lufs' in analysis else [('Integrated', pending)]
+        rms = rms_dbfs(analysis['loudness']['mean'])
+        readings.append(('RMS', 'n/a' if rms is None else f"{rms:.1f} dBFS"))
+        loudness = ''.join(f"• {label}: {value}<br>" for label, value in readings)
+        excerpt = ''
+        if analysis.get('excerpt'):
+            offset, length = analysis['excerpt']
+            excerpt = f" (analyzed {length:.0f} s from {offset:.0f} s)"
+        return header + f"""
+        <b>Duration:</b> {analysis['duration']:.2f} seconds{excerpt}<br>
+        <b>BPM:</b> {bpm}<br>
+        <b>Key:</b> {key}<br>
         <b>Loudness:</b><br>
-        • Average: {analysis['loudness']['mean']:.2f} dB<br>
-        • Peak: {analysis['loudness']['max']:.2f} dB<br>
-        • Dynamic Range: {analysis['loudness']['dynamic_range']:.2f} dB
+        {loudness}
+        <b>Clipping:</b> {clipping}<br>
+        <b>Stereo:</b> {stereo}
         """
-        self.info_label.setText(info_text)
-        self.info_label.setTextFormat(Qt.RichText)
 
     def closeEvent(self, event):
         """Override closeEvent to handle cleanup when dialog is closed"""
         # Stop audio player if it exists
         if hasattr(self, 'audio_player'):
             self.audio_player.player.stop()
+        for thread in self.threads:
+            thread.cancel()
+            thread.wait()
         super().closeEvent(event)
\ No newline at end of file
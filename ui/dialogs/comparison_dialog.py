@@ -1,48 +1,42 @@
 from PyQt5.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QLabel, 
-    QTabWidget, QWidget
+    QTabWidget, QWidget, QPushButton
 )
 from PyQt5.QtCore import Qt, QThread, pyqtSignal
 from PyQt5.QtGui import QPixmap
-import librosa
-import numpy as np
 import os
 from datetime import datetime
-from ..widgets.visualizers import WaveformVisualizer, SpectrogramVisualizer
+from ..widgets.visualizers import WaveformVisualizer, SpectrogramVisualizer, clip_spans
 from core.analyzer import AudioAnalyzer
+from core.analysis_cache import shared_cache
+from core.cancellation import CancellationToken, CancelledError
+from core.clipping import describe_clipping
+from core.loudness import describe_loudness, rms_dbfs
+from core.stereo import describe_stereo
 
 class AnalysisThread(QThread):
     analysis_complete = pyqtSignal(dict, int)  # Analysis results, file number
     error_occurred = pyqtSignal(str)
+    cancelled = pyqtSignal(int)  # File number
     
-    def __init__(self, file_path, file_num):
+    def __init__(self, file_path, file_num, token=None):
         super().__init__()
         self.file_path = file_path
         self.file_num = file_num
+        self.token = token or CancellationToken()
+
+    def cancel(self):
+        self.token.cancel()
         
     def run(self):
         try:
-            y, sr = librosa.load(self.file_path)
-            spec = np.abs(librosa.stft(y))
-            spec_db = librosa.amplitude_to_db(spec, ref=np.max)
-            
-            tempo, beats = librosa.beat.beat_track(y=y, sr=sr)
-            rms = librosa.feature.rms(y=y)[0]
-            
-            analysis = {
-                'waveform': y,
-                'sample_rate': sr,
-                'spectrogram': spec_db,
-                'duration': len(y) / sr,
-                'bpm': float(tempo),
-                'loudness': {
-                    'mean': float(np.mean(rms)),
-                    'max': float(np.max(rms)),
-                    'min': float(np.min(rms)),
-                    'dynamic_range': float(np.max(rms) - np.min(rms))
-                }
-            }
+            analysis = shared_cache().analyze(self.file_path, token=self.token)
+            if analysis is None:
+                self.error_occurred.emit(f"Could not analyze {self.file_path}")
+                return
             self.analysis_complete.emit(analysis, self.file_num)
+        except CancelledError:
+            self.cancelled.emit(self.file_num)
         except Exception as e:
             self.error_occurred.emit(str(e))
 
@@ -64,12 +58,16 @@ class AudioComparisonDialog(QDialog):
         self.thread1 = AnalysisThread(file1_path, 1)
         self.thread1.analysis_complete.connect(self.handle_analysis_complete)
         self.thread1.error_occurred.connect(self.handle_error)
+        self.thread1.cancelled.connect(self.handle_cancelled)
+        self.thread1.finished.connect(self.update_cancel_button)
         self.thread1.start()
         
         if file2_path:
             self.thread2 = AnalysisThread(file2_path, 2)
             self.thread2.analysis_complete.connect(self.handle_analysis_complete)
             self.thread2.error_occurred.connect(self.handle_error)
+            self.thread2.cancelled.connect(self.handle_cancelled)
+            self.thread2.finished.connect(self.update_cancel_button)
             self.thread2.start()
         
         self.show()
@@ -190,6 +188,10 @@ class AudioComparisonDialog(QDialog):
         tab_widget.addTab(info_tab, "Audio Info")
         layout.addWidget(tab_widget)
 
+        self.cancel_button = QPushButton("Cancel Analysis")
+        self.cancel_button.clicked.connect(self.cancel_analysis)
+        layout.addWidget(self.cancel_button)
+
         # Load artwork immediately (no need to wait for analysis)
         self.load_artwork()
 
@@ -222,20 +224,56 @@ class AudioComparisonDialog(QDialog):
             self.loading_label1.hide()
             self.waveform_viz1.show()
             self.spectrum_viz1.show()
-            self.waveform_viz1.plot_waveform(analysis['waveform'], analysis['sample_rate'])
-            self.spectrum_viz1.plot_spectrogram(analysis['spectrogram'], analysis['sample_rate'])
+            self.waveform_viz1.plot_waveform(analysis['waveform'], analysis['waveform_rate'])
+            self.waveform_viz1.plot_clipping(clip_spans(
+                analysis['clip_regions'], analysis['clipping']['sample_rate'], analysis['duration']
+            ))
+            self.spectrum_viz1.plot_spectrogram(
+                analysis['spectrogram'], analysis['sample_rate'], analysis['spectrogram_hop']
+            )
             self.update_info(1, analysis)
         else:
             self.loading_label2.hide()
             self.waveform_viz2.show()
             self.spectrum_viz2.show()
-            self.waveform_viz2.plot_waveform(analysis['waveform'], analysis['sample_rate'])
-            self.spectrum_viz2.plot_spectrogram(analysis['spectrogram'], analysis['sample_rate'])
+            self.waveform_viz2.plot_waveform(analysis['waveform'], analysis['waveform_rate'])
+            self.waveform_viz2.plot_clipping(clip_spans(
+                analysis['clip_regions'], analysis['clipping']['sample_rate'], analysis['duration']
+            ))
+            self.spectrum_viz2.plot_spectrogram(
+                analysis['spectrogram'], analysis['sample_rate'], analysis['spectrogram_hop']
+            )
             self.update_info(2, analysis)
 
     def handle_error(self, error_msg):
         print(f"Analysis error: {error_msg}")
 
+    def handle_cancelled(self, file_num):
+        label = self.loading_label1 if file_num == 1 else self.loading_label2
+        label.setText("Analysis cancelled")
+
+    def _analysis_threads(self):
+        return [t for t in (getattr(self, 'thread1', None), getattr(self, 'thread2', None)) if t]
+
+    def cancel_analysis(self):
+        for thread in self._analysis_threads():
+            thread.cancel()
+        self.cancel_button.setEnabled(False)
+
+    def update_cancel_button(self):
+        # The finishing thread may still report isRunning() while its signal is delivered
+        running = any(
+            t.isRunning() for t in self._analysis_threads() if t is not self.sender()
+        )
+        self.cancel_button.setVisible(running)
+
+    def closeEvent(self, event):
+        """Stop any analysis still running when the dialog is closed"""
+        for thread in self._analysis_threads():
+            thread.cancel()
+            thread.wait()
+        super().closeEvent(event)
+
     def load_artwork(self):
         """Load artwork immediately without waiting for analysis"""
         try:
@@ -320,13 +358,17 @@ class AudioComparisonDialog(QDialog):
                 if hasattr(audio.info, 'channels'):
                     info_text += f"<b>Channels:</b> {audio.info.channels}<br>"
 
+            readings = describe_loudness(analysis['lufs'])
+            rms = rms_dbfs(analysis['loudness']['mean'])
+            readings.append(('RMS', 'n/a' if rms is None else f"{rms:.1f} dBFS"))
+            loudness = ''.join(f"• {label}: {value}<br>" for label, value in readings)
             info_text += f"""
             <b>Duration:</b> {analysis['duration']:.2f} seconds<br>
             <b>BPM:</b> {analysis['bpm']:.1f}<br>
             <b>Loudness:</b><br>
-            • Average: {analysis['loudness']['mean']:.2f} dB<br>
-            • Peak: {analysis['loudness']['max']:.2f} dB<br>
-            • Dynamic Range: {analysis['loudness']['dynamic_range']:.2f} dB<br>
+            {loudness}
+            <b>Clipping:</b> {describe_clipping(analysis['clipping'])}<br>
+            <b>Stereo:</b> {describe_stereo(analysis['stereo'])}<br>
             """
 
             if audio is not None and hasattr(audio, 'tags') and audio.tags:
@@ -0,0 +1,66 @@
+import os
+from PyQt5.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushButton,
+    QTreeWidget, QTreeWidgetItem, QHeaderView
+)
+from PyQt5.QtCore import Qt
+
+class DuplicatesDialog(QDialog):
+    """Lists duplicate clusters found in the music directory"""
+
+    def __init__(self, clusters, directory, parent=None):
+        super().__init__(parent)
+        self.clusters = clusters
+        self.directory = directory
+        self.setWindowModality(Qt.NonModal)
+        self.setWindowFlags(Qt.Window | Qt.WindowSystemMenuHint | Qt.WindowCloseButtonHint)
+        self.initUI()
+
+    def initUI(self):
+        self.setWindowTitle('Duplicate Tracks')
+        self.resize(800, 500)
+        layout = QVBoxLayout()
+
+        files = sum(len(cluster) for cluster in self.clusters)
+        summary = QLabel(
+            f'{len(self.clusters)} groups of duplicates ({files} files) in {self.directory}'
+            if self.clusters else f'No duplicates found in {self.directory}'
+        )
+        layout.addWidget(summary)
+
+        self.tree = QTreeWidget()
+        self.tree.setHeaderLabels(['File', 'Format', 'Size (MB)', 'Distance', 'Folder'])
+        self.tree.header().setSectionResizeMode(0, QHeaderView.ResizeToContents)
+        for number, cluster in enumerate(self.clusters, start=1):
+            group = QTreeWidgetItem([f'Group {number} ({len(cluster)} files)'])
+            for path, distance in cluster.items():
+                try:
+                    size = f'{os.path.getsize(path) / (1024 * 1024):.2f}'
+                except OSError:
+                    size = ''
+                item = QTreeWidgetItem([
+                    os.path.basename(path),
+                    os.path.splitext(path)[1].lstrip('.').upper(),
+                    size,
+                    f'{distance:.4f}',
+                    os.path.dirname(path)
+                ])
+                item.setData(0, Qt.UserRole, path)
+                group.addChild(item)
+            self.tree.addTopLevelItem(group)
+        self.tree.expandAll()
+        layout.addWidget(self.tree)
+
+        button_layout = QHBoxLayout()
+        button_layout.addStretch()
+        export_btn = QPushButton('Export CSV')
+        export_btn.setEnabled(bool(self.clusters))
+        if self.parent() is not None:
+            export_btn.clicked.connect(self.parent().export_duplicates)
+        button_layout.addWidget(export_btn)
+        close_btn = QPushButton('Close')
+        close_btn.clicked.connect(self.close)
+        button_layout.addWidget(close_btn)
+        layout.addLayout(button_layout)
+
+        self.setLayout(layout)
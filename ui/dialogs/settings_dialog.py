@@ -4,6 +4,26 @@ from PyQt5.QtWidgets import (
     QDialogButtonBox, QSlider, QFileDialog
 )
 from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QIntValidator
+
+# Accepted range of each integer setting
+INT_SETTING_RANGES = {
+    'max_results': (1, 10000),
+    'embedding_workers': (0, 256),
+    'ann_nprobe': (0, 4096),
+    'candidate_pool': (0, 100000),
+}
+
+
+def setting_int(settings, key, default):
+    """Integer setting clamped to its range, or default if it is missing or malformed"""
+    try:
+        value = int(settings.value(key, default))
+    except (TypeError, ValueError):
+        return default
+    minimum, maximum = INT_SETTING_RANGES.get(key, (value, value))
+    return min(max(value, minimum), maximum)
+
 
 class SettingsDialog(QDialog):
     def __init__(self, parent=None):
@@ -101,10 +121,58 @@ class SettingsDialog(QDialog):
         results_layout = QHBoxLayout()
         results_layout.addWidget(QLabel("Maximum Results:"))
         self.max_results_input = QLineEdit()
-        self.max_results_input.setText(self.settings.value('max_results', '50'))
+        self.max_results_input.setValidator(QIntValidator(*INT_SETTING_RANGES['max_results'], self))
+        self.max_results_input.setText(str(setting_int(self.settings, 'max_results', 50)))
         results_layout.addWidget(self.max_results_input)
         similarity_layout.addLayout(results_layout)
 
+        # Worker processes for embedding extraction
+        workers_layout = QHBoxLayout()
+        workers_layout.addWidget(QLabel("Worker Processes (0 = auto):"))
+        self.workers_input = QLineEdit()
+        self.workers_input.setValidator(QIntValidator(*INT_SETTING_RANGES['embedding_workers'], self))
+        self.workers_input.setText(str(setting_int(self.settings, 'embedding_workers', 0)))
+        workers_layout.addWidget(self.workers_input)
+        similarity_layout.addLayout(workers_layout)
+
+        # Embedding format used for similarity search
+        mode_layout = QHBoxLayout()
+        mode_layout.addWidget(QLabel("Embedding Format:"))
+        self.embedding_mode_combo = QComboBox()
+        self.embedding_mode_combo.addItem("Full Mel Spectrogram", 'mel')
+        self.embedding_mode_combo.addItem("Compact Statistics", 'compact')
+        mode_index = self.embedding_mode_combo.findData(self.settings.value('embedding_mode', 'mel'))
+        self.embedding_mode_combo.setCurrentIndex(max(mode_index, 0))
+        self.embedding_mode_combo.setToolTip(
+            "Compact embeddings are ~100x smaller and robust to alignment; "
+            "switching formats re-analyzes the catalog once"
+        )
+        mode_layout.addWidget(self.embedding_mode_combo)
+        similarity_layout.addLayout(mode_layout)
+
+        # Approximate search: IVF lists probed per query
+        nprobe_layout = QHBoxLayout()
+        nprobe_layout.addWidget(QLabel("Index Lists Probed (0 = exact search):"))
+        self.nprobe_input = QLineEdit()
+        self.nprobe_input.setValidator(QIntValidator(*INT_SETTING_RANGES['ann_nprobe'], self))
+        self.nprobe_input.setText(str(setting_int(self.settings, 'ann_nprobe', 0)))
+        self.nprobe_input.setToolTip("Higher values are slower but find more of the true matches")
+        nprobe_layout.addWidget(self.nprobe_input)
+        similarity_layout.addLayout(nprobe_layout)
+
+        # Two-stage search: candidates re-ranked with full embeddings
+        pool_layout = QHBoxLayout()
+        pool_layout.addWidget(QLabel("Candidate Pool (0 = score every track):"))
+        self.candidate_pool_input = QLineEdit()
+        self.candidate_pool_input.setValidator(QIntValidator(*INT_SETTING_RANGES['candidate_pool'], self))
+        self.candidate_pool_input.setText(str(setting_int(self.settings, 'candidate_pool', 0)))
+        self.candidate_pool_input.setToolTip(
+            "Rank the catalog with coarse signatures first and compare only this many "
+            "tracks per song in full (Full Mel Spectrogram format only)"
+        )
+        pool_layout.addWidget(self.candidate_pool_input)
+        similarity_layout.addLayout(pool_layout)
+
         similarity_group.setLayout(similarity_layout)
         layout.addWidget(similarity_group)
 
@@ -187,7 +255,14 @@ class SettingsDialog(QDialog):
         self.settings.setValue('default_bitdepth', self.default_bitdepth.currentText())
         self.settings.setValue('default_bitrate', self.default_bitrate.currentText())
         self.settings.setValue('similarity_threshold', self.threshold_slider.value() / 100.0)
-        self.settings.setValue('max_results', self.max_results_input.text())
+        # Fields left empty or out of range keep the previous value
+        for key, field in [('max_results', self.max_results_input),
+                           ('embedding_workers', self.workers_input),
+                           ('ann_nprobe', self.nprobe_input),
+                           ('candidate_pool', self.candidate_pool_input)]:
+            if field.hasAcceptableInput():
+                self.settings.setValue(key, field.text())
+        self.settings.setValue('embedding_mode', self.embedding_mode_combo.currentData())
         self.settings.sync()
 
     def show_settings(self):
@@ -14,14 +14,16 @@ from pathlib import Path
 import tempfile
 import subprocess
 
-from ui.dialogs.settings_dialog import SettingsDialog
+from ui.dialogs.settings_dialog import SettingsDialog, setting_int
 from ui.dialogs.help_dialog import HelpDialog
 from ui.dialogs.details_dialog import SongDetailsDialog
 from ui.dialogs.mastering_dialog import MasteringOptionsDialog
 from ui.dialogs.comparison_dialog import AudioComparisonDialog
+from ui.dialogs.duplicates_dialog import DuplicatesDialog
 from ui.widgets.audio_player import AudioPlayer
-from core.analyzer import SimilarityThread
-from core.mastering import MasteringThread
+from core.workers import SimilarityThread, BatchSimilarityThread, DuplicateThread, MasteringThread
+from core.duplicates import cluster_rows
+from core.catalog import stop_watching
 from config.theme import COMBINED_STYLE
 
 class MASTWindow(QMainWindow):
@@ -37,13 +39,13 @@ class MASTWindow(QMainWindow):
         
         # Initialize state variables
         self.current_similarities = {}
+        self.batch_results = {}
+        self.duplicate_clusters = []
         self.open_dialogs = []
+        self.retired_threads = []
         
         # Initialize similarity options
-        self.similarity_options = {
-            'threshold': float(self.settings.value('similarity_threshold', 0.5)),
-            'max_results': int(self.settings.value('max_results', 50))
-        }
+        self.load_similarity_options()
         
         # Initialize UI
         self.initUI()
@@ -185,6 +187,32 @@ class MASTWindow(QMainWindow):
         reference_group.setLayout(reference_layout)
         layout.addWidget(reference_group)
 
+        # Batch targets: several songs searched against the catalog in one pass
+        batch_group = QGroupBox("Batch Targets")
+        batch_layout = QVBoxLayout()
+        self.batch_targets_list = QListWidget()
+        self.batch_targets_list.setMaximumHeight(100)
+        self.batch_targets_list.currentRowChanged.connect(self.select_batch_target)
+        batch_layout.addWidget(self.batch_targets_list)
+
+        batch_buttons = QHBoxLayout()
+        add_targets_btn = QPushButton('Add Targets')
+        add_targets_btn.clicked.connect(self.add_batch_targets)
+        batch_buttons.addWidget(add_targets_btn)
+        remove_target_btn = QPushButton('Remove')
+        remove_target_btn.clicked.connect(self.remove_batch_target)
+        batch_buttons.addWidget(remove_target_btn)
+        clear_targets_btn = QPushButton('Clear')
+        clear_targets_btn.clicked.connect(self.clear_batch_targets)
+        batch_buttons.addWidget(clear_targets_btn)
+        batch_compare_btn = QPushButton('Find Similar for All')
+        batch_compare_btn.clicked.connect(self.start_batch_comparison)
+        batch_buttons.addWidget(batch_compare_btn)
+        batch_layout.addLayout(batch_buttons)
+
+        batch_group.setLayout(batch_layout)
+        layout.addWidget(batch_group)
+
         # Directory selection
         dir_layout = QHBoxLayout()
         self.directory_label = QLabel('No directory selected')
@@ -199,6 +227,20 @@ class MASTWindow(QMainWindow):
         compare_btn = QPushButton('Find Similar Songs')
         compare_btn.clicked.connect(self.start_comparison)
         button_layout.addWidget(compare_btn)
+
+        duplicates_btn = QPushButton('Find Duplicates')
+        duplicates_btn.clicked.connect(self.start_duplicate_search)
+        button_layout.addWidget(duplicates_btn)
+
+        self.pause_search_button = QPushButton('Pause')
+        self.pause_search_button.clicked.connect(self.toggle_pause_comparison)
+        self.pause_search_button.setEnabled(False)
+        button_layout.addWidget(self.pause_search_button)
+
+        self.cancel_search_button = QPushButton('Cancel')
+        self.cancel_search_button.clicked.connect(self.cancel_comparison)
+        self.cancel_search_button.setEnabled(False)
+        button_layout.addWidget(self.cancel_search_button)
         layout.addLayout(button_layout)
 
         # Progress bar
@@ -207,6 +249,9 @@ class MASTWindow(QMainWindow):
 
         # Results list
         self.similar_songs_list = QListWidget()
+        # Connected once so streamed partial results are selectable right away
+        self.similar_songs_list.itemSelectionChanged.connect(self.update_play_button)
+        self.similar_songs_list.itemDoubleClicked.connect(self.show_song_details)
         layout.addWidget(self.similar_songs_list)
 
         # Control buttons
@@ -229,9 +274,16 @@ class MASTWindow(QMainWindow):
         layout.addLayout(controls_layout)
 
         # Mastering progress
+        mastering_layout = QHBoxLayout()
         self.mastering_progress = QProgressBar()
         self.mastering_progress.hide()
-        layout.addWidget(self.mastering_progress)
+        mastering_layout.addWidget(self.mastering_progress)
+
+        self.cancel_mastering_button = QPushButton('Cancel Mastering')
+        self.cancel_mastering_button.clicked.connect(self.cancel_mastering)
+        self.cancel_mastering_button.hide()
+        mastering_layout.addWidget(self.cancel_mastering_button)
+        layout.addLayout(mastering_layout)
 
         # Export button
         export_btn = QPushButton('Export Results')
@@ -283,6 +335,8 @@ class MASTWindow(QMainWindow):
             self.music_directory or ''
         )
         if directory:
+            if self.music_directory and directory != self.music_directory:
+                stop_watching(self.music_directory)
             self.music_directory = directory
             self.directory_label.setText(f'Selected: {directory}')
 
@@ -327,10 +381,17 @@ class MASTWindow(QMainWindow):
             if self.music_directory:
                 self.directory_label.setText(f'Selected: {self.music_directory}')
             
-            self.similarity_options = {
-                'threshold': float(self.settings.value('similarity_threshold', 0.5)),
-                'max_results': int(self.settings.value('max_results', 50))
-            }     
+            self.load_similarity_options()
+
+    def load_similarity_options(self):
+        self.similarity_options = {
+            'threshold': float(self.settings.value('similarity_threshold', 0.5)),
+            'max_results': setting_int(self.settings, 'max_results', 50),
+            'workers': setting_int(self.settings, 'embedding_workers', 0),
+            'nprobe': setting_int(self.settings, 'ann_nprobe', 0),
+            'candidate_pool': setting_int(self.settings, 'candidate_pool', 0),
+            'embedding_mode': self.settings.value('embedding_mode', 'mel')
+        }
 
     def show_help(self):
         dialog = HelpDialog(self)
@@ -345,7 +406,7 @@ class MASTWindow(QMainWindow):
         dialog.max_results_input.setText(str(self.similarity_options['max_results']))
         
         if dialog.exec_():
-            self.similarity_options = dialog.get_options()
+            self.similarity_options.update(dialog.get_options())
 
     def update_master_button(self):
         self.master_button.setEnabled(bool(self.song_to_master and self.reference_song))
@@ -359,6 +420,10 @@ class MASTWindow(QMainWindow):
             QMessageBox.warning(self, "Error", "Please select both a song to master and a music directory")
             return
 
+        # A new search supersedes the previous one
+        self.cancel_comparison()
+
+        self.batch_results = {}
         self.similar_songs_list.clear()
         self.progress_bar.setValue(0)
 
@@ -366,33 +431,200 @@ class MASTWindow(QMainWindow):
             self.song_to_master,
             self.music_directory,
             self.similarity_options['threshold'],
-            self.similarity_options['max_results']
+            self.similarity_options['max_results'],
+            workers=self.similarity_options.get('workers') or None,
+            nprobe=self.similarity_options.get('nprobe', 0),
+            embedding_mode=self.similarity_options.get('embedding_mode', 'mel'),
+            watch=True,
+            candidate_pool=self.similarity_options.get('candidate_pool', 0)
         )
         self.comparison_thread.update_progress.connect(self.progress_bar.setValue)
+        self.comparison_thread.partial_results.connect(self.update_similar_songs)
         self.comparison_thread.comparison_complete.connect(self.show_similar_songs)
         self.comparison_thread.error_occurred.connect(
             lambda msg: QMessageBox.critical(self, "Error", msg)
         )
+        self.comparison_thread.finished.connect(self.comparison_finished)
         self.comparison_thread.start()
+        self.pause_search_button.setText('Pause')
+        self.pause_search_button.setEnabled(True)
+        self.cancel_search_button.setEnabled(True)
 
-    def show_similar_songs(self, similarities):
-        self.current_similarities = similarities
+    def add_batch_targets(self):
+        file_paths, _ = QFileDialog.getOpenFileNames(
+            self, 'Select Songs to Master', '',
+            'Audio Files (*.mp3 *.wav *.aif *.flac *.m4a *.ogg)'
+        )
+        existing = self.batch_targets()
+        for file_path in file_paths:
+            if file_path not in existing:
+                item = QListWidgetItem(os.path.basename(file_path))
+                item.setData(Qt.UserRole, file_path)
+                self.batch_targets_list.addItem(item)
+
+    def remove_batch_target(self):
+        row = self.batch_targets_list.currentRow()
+        if row >= 0:
+            self.batch_targets_list.takeItem(row)
+
+    def clear_batch_targets(self):
+        self.batch_targets_list.clear()
+
+    def batch_targets(self):
+        return [
+            self.batch_targets_list.item(row).data(Qt.UserRole)
+            for row in range(self.batch_targets_list.count())
+        ]
+
+    def select_batch_target(self, row):
+        """Make the chosen target the song to master and show its matches"""
+        item = self.batch_targets_list.item(row)
+        if item is None:
+            return
+        file_path = item.data(Qt.UserRole)
+        if file_path != self.song_to_master:
+            self.song_to_master = file_path
+            self.song_to_master_label.setText(f'Selected: {os.path.basename(file_path)}')
+            self.master_player.loadFile(file_path)
+            self.update_master_button()
+        if self.batch_results:
+            self.update_similar_songs(self.batch_results.get(file_path, {}))
+
+    def start_batch_comparison(self):
+        targets = self.batch_targets()
+        if not targets or not self.music_directory:
+            QMessageBox.warning(self, "Error", "Please add target songs and select a music directory")
+            return
+
+        self.cancel_comparison()
+
+        self.batch_results = {}
         self.similar_songs_list.clear()
-        
-        for song_path, similarity in similarities.items():
-            item = QListWidgetItem(
-                f"{os.path.basename(song_path)} (Similarity: {similarity:.4f})"
-            )
-            self.similar_songs_list.addItem(item)
-        
-        try:
-            self.similar_songs_list.itemSelectionChanged.disconnect()
-            self.similar_songs_list.itemDoubleClicked.disconnect()
-        except:
-            pass
-            
-        self.similar_songs_list.itemSelectionChanged.connect(self.update_play_button)
-        self.similar_songs_list.itemDoubleClicked.connect(self.show_song_details)
+        self.progress_bar.setValue(0)
+
+        self.comparison_thread = BatchSimilarityThread(
+            targets,
+            self.music_directory,
+            threshold=self.similarity_options['threshold'],
+            max_results=self.similarity_options['max_results'],
+            workers=self.similarity_options.get('workers') or None,
+            nprobe=self.similarity_options.get('nprobe', 0),
+            embedding_mode=self.similarity_options.get('embedding_mode', 'mel'),
+            watch=True,
+            candidate_pool=self.similarity_options.get('candidate_pool', 0)
+        )
+        self.comparison_thread.update_progress.connect(self.progress_bar.setValue)
+        self.comparison_thread.partial_results.connect(self.update_batch_results)
+        self.comparison_thread.comparison_complete.connect(self.update_batch_results)
+        self.comparison_thread.error_occurred.connect(
+            lambda msg: QMessageBox.critical(self, "Error", msg)
+        )
+        self.comparison_thread.finished.connect(self.comparison_finished)
+        self.comparison_thread.start()
+        self.pause_search_button.setText('Pause')
+        self.pause_search_button.setEnabled(True)
+        self.cancel_search_button.setEnabled(True)
+        if self.batch_targets_list.currentRow() < 0:
+            self.batch_targets_list.setCurrentRow(0)
+
+    def update_batch_results(self, results):
+        """Store {target: {path: distance}} and show the selected target's matches"""
+        self.batch_results = results
+        item = self.batch_targets_list.currentItem()
+        if item is not None:
+            self.update_similar_songs(results.get(item.data(Qt.UserRole), {}))
+
+    def start_duplicate_search(self):
+        if not self.music_directory:
+            QMessageBox.warning(self, "Error", "Please select a music directory")
+            return
+
+        self.cancel_comparison()
+        self.progress_bar.setValue(0)
+
+        self.comparison_thread = DuplicateThread(
+            self.music_directory,
+            workers=self.similarity_options.get('workers') or None,
+            embedding_mode=self.similarity_options.get('embedding_mode', 'mel')
+        )
+        self.comparison_thread.update_progress.connect(self.progress_bar.setValue)
+        self.comparison_thread.duplicates_found.connect(self.show_duplicates)
+        self.comparison_thread.error_occurred.connect(
+            lambda msg: QMessageBox.critical(self, "Error", msg)
+        )
+        self.comparison_thread.finished.connect(self.comparison_finished)
+        self.comparison_thread.start()
+        self.pause_search_button.setText('Pause')
+        self.pause_search_button.setEnabled(True)
+        self.cancel_search_button.setEnabled(True)
+
+    def show_duplicates(self, clusters):
+        self.duplicate_clusters = clusters
+        dialog = DuplicatesDialog(clusters, self.music_directory, self)
+        dialog.setStyleSheet(self.styleSheet())
+        self.open_dialogs.append(dialog)
+        dialog.finished.connect(lambda: self.open_dialogs.remove(dialog))
+        dialog.show()
+
+    def cancel_comparison(self):
+        thread = getattr(self, 'comparison_thread', None)
+        if thread is None or not thread.isRunning():
+            return
+        # Detach the old thread so late results cannot overwrite a newer search,
+        # and keep a reference until it has actually stopped
+        if isinstance(thread, DuplicateThread):
+            signals = (thread.update_progress, thread.duplicates_found, thread.error_occurred)
+        else:
+            signals = (thread.update_progress, thread.partial_results, thread.comparison_complete,
+                       thread.error_occurred)
+        for signal in signals:
+            signal.disconnect()
+        thread.cancel()
+        self.retired_threads.append(thread)
+        thread.finished.connect(lambda: self.retired_threads.remove(thread))
+        self.pause_search_button.setEnabled(False)
+        self.cancel_search_button.setEnabled(False)
+
+    def toggle_pause_comparison(self):
+        thread = getattr(self, 'comparison_thread', None)
+        if thread is None or not thread.isRunning():
+            return
+        if thread.token.is_paused:
+            thread.resume()
+            self.pause_search_button.setText('Pause')
+        else:
+            thread.pause()
+            self.pause_search_button.setText('Resume')
+
+    def comparison_finished(self):
+        if self.sender() is getattr(self, 'comparison_thread', None):
+            self.pause_search_button.setText('Pause')
+            self.pause_search_button.setEnabled(False)
+            self.cancel_search_button.setEnabled(False)
+
+    def update_similar_songs(self, similarities):
+        """Refresh the results list in place, keeping the current selection"""
+        self.current_similarities = similarities
+        current_item = self.similar_songs_list.currentItem()
+        selected_text = current_item.text().split(' (Similarity:')[0] if current_item else None
+
+        self.similar_songs_list.setUpdatesEnabled(False)
+        for row, (song_path, similarity) in enumerate(similarities.items()):
+            text = f"{os.path.basename(song_path)} (Similarity: {similarity:.4f})"
+            item = self.similar_songs_list.item(row)
+            if item is None:
+                item = QListWidgetItem(text)
+                self.similar_songs_list.addItem(item)
+            elif item.text() != text:
+                item.setText(text)
+            if os.path.basename(song_path) == selected_text:
+                self.similar_songs_list.setCurrentItem(item)
+        while self.similar_songs_list.count() > len(similarities):
+            self.similar_songs_list.takeItem(self.similar_songs_list.count() - 1)
+        self.similar_songs_list.setUpdatesEnabled(True)
+
+    def show_similar_songs(self, similarities):
+        self.update_similar_songs(similarities)
       
     def play_selected_song(self):
         current_item = self.similar_songs_list.currentItem()
@@ -438,11 +670,22 @@ class MASTWindow(QMainWindow):
         self.mastering_progress.hide()
         self.update_play_button()
 
+    def cancel_mastering(self):
+        if hasattr(self, 'mastering_thread') and self.mastering_thread.isRunning():
+            self.mastering_thread.cancel()
+            self.cancel_mastering_button.setEnabled(False)
+
+    def mastering_stopped(self):
+        self.mastering_progress.hide()
+        self.cancel_mastering_button.hide()
+        self.update_master_button()
+        self.update_play_button()
+
     def mastering_finished(self):
         self.update_play_button()
         self.mastering_progress.hide()
         
-        output_path = str(Path(self.song_to_master).parent)
+        output_path = str(Path(self.mastering_thread.output_path).parent)
         
         # Show completion message
         QMessageBox.information(
@@ -523,6 +766,8 @@ class MASTWindow(QMainWindow):
         # Show mastering progress
         self.mastering_progress.show()
         self.mastering_progress.setValue(0)
+        self.cancel_mastering_button.setEnabled(True)
+        self.cancel_mastering_button.show()
         
         # Disable buttons during processing
         self.master_button.setEnabled(False)
@@ -536,12 +781,23 @@ class MASTWindow(QMainWindow):
             options=mastering_options
         )
         self.mastering_thread.progress_updated.connect(self.update_mastering_progress)
-        self.mastering_thread.finished.connect(self.mastering_finished)
+        self.mastering_thread.mastering_complete.connect(self.mastering_finished)
+        self.mastering_thread.finished.connect(self.mastering_stopped)
         self.mastering_thread.error_occurred.connect(self.show_mastering_error)
         self.mastering_thread.start()    
         
+    def closeEvent(self, event):
+        """Stop background work so no worker outlives the window"""
+        self.cancel_comparison()
+        self.cancel_mastering()
+        for thread in list(self.retired_threads) + [getattr(self, 'mastering_thread', None)]:
+            if thread is not None:
+                thread.wait()
+        stop_watching()
+        super().closeEvent(event)
+
     def export_results(self):
-        if not self.current_similarities:
+        if not self.current_similarities and not self.batch_results:
             QMessageBox.warning(self, "Export Failed", "No results to export")
             return
 
@@ -553,6 +809,8 @@ class MASTWindow(QMainWindow):
         )
 
         if file_path:
+            # A batch search exports every target's matches in one file
+            results = self.batch_results or {self.song_to_master: self.current_similarities}
             try:
                 with open(file_path, 'w', newline='', encoding='utf-8') as f:
                     writer = csv.writer(f)
@@ -563,15 +821,16 @@ class MASTWindow(QMainWindow):
                         'Compared Full Path', 
                         'Similarity Score'
                     ])
-                    ref_name = os.path.basename(self.song_to_master)
-                    for song_path, similarity in self.current_similarities.items():
-                        writer.writerow([
-                            ref_name,
-                            self.song_to_master,
-                            os.path.basename(song_path),
-                            song_path,
-                            f"{similarity:.4f}"
-                        ])
+                    for target_path, similarities in results.items():
+                        ref_name = os.path.basename(target_path)
+                        for song_path, similarity in similarities.items():
+                            writer.writerow([
+                                ref_name,
+                                target_path,
+                                os.path.basename(song_path),
+                                song_path,
+                                f"{similarity:.4f}"
+                            ])
                 QMessageBox.information(
                     self,
                     "Success",
@@ -583,3 +842,48 @@ class MASTWindow(QMainWindow):
                     "Export Failed",
                     f"Error exporting results: {str(e)}"
                 )
+
+    def export_duplicates(self):
+        if not self.duplicate_clusters:
+            QMessageBox.warning(self, "Export Failed", "No duplicates to export")
+            return
+
+        file_path, _ = QFileDialog.getSaveFileName(
+            self,
+            'Export Duplicates',
+            f'mast_duplicates_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv',
+            'CSV Files (*.csv)'
+        )
+
+        if file_path:
+            try:
+                with open(file_path, 'w', newline='', encoding='utf-8') as f:
+                    writer = csv.writer(f)
+                    writer.writerow([
+                        'Group',
+                        'Song',
+                        'Full Path',
+                        'Format',
+                        'Size (bytes)',
+                        'Distance'
+                    ])
+                    for row in cluster_rows(self.duplicate_clusters):
+                        writer.writerow([
+                            row['cluster'],
+                            row['name'],
+                            row['path'],
+                            row['format'],
+                            row['size'] if row['size'] is not None else '',
+                            f"{row['distance']:.4f}"
+                        ])
+                QMessageBox.information(
+                    self,
+                    "Success",
+                    f"Duplicates exported to {file_path}"
+                )
+            except Exception as e:
+                QMessageBox.critical(
+                    self,
+                    "Export Failed",
+                    f"Error exporting duplicates: {str(e)}"
+                )
@@ -5,7 +5,87 @@ import numpy as np
 import librosa
 import librosa.display
 
-class WaveformVisualizer(QWidget):
+# Plots are capped at about screen resolution: drawing every sample or STFT
+# frame of a full track takes seconds and looks the same
+MAX_WAVEFORM_POINTS = 4000
+MAX_SPECTROGRAM_SIZE = (512, 1000)  # frequency rows, time columns
+
+
+def waveform_envelope(audio_data, sr, max_points=MAX_WAVEFORM_POINTS):
+    """
+    (times, lower, upper): the min/max envelope of audio_data in at most
+    max_points steps. Short signals come back unchanged, with lower is upper.
+    """
+    audio_data = np.asarray(audio_data)
+    if len(audio_data) <= max_points:
+        return np.arange(len(audio_data)) / sr, audio_data, audio_data
+    step = int(np.ceil(len(audio_data) / max_points))
+    usable = len(audio_data) // step * step
+    blocks = audio_data[:usable].reshape(-1, step)
+    times = np.arange(len(blocks)) * step / sr
+    return times, blocks.min(axis=1), blocks.max(axis=1)
+
+
+def _max_pool(spec_data, factor, axis):
+    if factor <= 1:
+        return spec_data
+    usable = spec_data.shape[axis] // factor * factor
+    spec_data = spec_data[:usable] if axis == 0 else spec_data[:, :usable]
+    shape = list(spec_data.shape)
+    shape[axis:axis + 1] = [usable // factor, factor]
+    return spec_data.reshape(shape).max(axis=axis + 1)
+
+
+def reduce_spectrogram(spec_data, sr, hop_length=512, max_size=MAX_SPECTROGRAM_SIZE):
+    """
+    (spec, frequencies, times) with spec max-pooled to at most max_size, so
+    peaks and transients stay visible; frequencies and times label its cells.
+    """
+    rows, columns = spec_data.shape
+    row_factor = int(np.ceil(rows / max_size[0]))
+    column_factor = int(np.ceil(columns / max_size[1]))
+    frequencies = librosa.fft_frequencies(sr=sr, n_fft=2 * (rows - 1))
+    times = librosa.frames_to_time(np.arange(columns), sr=sr, hop_length=hop_length)
+    spec_data = _max_pool(_max_pool(spec_data, row_factor, 0), column_factor, 1)
+    return spec_data, frequencies[::row_factor][:spec_data.shape[0]], times[::column_factor][:spec_data.shape[1]]
+
+def clip_spans(regions, sr, duration, max_spans=MAX_WAVEFORM_POINTS):
+    """
+    (start, width) pairs in seconds marking the clipping regions of
+    core.clipping on a waveform plot. Regions of every channel are merged
+    wherever they fall within one of max_spans steps of each other, and each
+    span is at least one step wide so single clipped samples stay visible.
+    """
+    regions = np.asarray(regions)
+    if not len(regions):
+        return []
+    step = max(duration / max_spans, 1.0 / sr)
+    order = np.argsort(regions[:, 1], kind='stable')
+    starts = regions[order, 1] / sr
+    ends = np.maximum(starts + regions[order, 2] / sr, starts + step)
+    reach = np.maximum.accumulate(ends)
+    first = np.concatenate([[True], starts[1:] > reach[:-1] + step])
+    span_starts = starts[first]
+    span_ends = np.maximum.reduceat(ends, np.flatnonzero(first))
+    return list(zip(span_starts.tolist(), (span_ends - span_starts).tolist()))
+
+
+class _PlotWidget(QWidget):
+    """Defers redrawing a hidden plot (e.g. on another tab) until it is shown"""
+
+    def _refresh(self):
+        if self.isVisible():
+            self.canvas.draw_idle()
+        else:
+            self._stale = True
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if getattr(self, '_stale', False):
+            self._stale = False
+            self.canvas.draw_idle()
+
+class WaveformVisualizer(_PlotWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.figure, self.ax = plt.subplots()
@@ -14,6 +94,7 @@ class WaveformVisualizer(QWidget):
         layout.addWidget(self.canvas)
         self.setLayout(layout)
         self._style_plot()
+        self.figure.tight_layout()
 
     def _style_plot(self):
         self.figure.patch.set_facecolor('#1A365D')
@@ -23,21 +104,38 @@ class WaveformVisualizer(QWidget):
         self.ax.set_ylabel('Amplitude', color='#E2E8F0')
         for spine in self.ax.spines.values():
             spine.set_color('#4299E1')
-        self.figure.tight_layout()
 
     def plot_waveform(self, audio_data, sr):
+        """Plot a signal, or a (times, lower, upper) envelope from waveform_envelope"""
         self.ax.clear()
-        times = np.linspace(0, len(audio_data)/sr, len(audio_data))
-        self.ax.plot(times, audio_data, color='#4299E1', linewidth=0.5)
+        if isinstance(audio_data, tuple):
+            times, lower, upper = audio_data
+        else:
+            times, lower, upper = waveform_envelope(audio_data, sr)
+        if lower is upper:
+            self.ax.plot(times, lower, color='#4299E1', linewidth=0.5)
+        else:
+            # A filled band draws far faster than a line zig-zagging between the extremes
+            self.ax.fill_between(times, lower, upper, color='#4299E1', linewidth=0)
+        if len(times):
+            self.ax.set_xlim(times[0], times[-1])
         self._style_plot()
-        self.canvas.draw()
+        self._refresh()
+
+    def plot_clipping(self, spans):
+        """Mark clipping over the plotted waveform with (start, width) spans from clip_spans"""
+        if spans:
+            low, high = self.ax.get_ylim()
+            self.ax.broken_barh(spans, (low, high - low), facecolors='#F56565', alpha=0.35, linewidth=0)
+            self.ax.set_ylim(low, high)
+            self._refresh()
         
     def clear(self):
         self.ax.clear()
         self._style_plot()
-        self.canvas.draw()
+        self._refresh()
 
-class SpectrogramVisualizer(QWidget):
+class SpectrogramVisualizer(_PlotWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.figure, self.ax = plt.subplots()
@@ -45,36 +143,43 @@ class SpectrogramVisualizer(QWidget):
         layout = QVBoxLayout()
         layout.addWidget(self.canvas)
         self.setLayout(layout)
+        # The image and colorbar are built (and laid out) once, then updated in place
+        self.image = self.ax.imshow(
+            np.full((2, 2), np.nan), origin='lower', aspect='auto',
+            interpolation='nearest', cmap='coolwarm'
+        )
+        self.colorbar = self.figure.colorbar(self.image, ax=self.ax, format='%+2.0f dB')
         self._style_plot()
+        self.figure.tight_layout()
 
     def _style_plot(self):
         self.figure.patch.set_facecolor('#1A365D')
         self.ax.set_facecolor('#2D3748')
         self.ax.tick_params(colors='#E2E8F0', labelsize=8)
-        self.ax.set_xlabel('Time', color='#E2E8F0')
+        self.ax.set_xlabel('Time (s)', color='#E2E8F0')
         self.ax.set_ylabel('Frequency (Hz)', color='#E2E8F0')
         for spine in self.ax.spines.values():
             spine.set_color('#4299E1')
-        self.figure.tight_layout()
 
-    def plot_spectrogram(self, spec_data, sr):
-        self.ax.clear()
-        img = librosa.display.specshow(
-            spec_data,
-            sr=sr,
-            x_axis='time',
-            y_axis='hz',
-            ax=self.ax,
-            cmap='coolwarm'
-        )
-        self.colorbar = self.figure.colorbar(img, ax=self.ax, format='%+2.0f dB')
-        self._style_plot()
-        self.canvas.draw()
+    def plot_spectrogram(self, spec_data, sr, hop_length=512):
+        """Plot a dB spectrogram, or a (spec, frequencies, times) tuple from reduce_spectrogram"""
+        if isinstance(spec_data, tuple):
+            spec_data, frequencies, times = spec_data
+        else:
+            spec_data, frequencies, times = reduce_spectrogram(spec_data, sr, hop_length)
+        # A plain image of the reduced grid draws several times faster than specshow's mesh
+        extent = [times[0], times[-1], frequencies[0], frequencies[-1]]
+        self.image.set_data(spec_data)
+        self.image.set_extent(extent)
+        self.image.set_clim(np.min(spec_data), np.max(spec_data))
+        self.ax.set_xlim(extent[:2])
+        self.ax.set_ylim(extent[2:])
+        self.colorbar.update_normal(self.image)
+        self._refresh()
                 
     def clear(self):
-        self.ax.clear()
-        self._style_plot()
-        self.canvas.draw()
+        self.image.set_data(np.full((2, 2), np.nan))
+        self._refresh()
 
 class ComparisonVisualizer(QWidget):
     def __init__(self, parent=None):